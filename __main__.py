@@ -1,22 +1,49 @@
 import os
 import uvicorn
 import openai
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-# from fastapi.responses import EventSourceResponse
-from pydantic import BaseModel 
-from typing import List, Any, Dict, Optional
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel, TypeAdapter, ValidationError, create_model
+from typing import List, Any, AsyncIterator, Dict, Literal, NamedTuple, Optional, Type
 from typing import Mapping
 from string import Template
 from dotenv import load_dotenv
-import json
-import ollama
+import io
+import asyncio
 import time
+import ollama
+import itertools
+import traceback
+from contextvars import ContextVar
+
+from utils.cache import SAMPLING_FIELDS, ResponseCache, build_response_cache
+from utils.prompts import PromptRegistry
+from utils.patterns import PatternSpec
+from utils.http_pool import ProviderPool
+from utils.admission import AdmissionController, parse_model_limits
+from utils.engines import EngineRegistry, OllamaEngine, OpenAIEngine, clean_llm_output
+from utils.tgi import TGI_MODEL_NAME, TGIEngine, probe_tgi
+from utils.singleflight import SingleFlight
+from utils.session_store import PayloadTooLarge, build_session_store
+from utils.structured_output import (
+    JsonObjectExtractor, StructuredOutputError, build_repair_prompt, parse_structured_output
+)
+from utils.examples import ExampleIndex
+from utils.tokens import TokenCounter, parse_model_budgets
+from utils.candidates import candidates_instruction, candidates_schema, parse_candidates, rank_candidates
+from utils.ontology import PATTERNS, OntologyParseError, detect_format, parse_ontology
+from utils.jobs import FINISHED_STATES, JobWorker, build_job_store
+from utils.hedging import HedgePolicy, LatencyTracker, parse_hedge_models, race
+from utils.warmup import OllamaWarmer, parse_keep_alive
+from utils.generation_store import build_generation_store, iter_jsonl, make_record, write_parquet
+from utils import fast_json, metrics
 
 load_dotenv()
-HOST = os.getenv("HOST")
-PORT = int(os.getenv("PORT"))
-ORIGINS = os.getenv("ALLOWED_ORIGINS").split(",")
+HOST = os.getenv("HOST", "127.0.0.1")
+PORT = int(os.getenv("PORT", "8000"))
+ORIGINS = os.getenv("ALLOWED_ORIGINS", "*").split(",")
 
 #app = FastAPI(title="Ontology Patterns Backend")
 app = FastAPI(
@@ -26,7 +53,10 @@ app = FastAPI(
     redoc_url=None,
     openapi_url="/api/openapi.json",   # ← include the prefix
     root_path="/api",                  # ← lets FastAPI inject the right URLs
+    default_response_class=fast_json.JSON_RESPONSE_CLASS,
 )
+# Request bodies parsed with orjson when installed (see utils/fast_json.py)
+app.router.route_class = fast_json.FastJSONRoute
 
 app.add_middleware(
     CORSMiddleware,
@@ -36,27 +66,39 @@ app.add_middleware(
     allow_headers=["*"],  # Allow all headers
 )
 
-# do not touch
-_temp_localstorage_data = {}
-
-def _set_temp_localstorage_data(uuid: str, data: Any):
-    _temp_localstorage_data.setdefault(uuid, data)
-
-def _get_temp_localstorage_data(uuid: str):
-    try:
-        data = _temp_localstorage_data[uuid]
-        del _temp_localstorage_data[uuid]
-        return data
-    except:
-        return None
+# -----------------------------
+# Session hand-off store Setup
+# -----------------------------
+# Backs /_temp_localstorage_data; use SESSION_STORE_BACKEND=redis to share it between workers
+session_store = build_session_store(
+    backend=os.getenv("SESSION_STORE_BACKEND", "memory"),
+    ttl=float(os.getenv("SESSION_STORE_TTL", "300")),
+    max_bytes=int(os.getenv("SESSION_STORE_MAX_BYTES", str(64 * 1024 * 1024))),
+    max_entry_bytes=int(os.getenv("SESSION_STORE_MAX_ENTRY_BYTES", str(16 * 1024 * 1024))),
+    redis_url=os.getenv("REDIS_URL"),
+)
+SESSION_WAIT_TIMEOUT = float(os.getenv("SESSION_WAIT_TIMEOUT", "10"))
 
 # -----------------------------
 # Ollama Setup
 # -----------------------------
 
-ollama = ollama.Client(
-    host="https://llm.vse.cz/ollama"
-)
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "https://llm.vse.cz/ollama")
+# Keep-alive connection pool, tuned via OLLAMA_POOL_* / OLLAMA_*_TIMEOUT / OLLAMA_HTTP2
+ollama_pool = ProviderPool("ollama")
+
+# Clients are built on first use (inside the worker), not at import
+def build_ollama_client() -> ollama.Client:
+    return ollama.Client(
+        host=OLLAMA_HOST,
+        **ollama_pool.client_kwargs(asynchronous=False)
+    )
+
+def build_ollama_async_client() -> ollama.AsyncClient:
+    return ollama.AsyncClient(
+        host=OLLAMA_HOST,
+        **ollama_pool.client_kwargs(asynchronous=True)
+    )
 
 # -----------------------------
 # OPENAI Setup
@@ -65,6 +107,156 @@ openai_api_key = os.getenv("OPENAI_API_KEY", "")
 if not openai_api_key:
     print("Warning: OPENAI_API_KEY not found in environment!")
 openai.api_key = openai_api_key
+# Keep-alive connection pool, tuned via OPENAI_POOL_* / OPENAI_*_TIMEOUT / OPENAI_HTTP2
+openai_pool = ProviderPool("openai")
+
+def build_openai_client():
+    """The global `openai` module client, pointed at the pool."""
+    if not openai_api_key:
+        return None
+    openai.http_client = openai_pool.sync_client()
+    openai.timeout = openai_pool.config.timeout
+    return openai
+
+def build_openai_async_client() -> Optional[openai.AsyncOpenAI]:
+    # AsyncOpenAI refuses to be constructed without a key, the endpoints report it per request
+    if not openai_api_key:
+        return None
+    return openai.AsyncOpenAI(
+        api_key=openai_api_key,
+        http_client=openai_pool.async_client(),
+        timeout=openai_pool.config.timeout,
+        max_retries=0  # retried by the engine's admission controller, honoring Retry-After
+    )
+
+# -----------------------------
+# Prompt registry Setup
+# -----------------------------
+prompt_registry = PromptRegistry(os.getenv("PROMPTS_DIR", "./prompts"))
+
+@app.on_event("startup")
+def start_prompt_watcher():
+    prompt_registry.start_watching(float(os.getenv("PROMPTS_RELOAD_INTERVAL", "5")))
+
+@app.on_event("shutdown")
+def stop_prompt_watcher():
+    prompt_registry.stop_watching()
+
+# -----------------------------
+# Response cache Setup
+# -----------------------------
+response_cache = build_response_cache(
+    backend=os.getenv("RESPONSE_CACHE_BACKEND", "memory"),
+    maxsize=int(os.getenv("RESPONSE_CACHE_MAXSIZE", "1024")),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", "3600")),
+    redis_url=os.getenv("REDIS_URL"),
+)
+
+# -----------------------------
+# Generation store Setup
+# -----------------------------
+# Opt-in: every provider-answered generation is appended here; with GENERATION_STORE_WARM the
+# generate endpoints answer repeatable requests from it after a restart
+generation_store = build_generation_store(
+    backend=os.getenv("GENERATION_STORE_BACKEND", "off"),
+    path=os.getenv("GENERATION_STORE_PATH", "generations.sqlite3"),
+    mongo_url=os.getenv("MONGO_URL"),
+    max_rows=int(os.getenv("GENERATION_STORE_MAX_ROWS", "0")),
+    retention=float(os.getenv("GENERATION_STORE_RETENTION", str(30 * 24 * 3600))),
+)
+GENERATION_STORE_WARM = os.getenv("GENERATION_STORE_WARM", "true").lower() in ("1", "true", "yes")
+
+# Per-request provenance of the answer (provider latency, tokens), filled in along the call chain
+generation_trace: ContextVar[Optional[Dict[str, Any]]] = ContextVar("generation_trace", default=None)
+
+# -----------------------------
+# Request coalescing Setup
+# -----------------------------
+# Identical concurrent generations share one provider call
+single_flight = SingleFlight() if os.getenv("REQUEST_COALESCING", "true").lower() in ("1", "true", "yes") else None
+
+# -----------------------------
+# Structured output Setup
+# -----------------------------
+# Answers that do not match the output schema are re-asked once instead of failing
+STRUCTURED_OUTPUT_REASK = os.getenv("STRUCTURED_OUTPUT_REASK", "true").lower() in ("1", "true", "yes")
+# Upper bound of `n_candidates` per request
+MAX_CANDIDATES = int(os.getenv("MAX_CANDIDATES", "10"))
+
+# -----------------------------
+# Few-shot Setup
+# -----------------------------
+# Library examples (prompts/<pattern>/examples.jsonl) put into a few-shot prompt when the
+# request sends none
+FEW_SHOT_TOP_K = int(os.getenv("FEW_SHOT_TOP_K", "5"))
+
+# -----------------------------
+# Prompt prefix sharing Setup
+# -----------------------------
+# The shared part of a template (above its `[user]` line) goes out as the system message,
+# so Ollama reuses the KV cache of that prefix across requests (and OpenAI its prompt
+# cache). False sends everything as one user message, for before/after comparisons.
+PROMPT_PREFIX_SHARING = os.getenv("PROMPT_PREFIX_SHARING", "true").lower() in ("1", "true", "yes")
+
+# -----------------------------
+# Token budget Setup
+# -----------------------------
+# Prompts are counted per model after rendering; few-shot examples that do not fit the
+# budget are dropped (least similar first), and Ollama's num_ctx is sized to the prompt
+token_counter = TokenCounter()
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "8192"))
+model_prompt_budgets = parse_model_budgets(os.getenv("MODEL_PROMPT_TOKEN_BUDGETS"))
+
+# -----------------------------
+# Hedged requests Setup
+# -----------------------------
+# Generations on a model listed in HEDGE_MODELS also go to its fallback model when they
+# are slower than the primary's HEDGE_PERCENTILE latency; the first valid answer wins
+HEDGE_REQUESTS = os.getenv("HEDGE_REQUESTS", "false").lower() in ("1", "true", "yes")
+provider_latency = LatencyTracker(window=int(os.getenv("HEDGE_LATENCY_WINDOW", "500")))
+hedged_latency = LatencyTracker(window=int(os.getenv("HEDGE_LATENCY_WINDOW", "500")))
+hedge_policy = HedgePolicy(
+    parse_hedge_models(os.getenv("HEDGE_MODELS")),
+    provider_latency,
+    percentile=float(os.getenv("HEDGE_PERCENTILE", "0.95")),
+    min_samples=int(os.getenv("HEDGE_MIN_SAMPLES", "20")),
+    default_delay=float(os.getenv("HEDGE_DEFAULT_DELAY", "10")),
+    min_delay=float(os.getenv("HEDGE_MIN_DELAY", "0.5")),
+    max_delay=float(os.getenv("HEDGE_MAX_DELAY", "60")),
+)
+
+# -----------------------------
+# Ontology mining Setup
+# -----------------------------
+ONTOLOGY_MAX_BYTES = int(os.getenv("ONTOLOGY_MAX_BYTES", str(64 * 1024 * 1024)))
+# Larger ontologies need an explicit `limit`
+ONTOLOGY_MAX_CANDIDATES = int(os.getenv("ONTOLOGY_MAX_CANDIDATES", "100000"))
+
+# -----------------------------
+# Batch Setup
+# -----------------------------
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "5000"))
+
+# -----------------------------
+# Job queue Setup
+# -----------------------------
+# Long runs (/jobs, /ontology/mine) are persisted as jobs and worked off by a bounded
+# JobWorker pool in separate `python worker.py` processes (./run starts JOB_WORKERS of them),
+# so jobs never compete with interactive requests (JOB_WORKER_IN_PROCESS=true also runs one
+# inside every API worker, for development). Items of a crashed worker are resumed once their
+# lease expires.
+job_store = build_job_store(
+    backend=os.getenv("JOB_STORE_BACKEND", "sqlite"),
+    path=os.getenv("JOB_STORE_PATH", "jobs.sqlite3"),
+    redis_url=os.getenv("REDIS_URL"),
+    retention=float(os.getenv("JOB_RETENTION", str(7 * 86400))),
+    max_attempts=int(os.getenv("JOB_MAX_ATTEMPTS", "3")),
+)
+JOB_WORKER_IN_PROCESS = os.getenv("JOB_WORKER_IN_PROCESS", "false").lower() in ("1", "true", "yes")
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "8"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "0.5"))
+JOB_MAX_ITEMS = int(os.getenv("JOB_MAX_ITEMS", "100000"))
 
 # -----------------------------
 # Model routing Setup
@@ -81,57 +273,304 @@ model_provider_map = {
    "llama-3.3-70b-instruct:q4": "ollama"
 }
 
-#def get_updated_model_provider_map():
-#    new_map = {}
-#    ollama_list = ollama.list()["models"]
-#    print(ollama_list, flush=True)
-#    alfa_ollama_list = sorted(ollama_list, key=lambda m: m["model"])
-#    print(alfa_ollama_list, flush=True)
-#    for model in alfa_ollama_list:
-#        new_map.setdefault(model["model"], "ollama")
-#    print(new_map, flush=True)
-#    new_model_provider_map = {
-#        **base_model_provider_map,
-#        **new_map
-#    }
-#    return new_model_provider_map
-
-class ExampleItem(BaseModel):
-    A_label: str
-    p_label: str
-    B_label: str
-    r_label: Optional[str] = None
-    C_label: str
-    Property: Optional[str] = None     # NEW
-    Subclass: Optional[str] = None   
-
-class Pattern1Request(BaseModel):
-    A_label: str
-    p_label: str
-    B_label: str
-    r_label: str
-    C_label: str
-    use_few_shot: bool
-    few_shot_examples: List[ExampleItem] = []
-    # Additional OpenAI params
-    model_name: str = "gpt-4o"
-    temperature: float = 0.0
-    top_p: float = 1.0
-    frequency_penalty: float = 0.0
-    presence_penalty: float = 0.0
-    #Ollama only
-    repeat_penalty: float = 1.1
-    pattern_name: str = "1_shortcut"
-    output_schema: Optional[Dict[str, Any]] = None
+# -----------------------------
+# Provider engines Setup
+# -----------------------------
+# Every model routes to an engine; per-engine concurrency keeps a slow provider from starving the others
+engine_registry = EngineRegistry(model_provider_map)
+engine_registry.register(OpenAIEngine(
+    client_factory=build_openai_client,
+    async_client_factory=build_openai_async_client,
+    max_concurrency=int(os.getenv("OPENAI_MAX_CONCURRENCY", "16"))
+))
+engine_registry.register(OllamaEngine(
+    client_factory=build_ollama_client,
+    async_client_factory=build_ollama_async_client,
+    max_concurrency=int(os.getenv("OLLAMA_MAX_CONCURRENCY", "4")),
+    token_counter=token_counter,
+    completion_tokens=int(os.getenv("OLLAMA_COMPLETION_TOKENS", "512")),
+    min_num_ctx=int(os.getenv("OLLAMA_MIN_NUM_CTX", "4096")),
+    max_num_ctx=int(os.getenv("OLLAMA_MAX_NUM_CTX", "32768")),
+    keep_alive=parse_keep_alive(os.getenv("OLLAMA_KEEP_ALIVE")),
+    cold_start_seconds=float(os.getenv("OLLAMA_COLD_START_SECONDS", "1")),
+))
+provider_pools = {"openai": openai_pool, "ollama": ollama_pool}
+
+# Per model RPM/TPM buckets, retries with backoff and a circuit breaker per provider,
+# tuned via <PROVIDER>_RPM / _TPM / _MAX_RETRIES / _BREAKER_* and MODEL_RATE_LIMITS
+model_rate_limits = parse_model_limits(os.getenv("MODEL_RATE_LIMITS"))
+for _engine in engine_registry.engines().values():
+    _engine.admission = AdmissionController(_engine.name, model_limits=model_rate_limits)
+
+async def register_optional_engines():
+    tgi_host = os.getenv("TGI_HOST", "")
+    if tgi_host:
+        info = await probe_tgi(tgi_host)
+        if info is not None:
+            print("Success connecting to Text Generation Inference API. Info:", info)
+            provider_pools["tgi"] = ProviderPool("tgi")
+            tgi_engine = TGIEngine(tgi_host, provider_pools["tgi"], max_concurrency=int(os.getenv("TGI_MAX_CONCURRENCY", "4")))
+            tgi_engine.usage_observer = record_usage
+            tgi_engine.admission = AdmissionController("tgi", model_limits=model_rate_limits)
+            engine_registry.register(tgi_engine, models=[os.getenv("TGI_MODEL_NAME", TGI_MODEL_NAME)])
+
+    if os.getenv("DISCOVER_MODELS", "false").lower() in ("1", "true", "yes"):
+        discovered = await engine_registry.discover_models()
+        print(f"Discovered models: {discovered}", flush=True)
+
+# -----------------------------
+# Ollama warm-up Setup
+# -----------------------------
+# Preloads the Ollama models at startup and keeps the ones with recent traffic loaded
+OLLAMA_WARMUP_MODELS = [name.strip() for name in os.getenv("OLLAMA_WARMUP_MODELS", "").split(",") if name.strip()]
+
+def ollama_warmup_models() -> List[str]:
+    if OLLAMA_WARMUP_MODELS:
+        return OLLAMA_WARMUP_MODELS
+    return [model for model, provider in engine_registry.model_map.items() if provider == "ollama"]
+
+ollama_warmer = OllamaWarmer(
+    engine_registry.engines()["ollama"],
+    ollama_warmup_models,
+    interval=float(os.getenv("OLLAMA_WARMUP_INTERVAL", "60")),
+    hot_window=float(os.getenv("OLLAMA_HOT_WINDOW", "1800")),
+    preload=os.getenv("OLLAMA_PRELOAD", "true").lower() in ("1", "true", "yes"),
+) if os.getenv("OLLAMA_WARMUP", "true").lower() in ("1", "true", "yes") else None
+
+_background_tasks = set()
+
+def run_in_background(coro):
+    """Start a task that must not delay startup, keeping a reference until it is done."""
+    task = asyncio.ensure_future(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+@app.on_event("startup")
+async def preload_tokenizers():
+    # tiktoken downloads its encodings on first use; counts are estimated until they are loaded
+    run_in_background(asyncio.to_thread(token_counter.preload, list(engine_registry.model_map)))
+
+@app.on_event("startup")
+async def start_engine_discovery():
+    # Network probes run after the worker is serving, not in its startup path
+    run_in_background(register_optional_engines())
+
+@app.on_event("startup")
+def start_model_warmer():
+    if ollama_warmer is not None:
+        ollama_warmer.start()
+
+@app.on_event("shutdown")
+async def stop_model_warmer():
+    if ollama_warmer is not None:
+        await ollama_warmer.stop()
+
+@app.on_event("shutdown")
+async def close_provider_pools():
+    for task in list(_background_tasks):
+        task.cancel()
+    for pool in provider_pools.values():
+        await pool.aclose()
+
+# -----------------------------
+# Metrics Setup
+# -----------------------------
+metrics_registry = metrics.MetricsRegistry()
+STAGE_SECONDS = metrics_registry.histogram(
+    "patterns_generation_stage_seconds",
+    "Time spent per generation stage (prompt_build, provider_call, json_parse).",
+    ["stage", "pattern", "model", "provider"],
+)
+PROVIDER_FAILURES = metrics_registry.counter(
+    "patterns_provider_failures_total", "Failed provider calls.", ["provider", "model"]
+)
+JSON_DECODE_FAILURES = metrics_registry.counter(
+    "patterns_json_decode_failures_total", "LLM answers without a JSON object matching the output schema.",
+    ["pattern", "model", "provider"]
+)
+STRUCTURED_OUTPUT_REPAIRS = metrics_registry.counter(
+    "patterns_structured_output_repairs_total",
+    "Unusable LLM answers repaired locally or by re-asking the provider, by outcome.",
+    ["pattern", "model", "provider", "method", "outcome"],
+)
+FEW_SHOT_TRIMMED = metrics_registry.counter(
+    "patterns_few_shot_examples_trimmed_total", "Few-shot examples dropped to fit the prompt token budget.",
+    ["pattern", "model", "provider"]
+)
+PROMPT_TOKENS = metrics_registry.histogram(
+    "patterns_prompt_tokens", "Rendered prompt size in tokens (counted locally, before the provider call).",
+    ["pattern", "model", "provider"],
+    buckets=(256, 512, 1024, 2048, 4096, 8192, 16384, 32768),
+)
+TOKENS = metrics_registry.counter(
+    "patterns_tokens_total", "Tokens reported by the provider.", ["provider", "model", "kind"]
+)
+HEDGED_GENERATIONS = metrics_registry.counter(
+    "patterns_hedged_generations_total",
+    "Generations with hedging enabled, by outcome (primary_in_time, primary_won, fallback_won, failed).",
+    ["model", "fallback", "outcome"],
+)
+HEDGE_WINNERS = metrics_registry.counter(
+    "patterns_hedge_winners_total", "Provider and model that answered a generation once the fallback was started.",
+    ["provider", "model"]
+)
+HEDGED_GENERATION_SECONDS = metrics_registry.histogram(
+    "patterns_hedged_generation_seconds", "End-to-end time of generations with hedging enabled.", ["model"]
+)
+OLLAMA_DURATION_SECONDS = metrics_registry.histogram(
+    "patterns_ollama_duration_seconds",
+    "Ollama server-side durations per phase (load, prompt_eval, eval).",
+    ["model", "phase"],
+)
+PROMPT_EVAL_SECONDS = metrics_registry.histogram(
+    "patterns_ollama_prompt_eval_seconds",
+    "Ollama prompt evaluation time by prompt layout (shared_prefix, single_message).",
+    ["model", "layout"],
+)
+PROMPT_EVAL_TOKENS = metrics_registry.counter(
+    "patterns_ollama_prompt_eval_tokens_total",
+    "Prompt tokens Ollama evaluated (not served from its prefix cache) by prompt layout.",
+    ["model", "layout"],
+)
+metrics_registry.callback(
+    "patterns_cache_requests_total",
+    "Response cache lookups by result (hit, miss, skipped).",
+    ["result"],
+    lambda: [
+        (("hit",), response_cache.hits), (("miss",), response_cache.misses), (("skipped",), response_cache.skipped)
+    ] if response_cache is not None else [],
+    type="counter",
+)
+metrics_registry.callback(
+    "patterns_generation_store_requests_total",
+    "Generation store lookups by result.",
+    ["result"],
+    lambda: [
+        (("hit",), generation_store.hits), (("miss",), generation_store.misses)
+    ] if generation_store is not None else [],
+    type="counter",
+)
+metrics_registry.callback(
+    "patterns_coalesced_requests_total",
+    "Requests that joined an identical in-flight provider call.",
+    callback=lambda: [((), single_flight.deduplicated)] if single_flight is not None else [],
+    type="counter",
+)
+metrics_registry.callback(
+    "patterns_engine_in_use",
+    "Concurrency slots in use per provider engine.",
+    ["provider"],
+    lambda: [((name,), stats["in_use"]) for name, stats in engine_registry.stats().items()],
+)
+metrics_registry.callback(
+    "patterns_provider_queue_depth",
+    "Calls waiting for rate limit capacity or a concurrency slot per provider engine.",
+    ["provider"],
+    lambda: [
+        ((name,), stats["waiting"] + stats.get("admission", {}).get("queued", 0))
+        for name, stats in engine_registry.stats().items()
+    ],
+)
+metrics_registry.callback(
+    "patterns_admission_rejections_total",
+    "Calls rejected before reaching the provider (rate_limited, circuit_open).",
+    ["provider", "reason"],
+    lambda: [
+        ((name, reason), count)
+        for name, engine in engine_registry.engines().items() if engine.admission is not None
+        for reason, count in engine.admission.rejections.items()
+    ],
+    type="counter",
+)
+metrics_registry.callback(
+    "patterns_provider_retries_total",
+    "Provider calls retried after a transient failure or a provider 429.",
+    ["provider"],
+    lambda: [
+        ((name,), engine.admission.retries)
+        for name, engine in engine_registry.engines().items() if engine.admission is not None
+    ],
+    type="counter",
+)
+metrics_registry.callback(
+    "patterns_circuit_open",
+    "1 while the provider's circuit breaker is open or half open.",
+    ["provider"],
+    lambda: [
+        ((name,), int(engine.admission.breaker.state != "closed"))
+        for name, engine in engine_registry.engines().items() if engine.admission is not None
+    ],
+)
 
+metrics_registry.callback(
+    "patterns_ollama_model_loaded",
+    "1 if the Ollama model was loaded at the warmer's last check.",
+    ["model"],
+    lambda: [
+        ((model,), int(state["loaded"])) for model, state in ollama_warmer.state.items()
+    ] if ollama_warmer is not None else [],
+)
+metrics_registry.callback(
+    "patterns_ollama_cold_starts_total",
+    "Ollama calls that had to load their model first (load longer than OLLAMA_COLD_START_SECONDS).",
+    ["model"],
+    lambda: [((model,), count) for model, count in engine_registry.engines()["ollama"].cold_starts.items()],
+    type="counter",
+)
+metrics_registry.callback(
+    "patterns_ollama_warmups_total",
+    "Warm-up pings sent to Ollama by reason (startup, keepalive) and outcome.",
+    ["model", "reason", "outcome"],
+    lambda: list(ollama_warmer.warmups.items()) if ollama_warmer is not None else [],
+    type="counter",
+)
+metrics_registry.callback(
+    "patterns_hedge_latency_seconds",
+    "Recent latency quantiles of hedged models: their provider calls alone (unhedged) vs. hedged generations.",
+    ["model", "mode", "quantile"],
+    lambda: [
+        ((model, mode, str(q)), value)
+        for model in hedge_policy.fallbacks
+        for mode, tracker in (("unhedged", provider_latency), ("hedged", hedged_latency))
+        for q in (0.5, 0.95, 0.99)
+        for value in (tracker.quantile(model, q),) if value is not None
+    ],
+)
 
-class Pattern2Request(BaseModel):
-    A_label: str
-    p_label: str
-    B_label: str
-    C_label: str
+def record_usage(provider: str, model_name: str, usage: Dict[str, float]):
+    trace = generation_trace.get()
+    for kind in ("prompt_tokens", "cached_prompt_tokens", "completion_tokens"):
+        if kind in usage:
+            TOKENS.inc(usage[kind], provider=provider, model=model_name, kind=kind[:-len("_tokens")])
+            if trace is not None:
+                trace[kind] = int(usage[kind])
+    for phase in ("load", "prompt_eval", "eval"):
+        if phase + "_seconds" in usage:
+            OLLAMA_DURATION_SECONDS.observe(usage[phase + "_seconds"], model=model_name, phase=phase)
+    if "prompt_eval_seconds" in usage:
+        layout = (trace or {}).get("prompt_layout", "single_message")
+        PROMPT_EVAL_SECONDS.observe(usage["prompt_eval_seconds"], model=model_name, layout=layout)
+        PROMPT_EVAL_TOKENS.inc(usage.get("prompt_tokens") or 0, model=model_name, layout=layout)
+
+for _engine in engine_registry.engines().values():
+    _engine.usage_observer = record_usage
+
+def stage_labels(data: Any) -> Dict[str, str]:
+    # Only served models get their own series, clients cannot add label values
+    known = data.model_name in model_provider_map
+    return {
+        "pattern": data.pattern_name,
+        "model": data.model_name if known else "unknown",
+        "provider": model_provider_map[data.model_name] if known else "unknown",
+    }
+
+class GenerationRequest(BaseModel):
+    """Fields of every pattern's request, besides its inputs and few-shot examples (see pattern_models)."""
     use_few_shot: bool
-    few_shot_examples: List[ExampleItem] = []
+    # Examples to put into the prompt, the most similar ones first (default FEW_SHOT_TOP_K
+    # library examples, all sent examples)
+    few_shot_k: Optional[int] = None
     # Additional OpenAI params
     model_name: str = "gpt-4o"
     temperature: float = 0.0
@@ -140,331 +579,1154 @@ class Pattern2Request(BaseModel):
     presence_penalty: float = 0.0
     #Ollama only
     repeat_penalty: float = 1.1
-    pattern_name: str = "2_subclass"
     output_schema: Optional[Dict[str, Any]] = None
+    # Shared part of the prompt, sent as the system message; set when the prompt is built
+    system_prompt: Optional[str] = None
+    # Serve/store cached answers even when temperature > 0
+    cache_sampled: bool = False
+    # Alternatives generated in the same provider call, ranked in `candidates`
+    n_candidates: int = 1
+    # Also ask the model's HEDGE_MODELS fallback when the answer is slow (default HEDGE_REQUESTS)
+    hedge: Optional[bool] = None
+
+class BatchItemError(BaseModel):
+    status_code: int
+    detail: str
+
+class PatternModels(NamedTuple):
+    request: Type[BaseModel]
+    example: Type[BaseModel]
+    candidate: Type[BaseModel]
+    response: Type[BaseModel]
+    batch_item: Type[BaseModel]
+    # Built once: parse batch bodies and serialize batch responses in pydantic-core
+    batch_request: TypeAdapter
+    batch_response: TypeAdapter
+
+_pattern_models: Dict[str, PatternModels] = {}
+
+def pattern_models(spec: PatternSpec) -> PatternModels:
+    """The pattern's pydantic models, created from its spec once (again when the spec changes)."""
+    models = _pattern_models.get(spec.signature)
+    if models is not None:
+        return models
+    clashes = set(spec.inputs) & (set(GenerationRequest.model_fields) | {"few_shot_examples", "pattern_name"})
+    if clashes:
+        raise HTTPException(status_code=500, detail=f"Inputs of pattern {spec.name} clash with request fields: {sorted(clashes)}")
+    title = spec.title
+    example = create_model(
+        f"{title}Example",
+        **{field: (Optional[str], None) if field in spec.example_defaults else (str, ...) for field in spec.inputs},
+        **{spec.example_answer_field: (Optional[str], None)},
+    )
+    request = create_model(
+        f"{title}Request",
+        __base__=GenerationRequest,
+        **{field: (str, ...) for field in spec.inputs},
+        few_shot_examples=(List[example], []),
+        pattern_name=(Literal[spec.key], spec.key),
+    )
+    candidate = create_model(
+        f"{title}Candidate",
+        **{spec.answer_field: (str, ...)}, explanation=(str, ...), votes=(int, ...), score=(float, ...),
+    )
+    response = create_model(
+        f"{title}Response",
+        **{spec.answer_field: (str, ...)},
+        explanation=(str, ...),
+        # Only for n_candidates > 1, best first (the top-level fields repeat the best one)
+        candidates=(Optional[List[candidate]], None),
+        # As reported by the provider, counted locally for cached answers
+        prompt_tokens=(Optional[int], None),
+        # Model that answered a hedged generation
+        model_name=(Optional[str], None),
+    )
+    batch_item = create_model(
+        f"{title}BatchItem", index=(int, ...), result=(Optional[response], None), error=(Optional[BatchItemError], None),
+    )
+    models = PatternModels(
+        request, example, candidate, response, batch_item, TypeAdapter(List[request]), TypeAdapter(List[batch_item])
+    )
+    _pattern_models[spec.signature] = models
+    return models
+
+def builtin_pattern_models(pattern_name: str) -> PatternModels:
+    spec = prompt_registry.pattern_spec(pattern_name)
+    if spec is None:
+        raise RuntimeError(f"Pattern spec {prompt_registry.root}/{pattern_name}/pattern.json is missing or invalid.")
+    return pattern_models(spec)
+
+# The typed /generate_shortcut and /generate_subclass routes and job requests
+_shortcut_models = builtin_pattern_models("1_shortcut")
+_subclass_models = builtin_pattern_models("2_subclass")
+Pattern1Request, Pattern1Response, Pattern1BatchItem = (
+    _shortcut_models.request, _shortcut_models.response, _shortcut_models.batch_item
+)
+Pattern2Request, Pattern2Response, Pattern2BatchItem = (
+    _subclass_models.request, _subclass_models.response, _subclass_models.batch_item
+)
 
-
-class Pattern1Response(BaseModel):
-    property_name: str
-    explanation: str
-
-class Pattern2Response(BaseModel):
-    class_name: str
-    explanation: str
+class JobRequest(BaseModel):
+    shortcut: List[Pattern1Request] = []
+    subclass: List[Pattern2Request] = []
+    # Inputs of any pattern by pattern name, e.g. {"my_pattern": [{...}]}
+    items: Dict[str, List[Dict[str, Any]]] = {}
+    # Defaults of the items' own fields, e.g. {"model_name": "gpt-4o"}
+    settings: Dict[str, Any] = {}
 
 class TemporaryLocalStorageData(BaseModel):
     uuid: str
     data: Any
 
 def get_provider(model_name: str) -> str:
-    return model_provider_map[model_name]
+    return engine_registry.provider_of(model_name)
 
-def load_text_file(filepath: str) -> str:
-    """Loads a text file and returns its content as a string."""
-    try:
-        with open(filepath, "r", encoding="utf-8") as f:
-            return f.read()
-    except Exception as e:
-        print(f"Error reading {filepath}: {e}")
-        return ""
+def check_model(model_name: str):
+    """400 for a model no engine serves, before anything is recorded under its name."""
+    if model_name not in engine_registry.model_map:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown model name: {model_name}. Supported models: {', '.join(sorted(engine_registry.model_map))}"
+        )
 
 def load_output_schema(pattern_name: str) -> Optional[Dict[str, Any]]:
-    """Loads output schema file based on pattern name and returns the json schema as an object."""
+    """Returns the parsed output schema for the pattern from the in-memory prompt registry."""
 
-    path = f"./prompts/{pattern_name}/output_schema.json"
-    schema_text = load_text_file(path)
-    try:
-        schema = json.loads(schema_text)
-    except Exception as e:
-        print(f"Error reading output schema for {pattern_name}: {e}")
-        return None
-    
+    schema = prompt_registry.schema(pattern_name)
+    if schema is None:
+        print(f"Error reading output schema for {pattern_name}: not found in {prompt_registry.root}")
     return schema
 
-def load_template(pattern_name: str, model_name: str, use_few_shot: bool) -> str:
-    """Loads a prompt file based on required parameters and returns its content as a string."""
+def load_template(pattern_name: str, model_name: str, use_few_shot: bool) -> Optional[Template]:
+    """Returns the precompiled prompt template for the required parameters from the prompt registry."""
 
     provider = get_provider(model_name)
     technique = "few_shot" if use_few_shot else "baseline"
-    path = f"./prompts/{pattern_name}/{provider}/{technique}.txt"
+    return prompt_registry.template(pattern_name, provider, technique)
+
+def load_system_template(pattern_name: str, model_name: str, use_few_shot: bool) -> Optional[Template]:
+    """Returns the shared (system) part of the template, None if the template is not split."""
 
-    return load_text_file(path)
+    provider = get_provider(model_name)
+    technique = "few_shot" if use_few_shot else "baseline"
+    return prompt_registry.system_template(pattern_name, provider, technique)
+
+def request_spec(data: Any) -> PatternSpec:
+    spec = prompt_registry.pattern_spec(data.pattern_name)
+    if spec is None:
+        raise HTTPException(status_code=500, detail=f"Pattern spec not found ({data.pattern_name}).")
+    return spec
+
+def select_few_shot_examples(data: Any, spec: PatternSpec) -> List[Dict[str, Any]]:
+    """
+    Examples for a few-shot prompt: the ones sent with the request (the few_shot_k most similar
+    if it is set), otherwise the most similar ones from the pattern's example library.
+    """
+    if not data.use_few_shot:
+        return []
+    query = data.model_dump(include=set(spec.inputs))
+    if data.few_shot_examples:
+        examples = [example.model_dump() for example in data.few_shot_examples]
+        if data.few_shot_k is None or data.few_shot_k >= len(examples):
+            return examples
+        return ExampleIndex.from_examples(examples).top_k(query, data.few_shot_k)
+    k = FEW_SHOT_TOP_K if data.few_shot_k is None else data.few_shot_k
+    return prompt_registry.examples(data.pattern_name, query, k)
+
+def prompt_token_budget(model_name: str) -> int:
+    return model_prompt_budgets.get(model_name, PROMPT_TOKEN_BUDGET)
+
+def count_prompt_tokens(data: Any, prompt_text: str) -> int:
+    """Prompt size (system and user message) for data.model_name, noted in the current generation trace."""
+    tokens = token_counter.count(data.model_name, prompt_text)
+    if data.system_prompt:
+        tokens += token_counter.count(data.model_name, data.system_prompt)
+    trace = generation_trace.get()
+    if trace is not None:
+        trace["prompt_tokens_estimate"] = tokens
+    return tokens
+
+def full_prompt(data: Any, prompt_text: str) -> str:
+    """System and user message as one text, the way PROMPT_PREFIX_SHARING=false sends it."""
+    return data.system_prompt + "\n\n" + prompt_text if data.system_prompt else prompt_text
+
+def prompt_layout(data: Any) -> str:
+    """"shared_prefix" when the prompt goes out as system + user message, else "single_message"."""
+    return "shared_prefix" if data.system_prompt else "single_message"
+
+def fit_prompt(data: Any, tpl: Template, snippets: List[str], system_tpl: Optional[Template] = None, **fields: str) -> str:
+    """
+    Render the template with as many few-shot snippets (in order) as fit the model's prompt
+    token budget. Raises 413 when the prompt does not fit even without examples. The system
+    part, if any, is rendered into data.system_prompt (or in front of the prompt when
+    PROMPT_PREFIX_SHARING is off).
+    """
+    prefix = ""
+    data.system_prompt = system_tpl.safe_substitute(**fields) if system_tpl is not None else None
+    if data.system_prompt is not None and not PROMPT_PREFIX_SHARING:
+        prefix, data.system_prompt = full_prompt(data, ""), None
+    trace = generation_trace.get()
+    if trace is not None:
+        trace["prompt_layout"] = prompt_layout(data)
+
+    def render(count: int) -> str:
+        return prefix + tpl.safe_substitute(few_shot_examples="\n\n".join(snippets[:count]), **fields)
+
+    budget = prompt_token_budget(data.model_name)
+    prompt_text = render(len(snippets))
+    tokens = count_prompt_tokens(data, prompt_text)
+    if tokens > budget and snippets:
+        # Sum up snippet sizes instead of re-counting the whole prompt per candidate count
+        used = count_prompt_tokens(data, render(0))
+        separator = token_counter.count(data.model_name, "\n\n")
+        kept = 0
+        for snippet in snippets:
+            used += token_counter.count(data.model_name, snippet) + separator
+            if used > budget:
+                break
+            kept += 1
+        FEW_SHOT_TRIMMED.inc(len(snippets) - kept, **stage_labels(data))
+        prompt_text = render(kept)
+        tokens = count_prompt_tokens(data, prompt_text)
+    PROMPT_TOKENS.observe(tokens, **stage_labels(data))
+    if tokens > budget:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Prompt has {tokens} tokens, the budget of {data.model_name} is {budget}."
+        )
+    return prompt_text
 
-def build_pattern1_prompt(data: Pattern1Request) -> str:
-    """Build the prompt for Pattern1 (shortcut)."""
+def build_prompt(data: Any) -> str:
+    """Build the prompt for any pattern: its template, filled with the request's inputs and examples."""
 
+    spec = request_spec(data)
     data.output_schema = load_output_schema(data.pattern_name)
 
-    template_content = load_template(
+    tpl = load_template(
         pattern_name=data.pattern_name,
         model_name=data.model_name,
         use_few_shot=data.use_few_shot
     )
 
-    if not template_content:
-        raise HTTPException(status_code=500, detail="Prompt template not found (Pattern1).")
-
-    if get_provider(data.model_name) == "ollama":
-        data.output_schema = load_output_schema(data.pattern_name)# Add the output schema to data for later use
-
-    few_shot_str = ""
-    if data.use_few_shot and data.few_shot_examples:
-        lines = []
-        for ex in data.few_shot_examples:
-            print(ex)
-            r_lab = ex.r_label if ex.r_label else "..."
-            snippet = f"""Input:
-- Class A: {ex.A_label}
-  - Property p: {ex.p_label}
-- Class B: {ex.B_label}
-  - Property r: {r_lab}
-- Class C: {ex.C_label}
-
-Suggested Property Name: {ex.Property}
----
-"""
-            lines.append(snippet.strip())
-        few_shot_str = "\n\n".join(lines)
-
-    tpl = Template(template_content)
-    final_prompt = tpl.safe_substitute(
-        few_shot_examples=few_shot_str,
-        A_label=data.A_label,
-        p_label=data.p_label,
-        B_label=data.B_label,
-        r_label=data.r_label,
-        C_label=data.C_label,
-        output_schema=json.dumps(data.output_schema)
-    )
-    return final_prompt
+    if tpl is None:
+        raise HTTPException(status_code=500, detail=f"Prompt template not found ({data.pattern_name}).")
 
-def build_pattern2_prompt(data: Pattern2Request) -> str:
-    """Build the prompt for Pattern2 (subclass)."""
+    lines = [spec.format_example(example) for example in select_few_shot_examples(data, spec)]
 
-    template_content = load_template(
+    system_tpl = load_system_template(
         pattern_name=data.pattern_name,
         model_name=data.model_name,
         use_few_shot=data.use_few_shot
     )
-
-    if not template_content:
-        raise HTTPException(status_code=500, detail="Prompt template not found (Pattern2).")
-
-    if get_provider(data.model_name) == "ollama":
-        data.output_schema = load_output_schema(data.pattern_name)# Add the output schema to data for later use
-
-    few_shot_str = ""
-    if data.use_few_shot and data.few_shot_examples:
-        lines = []
-        for ex in data.few_shot_examples:
-            snippet = f"""Input:
-- Class A: {ex.A_label}:
-  - Property p ({ex.p_label}):
-    - Domain: {ex.A_label}
-    - Range: {ex.B_label}
-- Class B: {ex.B_label}
-- Class C: {ex.C_label}, a subclass of {ex.B_label}
-
-Suggested Class Name: {ex.Subclass}
----
-"""
-            lines.append(snippet.strip())
-        few_shot_str = "\n\n".join(lines)
-
-    tpl = Template(template_content)
-    final_prompt = tpl.safe_substitute(
-        few_shot_examples=few_shot_str,
-        A_label=data.A_label,
-        p_label=data.p_label,
-        B_label=data.B_label,
-        C_label=data.C_label,
-        output_schema=json.dumps(data.output_schema)
+    return fit_prompt(
+        data, tpl, lines, system_tpl,
+        **{field: getattr(data, field) for field in spec.inputs},
+        output_schema=prompt_registry.schema_json(data.pattern_name)
     )
-    return final_prompt
-
-def call_openai_chat(
-    model_name: str,
-    prompt_text: str,
-    temperature: float,
-    top_p: float,
-    frequency_penalty: float,
-    presence_penalty: float,
-) -> str:
-    provider = model_provider_map.get(model_name)
-    if not provider:
-        raise ValueError(f"Unknown model name: {model_name}")
-    
-    if not openai_api_key:
-        raise HTTPException(status_code=500, detail="Missing OPENAI_API_KEY.")
-    
-    if model_name in ["o1-preview", "o1-mini"]:
-        temperature = 1.0
-        
+
+async def call_llm_chat(data: Any, prompt_text: str) -> str:
+    """Dispatch the rendered prompt to the engine serving data.model_name."""
+    labels = stage_labels(data)
+    start = time.perf_counter()
     try:
-        response = openai.chat.completions.create(
-            model=model_name,
-            messages=[{"role": "user", "content": prompt_text}],
-            temperature=temperature,
-            top_p=top_p,
-            frequency_penalty=frequency_penalty,
-            presence_penalty=presence_penalty
-        )
-        return response.choices[0].message.content.strip().replace("json","").replace("`","")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"OpenAI API call failed: {e}")
+        with STAGE_SECONDS.time(stage="provider_call", **labels):
+            answer = await engine_registry.engine_for(data.model_name).agenerate(data, prompt_text)
+    except HTTPException:
+        PROVIDER_FAILURES.inc(provider=labels["provider"], model=labels["model"])
+        raise
+    provider_latency.observe(data.model_name, time.perf_counter() - start)
+    mark_provider_answer(start)
+    return answer
 
 
-def call_ollama_chat(
-    model_name: str,
-    prompt_text: str,
-    temperature: float,
-    top_p: float,
-    repeat_penalty: float,
-    output_schema: Optional[Dict[str, Any]] = None
-):
-    if output_schema is None:
-        print("Warning: No response schema provided for the call to Ollama API." +
-              "Defaulting 'format' parameter to generic 'json'")
+def mark_provider_answer(start: float):
+    """Note in the current generation trace that the answer came from the provider."""
+    trace = generation_trace.get()
+    if trace is not None:
+        trace["source"] = "provider"
+        trace["latency_ms"] = (time.perf_counter() - start) * 1000
+
+
+def cache_params(data: Any) -> Dict[str, Any]:
+    """Everything besides prompt and model that changes the generation, used in the cache key."""
+    params = {field: getattr(data, field) for field in SAMPLING_FIELDS}
+    params["output_schema"] = data.output_schema
+    if data.system_prompt:
+        params["system_prompt"] = data.system_prompt
+    if data.n_candidates > 1:
+        # Only set when used, so keys of single-answer generations stay the same
+        params["n_candidates"] = data.n_candidates
+    return params
+
+
+def is_repeatable(data: Any) -> bool:
+    """Whether an earlier answer to the same prompt may be reused (greedy decoding or cache_sampled)."""
+    return data.temperature <= 0 or data.cache_sampled
+
+
+def prompt_key(data: Any, prompt_text: str) -> str:
+    return ResponseCache.make_key(prompt_text, data.model_name, cache_params(data))
 
+
+async def call_llm_chat_coalesced(data: Any, prompt_text: str) -> str:
+    """call_llm_chat, sharing one in-flight provider call between identical concurrent requests."""
+    if single_flight is None or not is_repeatable(data):
+        return await call_llm_chat(data, prompt_text)
+
+    return await single_flight.do(prompt_key(data, prompt_text), lambda: call_llm_chat(data, prompt_text))
+
+
+async def lookup_generation_store(data: Any, prompt_text: str) -> Optional[str]:
+    """Raw answer of an identical generation persisted earlier, if warm-starting from the store is enabled."""
+    if generation_store is None or not GENERATION_STORE_WARM or not is_repeatable(data):
+        return None
     try:
-        response: ollama.ChatResponse = ollama.chat(
-            model=model_name,
-            messages=[{"role": "user", "content": prompt_text}],
-            format=output_schema if output_schema is not None else "json",
-            options={
-                "temperature": temperature,
-                "top_p": top_p,
-                "repeat_penalty": repeat_penalty,
-                "num_ctx": 4096
-            }
-        )
-        return response.message.content.strip().replace("json","").replace("`","")
+        return await generation_store.lookup(prompt_key(data, prompt_text))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Ollama API call failed: {e}")
+        print(f"Warning: generation store lookup failed: {e}")
+        generation_store.errors += 1
+        return None
+
+
+async def call_llm_chat_stored(data: Any, prompt_text: str) -> str:
+    """call_llm_chat_coalesced, answered from the generation store when possible."""
+    stored = await lookup_generation_store(data, prompt_text)
+    if stored is not None:
+        return stored
+    return await call_llm_chat_coalesced(data, prompt_text)
+
+
+async def lookup_response_cache(data: Any, prompt_text: str) -> Optional[str]:
+    """Cached answer to this prompt/model/params, None on a miss or when the generation is not cacheable."""
+    if response_cache is None:
+        return None
+    if not response_cache.is_cacheable(cache_params(data), data.cache_sampled):
+        response_cache.skipped += 1
+        return None
+    cached = await response_cache.lookup(prompt_key(data, prompt_text))
+    if cached is not None:
+        trace = generation_trace.get()
+        if trace is not None:
+            trace["source"] = "cache"
+    return cached
+
+
+async def store_response_cache(data: Any, prompt_text: str, raw_answer: str):
+    """Cache an answer that parsed; answers that were served from the cache are not written again."""
+    if response_cache is None or not response_cache.is_cacheable(cache_params(data), data.cache_sampled):
+        return
+    trace = generation_trace.get()
+    if trace is not None and trace.get("source") == "cache":
+        return
+    await response_cache.store(prompt_key(data, prompt_text), raw_answer)
+
+
+async def call_llm_chat_cached(data: Any, prompt_text: str) -> str:
+    """
+    call_llm_chat behind the response cache, keyed on prompt, model and sampling parameters.
+    The answer is only cached by parse_and_record, once it parsed.
+    """
+    cached = await lookup_response_cache(data, prompt_text)
+    if cached is not None:
+        return cached
+    return await call_llm_chat_stored(data, prompt_text)
+
+
+async def stream_llm_chat(data: Any, prompt_text: str) -> AsyncIterator[str]:
+    """Streaming counterpart of call_llm_chat_cached, a cache hit is yielded as a single chunk."""
+    cached = await lookup_response_cache(data, prompt_text)
+    if cached is not None:
+        yield cached
+        return
+
+    stored = await lookup_generation_store(data, prompt_text)
+    if stored is not None:
+        yield stored
+        return
+
+    stream = engine_registry.engine_for(data.model_name).astream(data, prompt_text)
+
+    labels = stage_labels(data)
+    chunks = []
+    start = time.perf_counter()
+    finished = False
+    try:
+        with STAGE_SECONDS.time(stage="provider_call", **labels):
+            async for token in stream:
+                chunks.append(token)
+                yield token
+        finished = True
+    except HTTPException:
+        PROVIDER_FAILURES.inc(provider=labels["provider"], model=labels["model"])
+        raise
+    except GeneratorExit:
+        # The consumer stopped once the JSON answer was complete, what arrived so far is the answer
+        finished = bool(chunks)
+        raise
+    finally:
+        await stream.aclose()
+        if finished:
+            mark_provider_answer(start)
+
 
 @app.get("/model_provider_map", response_model=Mapping[str, str])
 def get_model_names():
     return model_provider_map
 
 
-@app.post("/generate_shortcut")
-def generate_pattern1(data: Pattern1Request):
-    # 1) Build the prompt
-    prompt_text = build_pattern1_prompt(data)
-    
-    # 2) determine model provider
-    provider = get_provider(data.model_name)
-
-    # 3a) Call llm chat by provider
-    if provider == "openai":
-        raw_answer = call_openai_chat(
-            model_name=data.model_name,
-            prompt_text=prompt_text,
-            temperature=data.temperature,
-            top_p=data.top_p,
-            frequency_penalty=data.frequency_penalty,
-            presence_penalty=data.presence_penalty,
-        )
-    elif provider == "ollama":
-        raw_answer = call_ollama_chat(
-            model_name=data.model_name,
-            prompt_text=prompt_text,
-            temperature=data.temperature,
-            top_p=data.top_p,
-            repeat_penalty=data.repeat_penalty,
-            output_schema=data.output_schema
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Prometheus metrics of this worker process."""
+    return PlainTextResponse(metrics_registry.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/provider_pool_stats")
+def get_provider_pool_stats():
+    """Connection pool configuration and utilization per provider."""
+    return {provider: pool.stats() for provider, pool in provider_pools.items()}
+
+
+@app.get("/engine_stats")
+def get_engine_stats():
+    """Concurrency slots in use and queued calls per provider engine."""
+    return engine_registry.stats()
+
+
+@app.get("/coalescing_stats")
+def get_coalescing_stats():
+    """Provider calls made vs. identical concurrent requests that joined an in-flight call."""
+    if single_flight is None:
+        return {"enabled": False}
+    return {"enabled": True, **single_flight.stats()}
+
+
+@app.get("/generation_store_stats")
+def get_generation_store_stats():
+    """Appends and warm-start hits of the persistent generation store."""
+    if generation_store is None:
+        return {"backend": "off"}
+    return generation_store.stats()
+
+
+@app.get("/generation_store/export")
+def export_generation_store(format: str = "jsonl", pattern_name: Optional[str] = None,
+                            model_name: Optional[str] = None, since: Optional[float] = None,
+                            inputs: Optional[str] = None):
+    """
+    Bulk export of stored generations (oldest first) as JSONL, streamed, or as a Parquet file.
+    `since` is a unix timestamp, `inputs` a JSON object of the pattern inputs (e.g. all five labels).
+    """
+    if generation_store is None:
+        raise HTTPException(status_code=404, detail="Generation store is disabled.")
+    input_values = None
+    if inputs is not None:
+        try:
+            input_values = fast_json.loads(inputs)
+        except ValueError:
+            input_values = None
+        if not isinstance(input_values, dict):
+            raise HTTPException(status_code=400, detail="inputs must be a JSON object.")
+    records = generation_store.iter_records(pattern_name=pattern_name, model_name=model_name, since=since,
+                                            inputs=input_values)
+    if format == "jsonl":
+        return StreamingResponse(iter_jsonl(records), media_type="application/x-ndjson")
+    if format == "parquet":
+        buffer = io.BytesIO()
+        try:
+            write_parquet(records, buffer)
+        except RuntimeError as e:
+            raise HTTPException(status_code=501, detail=str(e))
+        return Response(
+            content=buffer.getvalue(),
+            media_type="application/vnd.apache.parquet",
+            headers={"Content-Disposition": 'attachment; filename="generations.parquet"'},
         )
-    # 4) Parse the LLM output as JSON
+    raise HTTPException(status_code=400, detail="format must be 'jsonl' or 'parquet'.")
+
+
+@app.get("/ollama_model_stats")
+def get_ollama_model_stats():
+    """Load state, last use, cold starts and warm-up pings per Ollama model."""
+    if ollama_warmer is None:
+        return {"warmup": False, "cold_starts": dict(engine_registry.engines()["ollama"].cold_starts)}
+    return {"warmup": True, **ollama_warmer.stats()}
+
+
+@app.get("/hedge_stats")
+def get_hedge_stats():
+    """Hedged models, their current deadlines and recent latency quantiles (unhedged provider calls vs. hedged)."""
+    return {
+        "enabled_by_default": HEDGE_REQUESTS,
+        "fallbacks": hedge_policy.fallbacks,
+        "deadlines": {model: hedge_policy.delay(model) for model in hedge_policy.fallbacks},
+        "unhedged": provider_latency.stats(),
+        "hedged": hedged_latency.stats(),
+    }
+
+
+@app.get("/cache_stats")
+def get_cache_stats():
+    """Hit/miss counters of the generation response cache."""
+    if response_cache is None:
+        return {"backend": "off"}
+    return response_cache.stats()
+
+
+def parse_llm_json(raw_answer: str, data: Any, extractor: Optional[JsonObjectExtractor] = None) -> Dict[str, Any]:
+    """
+    Extract the first JSON object from the LLM output and validate it against the pattern's
+    output schema, raising StructuredOutputError if there is none. `extractor` is passed when
+    the output was already scanned while streaming.
+    """
+    labels = stage_labels(data)
     try:
-        parsed_json = json.loads(raw_answer)
-    except json.JSONDecodeError:
-        raise HTTPException(
-            status_code=500,
-            detail="API did not return valid JSON. Raw output was:\n" + raw_answer
-        )
-    # 5) Extract fields from JSON
-    prop_name = parsed_json.get("property_name", "UnknownProperty")
+        with STAGE_SECONDS.time(stage="json_parse", **labels):
+            parsed_json, repaired = parse_structured_output(
+                raw_answer, prompt_registry.validator(data.pattern_name), extractor
+            )
+    except StructuredOutputError:
+        JSON_DECODE_FAILURES.inc(**labels)
+        raise
+    if repaired:
+        STRUCTURED_OUTPUT_REPAIRS.inc(method="local", outcome="ok", **labels)
+    return parsed_json
+
+def is_complete_answer(candidate: str, data: Any) -> bool:
+    """Whether a JSON object completed mid-stream already is a valid answer (the rest can be skipped)."""
+    if data.n_candidates > 1:
+        return False
+    try:
+        parse_structured_output(candidate, prompt_registry.validator(data.pattern_name))
+    except StructuredOutputError:
+        return False
+    return True
+
+def unusable_answer(error: StructuredOutputError, raw_answer: str) -> HTTPException:
+    return HTTPException(
+        status_code=500,
+        detail=f"API did not return valid JSON ({'; '.join(error.errors)}). Raw output was:\n" + raw_answer
+    )
+
+async def reask_llm_chat(data: Any, prompt_text: str, raw_answer: str, errors: List[str]) -> str:
+    """
+    Ask the provider once more, showing it the unusable answer and what was wrong with it.
+    """
+    return await call_llm_chat(data, build_repair_prompt(prompt_text, raw_answer, errors))
+
+def check_candidates(data: Any):
+    if not 1 <= data.n_candidates <= MAX_CANDIDATES:
+        raise HTTPException(status_code=400, detail=f"n_candidates must be between 1 and {MAX_CANDIDATES}.")
+
+def prepare_candidates(data: Any, prompt_text: str, streaming: bool = False) -> str:
+    """
+    For n_candidates > 1, ask for a list of candidates in the prompt (and output schema),
+    unless the engine returns n completions natively. Returns the prompt to send.
+    """
+    check_candidates(data)
+    if data.n_candidates == 1:
+        return prompt_text
+    if engine_registry.engine_for(data.model_name).supports_n and not streaming:
+        return prompt_text
+    if data.output_schema is not None:
+        data.output_schema = candidates_schema(data.output_schema, data.n_candidates)
+    return prompt_text + candidates_instruction(data.n_candidates)
+
+def parse_ranked_candidates(raw_answer: str, data: Any, name_field: str,
+                            extractor: Optional[JsonObjectExtractor] = None) -> List[Dict[str, Any]]:
+    """All valid candidates in the LLM output, deduplicated and ranked (raises StructuredOutputError if none)."""
+    labels = stage_labels(data)
+    try:
+        with STAGE_SECONDS.time(stage="json_parse", **labels):
+            answers = parse_candidates(raw_answer, name_field, prompt_registry.validator(data.pattern_name), extractor)
+    except StructuredOutputError:
+        JSON_DECODE_FAILURES.inc(**labels)
+        raise
+    return rank_candidates(answers, name_field, limit=data.n_candidates)
+
+def parse_answer(raw_answer: str, data: Any, extractor: Optional[JsonObjectExtractor] = None) -> BaseModel:
+    """The LLM output as the pattern's response model (ranked candidates for n_candidates > 1)."""
+    spec = request_spec(data)
+    models = pattern_models(spec)
+    if data.n_candidates > 1:
+        candidates = [models.candidate(**{"explanation": "", **candidate})
+                      for candidate in parse_ranked_candidates(raw_answer, data, spec.answer_field, extractor)]
+        return models.response(**{spec.answer_field: getattr(candidates[0], spec.answer_field)},
+                               explanation=candidates[0].explanation, candidates=candidates)
+    parsed_json = parse_llm_json(raw_answer, data, extractor)
+    answer = parsed_json.get(spec.answer_field, spec.answer_default)
     explanation = parsed_json.get("explanation", "")
-    
-    return Pattern1Response(property_name=prop_name, explanation=explanation)
+    return models.response(**{spec.answer_field: answer}, explanation=explanation)
+
+async def record_generation(data: Any, prompt_text: str, raw_answer: str, response: Optional[BaseModel]):
+    """Append a provider-answered generation to the store (answers served from cache/store are not repeated)."""
+    trace = generation_trace.get()
+    if generation_store is None or trace is None or trace.get("source") != "provider":
+        return
+    record = make_record(
+        request=data.model_dump(exclude={"output_schema", "system_prompt"}),
+        inputs={field: getattr(data, field, None) for field in request_spec(data).inputs},
+        provider=get_provider(data.model_name),
+        prompt_key=prompt_key(data, prompt_text),
+        prompt=full_prompt(data, prompt_text),
+        raw_output=raw_answer,
+        response=response.model_dump() if response is not None else None,
+        latency_ms=trace.get("latency_ms"),
+        prompt_tokens=trace.get("prompt_tokens"),
+        completion_tokens=trace.get("completion_tokens"),
+    )
+    try:
+        await generation_store.append(record)
+    except Exception as e:
+        print(f"Warning: generation store append failed: {e}")
+        generation_store.errors += 1
 
-@app.post("/generate_subclass")
-def generate_pattern2(data: Pattern2Request):
+async def parse_and_record(data: Any, prompt_text: str, raw_answer: str, parse_answer: Any,
+                           extractor: Optional[JsonObjectExtractor] = None) -> BaseModel:
+    """
+    Parse the LLM output, re-asking the provider once if it is unusable, and persist the
+    generation (also when parsing fails). Only an answer that parsed goes into the response cache.
+    """
+    response = None
+    try:
+        try:
+            response = parse_answer(raw_answer, data, extractor)
+        except StructuredOutputError as e:
+            if not STRUCTURED_OUTPUT_REASK:
+                raise unusable_answer(e, raw_answer)
+            raw_answer = await reask_llm_chat(data, prompt_text, raw_answer, e.errors)
+            try:
+                response = parse_answer(raw_answer, data)
+            except StructuredOutputError as e:
+                STRUCTURED_OUTPUT_REPAIRS.inc(method="reask", outcome="failed", **stage_labels(data))
+                raise unusable_answer(e, raw_answer)
+            STRUCTURED_OUTPUT_REPAIRS.inc(method="reask", outcome="ok", **stage_labels(data))
+        await store_response_cache(data, prompt_text, raw_answer)
+        trace = generation_trace.get() or {}
+        response.prompt_tokens = trace.get("prompt_tokens", trace.get("prompt_tokens_estimate"))
+        return response
+    finally:
+        await record_generation(data, prompt_text, raw_answer, response)
+
+async def run_pattern_once(data: Any) -> BaseModel:
+    generation_trace.set({})
     # 1) Build the prompt
-    prompt_text = build_pattern2_prompt(data)
+    with STAGE_SECONDS.time(stage="prompt_build", **stage_labels(data)):
+        prompt_text = prepare_candidates(data, build_prompt(data))
     
-    # 2) determine model provider
-    provider = get_provider(data.model_name)
-
-    # 3) Call llm chat by provider
-    if provider == "openai":
-        raw_answer = call_openai_chat(
-            model_name=data.model_name,
-            prompt_text=prompt_text,
-            temperature=data.temperature,
-            top_p=data.top_p,
-            frequency_penalty=data.frequency_penalty,
-            presence_penalty=data.presence_penalty,
-        )
-    elif provider == "ollama":
-        raw_answer = call_ollama_chat(
-            model_name=data.model_name,
-            prompt_text=prompt_text,
-            temperature=data.temperature,
-            top_p=data.top_p,
-            repeat_penalty=data.repeat_penalty,
-            output_schema=data.output_schema
-        )
-    # 4) Parse the LLM output as JSON
+    # 2) Call llm chat by provider, unless an identical generation is cached or stored
+    raw_answer = await call_llm_chat_cached(data, prompt_text)
+    # 3) Parse the LLM output
+    return await parse_and_record(data, prompt_text, raw_answer, parse_answer)
+
+def hedge_fallback(data: Any) -> Optional[str]:
+    """The fallback model to hedge this generation with, None when it is not hedged."""
+    if not (HEDGE_REQUESTS if data.hedge is None else data.hedge) or data.model_name not in engine_registry.model_map:
+        return None
+    fallback = hedge_policy.fallback_for(data.model_name)
+    return fallback if fallback in engine_registry.model_map else None
+
+async def run_hedged(data: Any, run: Any) -> BaseModel:
+    """
+    run(data), raced against run() on the fallback model once the primary is slower than its
+    hedging deadline (or failed). An answer that does not parse counts as a failure.
+    """
+    fallback = hedge_fallback(data)
+    if fallback is None:
+        return await run(data)
+    start = time.perf_counter()
+
+    async def primary():
+        try:
+            return await run(data)
+        except asyncio.CancelledError:
+            # Abandoned calls count with the time they got, or the deadline would only learn from fast ones
+            provider_latency.observe(data.model_name, time.perf_counter() - start)
+            raise
+
+    fallback_data = data.model_copy(update={"model_name": fallback}, deep=True)
     try:
-        parsed_json = json.loads(raw_answer)
-    except json.JSONDecodeError:
-        raise HTTPException(
-            status_code=500,
-            detail="API did not return valid JSON. Raw output was:\n" + raw_answer
-        )
-    # 5) Extract fields from JSON
-    class_name = parsed_json.get("class_name", "UnknownClass")
-    explanation = parsed_json.get("explanation", "")
-    
-    return Pattern2Response(class_name=class_name, explanation=explanation)
+        winner, response, hedged = await race(primary, lambda: run(fallback_data), hedge_policy.delay(data.model_name))
+    except Exception:
+        HEDGED_GENERATIONS.inc(model=data.model_name, fallback=fallback, outcome="failed")
+        raise
+    elapsed = time.perf_counter() - start
+    answered_by = data.model_name if winner == "primary" else fallback
+    HEDGED_GENERATIONS.inc(model=data.model_name, fallback=fallback,
+                           outcome=f"{winner}_won" if hedged else "primary_in_time")
+    if hedged:
+        HEDGE_WINNERS.inc(provider=get_provider(answered_by), model=answered_by)
+    HEDGED_GENERATION_SECONDS.observe(elapsed, model=data.model_name)
+    hedged_latency.observe(data.model_name, elapsed)
+    response.model_name = answered_by
+    return response
+
+async def run_pattern(data: Any) -> BaseModel:
+    check_model(data.model_name)
+    return await run_hedged(data, run_pattern_once)
+
+async def run_batch_item(index: int, data: Any, item_model: Any):
+    """Run one batch item (throttled by its engine's concurrency limit), capturing errors per item."""
+    try:
+        return item_model(index=index, result=await run_pattern(data))
+    except HTTPException as e:
+        return item_model(index=index, error=BatchItemError(status_code=e.status_code, detail=str(e.detail)))
+    except KeyError:
+        return item_model(index=index, error=BatchItemError(status_code=400, detail=f"Unknown model name: {data.model_name}"))
+    except Exception as e:
+        return item_model(index=index, error=BatchItemError(status_code=500, detail=str(e)))
+
+def check_batch_size(items: List[Any]):
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch too large, at most {BATCH_MAX_ITEMS} items are allowed.")
+
+async def run_batch(items: List[Any], item_model: Any) -> List[Any]:
+    """Fan the items out concurrently and return their results in request order."""
+    check_batch_size(items)
+    return await asyncio.gather(*(run_batch_item(i, data, item_model) for i, data in enumerate(items)))
+
+@app.post("/generate_shortcut", response_model=Pattern1Response)
+async def generate_pattern1(data: Pattern1Request):
+    return fast_json.json_response(await run_pattern(data))
+
+@app.post("/generate_subclass", response_model=Pattern2Response)
+async def generate_pattern2(data: Pattern2Request):
+    return fast_json.json_response(await run_pattern(data))
+
+@app.post("/generate_shortcut/batch", response_model=List[Pattern1BatchItem])
+async def generate_pattern1_batch(items: List[Pattern1Request]):
+    """Generate Pattern1 suggestions for many inputs, one result or error per item, in order."""
+    return fast_json.json_response(await run_batch(items, Pattern1BatchItem), _shortcut_models.batch_response)
+
+@app.post("/generate_subclass/batch", response_model=List[Pattern2BatchItem])
+async def generate_pattern2_batch(items: List[Pattern2Request]):
+    """Generate Pattern2 suggestions for many inputs, one result or error per item, in order."""
+    return fast_json.json_response(await run_batch(items, Pattern2BatchItem), _subclass_models.batch_response)
+
+
+def sse_event(event: str, data: Any) -> str:
+    payload = data.model_dump_json() if isinstance(data, BaseModel) else fast_json.dumps(data)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+async def stream_generation(data: Any) -> AsyncIterator[str]:
+    """SSE stream: `token` events while the provider generates, then one `result` (or `error`) event."""
+    generation_trace.set({})
+    try:
+        check_model(data.model_name)
+        with STAGE_SECONDS.time(stage="prompt_build", **stage_labels(data)):
+            prompt_text = prepare_candidates(data, build_prompt(data), streaming=True)
+        chunks = []
+        extractor = JsonObjectExtractor()
+        tokens = stream_llm_chat(data, prompt_text)
+        try:
+            async for token in tokens:
+                chunks.append(token)
+                yield sse_event("token", {"delta": token})
+                completed = extractor.feed(token)
+                if completed is not None and is_complete_answer(completed, data):
+                    break
+        finally:
+            await tokens.aclose()
+        result = await parse_and_record(data, prompt_text, clean_llm_output("".join(chunks)), parse_answer, extractor)
+        yield sse_event("result", result)
+    except HTTPException as e:
+        yield sse_event("error", {"status_code": e.status_code, "detail": str(e.detail)})
+    except KeyError:
+        yield sse_event("error", {"status_code": 400, "detail": f"Unknown model name: {data.model_name}"})
+    except Exception as e:
+        # The 200 and its headers are already sent, the error event is the only way to report it
+        print(f"Warning: stream generation with {data.model_name} failed: {e!r}")
+        traceback.print_exc()
+        yield sse_event("error", {"status_code": 500, "detail": str(e)})
+
+async def stream_batch(items: List[Any], item_model: Any) -> AsyncIterator[str]:
+    """NDJSON stream: one batch item per line, in completion order (each line carries its index)."""
+    tasks = [asyncio.ensure_future(run_batch_item(i, data, item_model)) for i, data in enumerate(items)]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            item = await finished
+            yield item.model_dump_json() + "\n"
+    finally:
+        for task in tasks:
+            task.cancel()
+
+@app.post("/generate_shortcut/stream")
+async def generate_pattern1_stream(data: Pattern1Request):
+    """Stream provider tokens as Server-Sent Events, finishing with the parsed Pattern1Response."""
+    return StreamingResponse(
+        stream_generation(data),
+        media_type="text/event-stream"
+    )
+
+@app.post("/generate_subclass/stream")
+async def generate_pattern2_stream(data: Pattern2Request):
+    """Stream provider tokens as Server-Sent Events, finishing with the parsed Pattern2Response."""
+    return StreamingResponse(
+        stream_generation(data),
+        media_type="text/event-stream"
+    )
+
+@app.post("/generate_shortcut/batch/stream")
+async def generate_pattern1_batch_stream(items: List[Pattern1Request]):
+    """Like /generate_shortcut/batch, but streams each item as NDJSON as soon as it is done."""
+    check_batch_size(items)
+    return StreamingResponse(stream_batch(items, Pattern1BatchItem), media_type="application/x-ndjson")
+
+@app.post("/generate_subclass/batch/stream")
+async def generate_pattern2_batch_stream(items: List[Pattern2Request]):
+    """Like /generate_subclass/batch, but streams each item as NDJSON as soon as it is done."""
+    check_batch_size(items)
+    return StreamingResponse(stream_batch(items, Pattern2BatchItem), media_type="application/x-ndjson")
+
+
+def prompt_response(data: Any) -> Dict[str, Any]:
+    """`prompt` is the whole text the model gets; `system` and `user` are its two messages."""
+    check_model(data.model_name)
+    prompt_text = build_prompt(data)
+    return {
+        "prompt": full_prompt(data, prompt_text),
+        "system": data.system_prompt,
+        "user": prompt_text,
+        "prompt_tokens": count_prompt_tokens(data, prompt_text),
+    }
 
 @app.post("/shortcut_prompt")
 def prompt_pattern1(data: Pattern1Request):
     """
     Return the *complete* prompt that would be sent to API for Pattern1.
     """
-    prompt_text = build_pattern1_prompt(data)
-    return {"prompt": prompt_text}
+    return prompt_response(data)
 
 @app.post("/subclass_prompt")
 def prompt_pattern2(data: Pattern2Request):
     """
     Return the *complete* prompt that would be sent to API for Pattern2.
     """
-    prompt_text = build_pattern2_prompt(data)
-    return {"prompt": prompt_text}
+    return prompt_response(data)
+
+
+# -----------------------------
+# Pattern routes
+# -----------------------------
+# /generate/{pattern}... serve every pattern under prompts/ (shortcut and subclass too), with
+# the request and response models derived from its pattern.json (see GET /patterns). The
+# body is validated against the pattern's model here rather than by FastAPI, since the
+# model is only known once the path is resolved.
+
+# Documents the body of the pattern routes, whose type depends on the path
+PATTERN_BODY = {"requestBody": {"required": True, "content": {"application/json": {"schema": {
+    "type": "object", "description": "The pattern's request, see GET /patterns"
+}}}}}
+PATTERN_BATCH_BODY = {"requestBody": {"required": True, "content": {"application/json": {"schema": {
+    "type": "array", "items": {"type": "object"}, "description": "The pattern's requests, see GET /patterns"
+}}}}}
+
+def resolve_pattern(pattern: str) -> PatternModels:
+    """Models of the pattern named in the path (its name or its directory name), 404 if there is none."""
+    spec = prompt_registry.pattern_spec(pattern)
+    if spec is None:
+        raise HTTPException(status_code=404, detail=f"Unknown pattern: {pattern}")
+    return pattern_models(spec)
+
+def validation_error(error: ValidationError, *loc: Any) -> RequestValidationError:
+    """A pydantic error as FastAPI's own 422 response, located under `loc`."""
+    return RequestValidationError([{**e, "loc": (*loc, *e["loc"])} for e in error.errors(include_url=False)])
+
+async def pattern_request(request: Request, pattern: str) -> BaseModel:
+    models = resolve_pattern(pattern)
+    try:
+        return models.request.model_validate_json(await request.body())
+    except ValidationError as e:
+        raise validation_error(e, "body")
+
+async def pattern_batch_request(request: Request, pattern: str) -> List[BaseModel]:
+    models = resolve_pattern(pattern)
+    try:
+        items = models.batch_request.validate_json(await request.body())
+    except ValidationError as e:
+        raise validation_error(e, "body")
+    check_batch_size(items)
+    return items
+
+@app.get("/patterns")
+def list_patterns():
+    """The patterns under prompts/, with the JSON schemas of their requests and responses."""
+    patterns = []
+    for spec in prompt_registry.pattern_specs():
+        models = pattern_models(spec)
+        patterns.append({
+            **spec.describe(),
+            "request_schema": models.request.model_json_schema(),
+            "response_schema": models.response.model_json_schema(),
+        })
+    return patterns
+
+@app.post("/generate/{pattern}", openapi_extra=PATTERN_BODY)
+async def generate_pattern(pattern: str, request: Request):
+    """Generate a suggestion for any pattern (its response model, see GET /patterns)."""
+    return fast_json.json_response(await run_pattern(await pattern_request(request, pattern)))
+
+@app.post("/generate/{pattern}/batch", openapi_extra=PATTERN_BATCH_BODY)
+async def generate_pattern_batch(pattern: str, request: Request):
+    """Generate suggestions for many inputs of a pattern, one result or error per item, in order."""
+    items = await pattern_batch_request(request, pattern)
+    models = resolve_pattern(pattern)
+    return fast_json.json_response(await run_batch(items, models.batch_item), models.batch_response)
+
+@app.post("/generate/{pattern}/stream", openapi_extra=PATTERN_BODY)
+async def generate_pattern_stream(pattern: str, request: Request):
+    """Stream provider tokens as Server-Sent Events, finishing with the pattern's parsed response."""
+    data = await pattern_request(request, pattern)
+    return StreamingResponse(stream_generation(data), media_type="text/event-stream")
+
+@app.post("/generate/{pattern}/batch/stream", openapi_extra=PATTERN_BATCH_BODY)
+async def generate_pattern_batch_stream(pattern: str, request: Request):
+    """Like /generate/{pattern}/batch, but streams each item as NDJSON as soon as it is done."""
+    items = await pattern_batch_request(request, pattern)
+    return StreamingResponse(stream_batch(items, resolve_pattern(pattern).batch_item), media_type="application/x-ndjson")
+
+@app.post("/prompt/{pattern}", openapi_extra=PATTERN_BODY)
+async def prompt_pattern(pattern: str, request: Request):
+    """Return the *complete* prompt that would be sent to API for the pattern."""
+    return prompt_response(await pattern_request(request, pattern))
+
+
+async def run_generation_job_item(index: int, payload: Dict[str, Any], settings: Dict[str, Any]) -> Dict[str, Any]:
+    """One job item: payload {"pattern", "input"}, the input's fields over the job settings."""
+    pattern, item = payload["pattern"], payload["input"]
+    spec = prompt_registry.pattern_spec(pattern)
+    if spec is None:
+        return {"index": index, "pattern": pattern, "input": item, "result": None,
+                "error": {"status_code": 404, "detail": f"Unknown pattern: {pattern}"}}
+    models = pattern_models(spec)
+    try:
+        data = models.request(**{**settings, **item})
+    except ValueError as e:
+        return {"index": index, "pattern": pattern, "input": item, "result": None,
+                "error": {"status_code": 422, "detail": str(e)}}
+    outcome = await run_batch_item(index, data, models.batch_item)
+    return {"index": index, "pattern": pattern, "input": item, **outcome.model_dump(exclude={"index"})}
+
+job_worker = JobWorker(
+    job_store,
+    handlers={"generate": run_generation_job_item},
+    concurrency=JOB_CONCURRENCY,
+    lease=JOB_LEASE_SECONDS,
+    poll_interval=JOB_POLL_INTERVAL,
+) if job_store is not None else None
+
+@app.on_event("startup")
+def start_job_worker():
+    if job_worker is not None and JOB_WORKER_IN_PROCESS:
+        job_worker.start()
+
+@app.on_event("shutdown")
+async def stop_job_worker():
+    if job_worker is not None:
+        # Unfinished items go back to the queue for the next worker
+        await job_worker.stop()
+
+def require_job_store():
+    if job_store is None:
+        raise HTTPException(status_code=404, detail="Job queue is disabled.")
+    return job_store
+
+async def get_job_progress(job_id: str) -> Dict[str, Any]:
+    progress = await require_job_store().progress(job_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return progress
+
+async def follow_job_results(job_id: str, start: int, follow: bool) -> AsyncIterator[str]:
+    position = start
+    while True:
+        # Checked before reading, so results stored right before the job finished are not missed
+        progress = await job_store.progress(job_id)
+        finished = progress is None or progress["status"] in FINISHED_STATES
+        results = await job_store.results(job_id, position)
+        for result in results:
+            yield fast_json.dumps(result) + "\n"
+        position += len(results)
+        if results:
+            continue
+        if finished or not follow:
+            return
+        await asyncio.sleep(JOB_POLL_INTERVAL)
+
+@app.post("/jobs", status_code=202)
+async def submit_job(job: JobRequest):
+    """
+    Queue many generations as one background job: results are collected server-side and
+    can be polled, streamed and downloaded later, across restarts.
+    """
+    store = require_job_store()
+    total = len(job.shortcut) + len(job.subclass) + sum(len(inputs) for inputs in job.items.values())
+    if not total:
+        raise HTTPException(status_code=400, detail="The job has no items.")
+    if total > JOB_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Job too large, at most {JOB_MAX_ITEMS} items are allowed.")
+    for pattern, inputs in job.items.items():
+        # Checked now, a job should not fail item by item on a typo
+        models = resolve_pattern(pattern)
+        for i, item in enumerate(inputs):
+            try:
+                models.request(**{**job.settings, **item})
+            except ValidationError as e:
+                raise validation_error(e, "body", "items", pattern, i)
+    items = itertools.chain(
+        ({"pattern": "shortcut", "input": data.model_dump(exclude_unset=True)} for data in job.shortcut),
+        ({"pattern": "subclass", "input": data.model_dump(exclude_unset=True)} for data in job.subclass),
+        ({"pattern": pattern, "input": item} for pattern, inputs in job.items.items() for item in inputs),
+    )
+    job_id = await store.submit("generate", job.settings, items)
+    return await get_job_progress(job_id)
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    return await get_job_progress(job_id)
+
+@app.get("/jobs/{job_id}/results")
+async def get_job_results(job_id: str, start: int = 0, follow: bool = True):
+    """Results as NDJSON in completion order; with `follow`, the stream stays open until the job finishes."""
+    await get_job_progress(job_id)
+    return StreamingResponse(follow_job_results(job_id, start, follow), media_type="application/x-ndjson")
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel a job; items in flight are stopped at the workers' next lease renewal."""
+    await get_job_progress(job_id)
+    await job_store.cancel(job_id)
+    return await get_job_progress(job_id)
+
+@app.get("/job_stats")
+async def get_job_stats():
+    """Jobs per status in the store, and this process' worker."""
+    if job_store is None:
+        return {"backend": "off"}
+    await job_store.purge()
+    stats = await job_store.stats()
+    if job_worker is not None:
+        stats["worker"] = {**job_worker.stats(), "in_process": JOB_WORKER_IN_PROCESS}
+    return stats
+
+
+async def read_ontology(request: Request, format: Optional[str]):
+    """Parse and index the ontology document sent as the raw request body."""
+    data = await request.body()
+    if not data:
+        raise HTTPException(status_code=400, detail="Send the ontology document as the request body.")
+    if len(data) > ONTOLOGY_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Ontology too large, at most {ONTOLOGY_MAX_BYTES} bytes are allowed.")
+    try:
+        rdf_format = detect_format(format, request.headers.get("content-type"), data)
+        return await asyncio.to_thread(parse_ontology, data, rdf_format)
+    except OntologyParseError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+
+def mining_patterns(patterns: str) -> List[str]:
+    selected = [name.strip() for name in patterns.split(",") if name.strip()]
+    if not selected or set(selected) - set(PATTERNS):
+        raise HTTPException(status_code=400, detail=f"patterns must be a comma separated subset of: {', '.join(PATTERNS)}")
+    return selected
+
+def mining_inputs(index: Any, patterns: List[str], limit: Optional[int]):
+    """(inputs, total, counts per pattern); too many candidates without a `limit` are refused with 413."""
+    counts = {pattern: index.count(pattern) for pattern in patterns}
+    total = sum(counts.values())
+    if limit is None and total > ONTOLOGY_MAX_CANDIDATES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"The ontology yields {total} candidates, more than {ONTOLOGY_MAX_CANDIDATES}; pass a `limit`."
+        )
+    inputs = itertools.chain.from_iterable(
+        ((pattern, item) for item in index.iter_inputs(pattern)) for pattern in patterns
+    )
+    if limit is not None:
+        inputs, total = itertools.islice(inputs, limit), min(total, limit)
+    return inputs, total, counts
+
+@app.post("/ontology/candidates")
+async def ontology_candidates(request: Request, format: Optional[str] = None, patterns: str = "shortcut,subclass",
+                              limit: Optional[int] = None):
+    """Enumerate the pattern inputs of an uploaded ontology as NDJSON, without generating anything."""
+    index = await read_ontology(request, format)
+    inputs, _, _ = mining_inputs(index, mining_patterns(patterns), limit)
+    return StreamingResponse(
+        (fast_json.dumps({"pattern": pattern, **item}) + "\n" for pattern, item in inputs),
+        media_type="application/x-ndjson"
+    )
 
+@app.post("/ontology/mine", status_code=202)
+async def mine_ontology(request: Request, format: Optional[str] = None, patterns: str = "shortcut,subclass",
+                        limit: Optional[int] = None, model_name: str = "gpt-4o", use_few_shot: bool = False,
+                        temperature: float = 0.0):
+    """
+    Upload an ontology (Turtle, RDF/XML, N-Triples, ... as the raw body) and generate suggestions
+    for every shortcut chain and subclass tuple in it, as a background job (see /jobs/{job_id}).
+    """
+    check_model(model_name)
+    index = await read_ontology(request, format)
+    inputs, _, counts = mining_inputs(index, mining_patterns(patterns), limit)
+    settings = {"model_name": model_name, "use_few_shot": use_few_shot, "temperature": temperature}
+    store = require_job_store()
+    job_id = await store.submit(
+        "generate", settings, ({"pattern": pattern, "input": item} for pattern, item in inputs)
+    )
+    return {**await get_job_progress(job_id), "candidates": counts, "ontology": index.stats()}
+
+
+def encode_session_payload(data: Any) -> str:
+    """
+    The client sends a JSON-encoded list of JSON-encoded items; stored as one JSON array of the
+    items. Item texts are only checked to be JSON and spliced in as sent, not re-encoded.
+    Raises 400 unless the payload is such a list. CPU-bound on large payloads, run it off the loop.
+    """
+    try:
+        items = fast_json.loads(data) if isinstance(data, str) else data
+    except ValueError:
+        raise HTTPException(status_code=400, detail="data is not valid JSON.")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="data must be a JSON list.")
+    parts = []
+    for i, item in enumerate(items):
+        if not isinstance(item, str):
+            parts.append(fast_json.dumps(item))
+            continue
+        try:
+            fast_json.loads(item)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Item {i} of data is not valid JSON.")
+        parts.append(item)
+    return "[" + ",".join(parts) + "]"
 
 @app.post("/_temp_localstorage_data")
-def save_temp_session_data(req: TemporaryLocalStorageData):
-    data = json.loads(req.data)
-    for i in range(len(data)):
-        data[i] = json.loads(data[i])
-    _set_temp_localstorage_data(req.uuid, data)
+async def save_temp_session_data(req: TemporaryLocalStorageData):
+    payload = await asyncio.to_thread(encode_session_payload, req.data)
+    try:
+        await session_store.put(req.uuid, payload)
+    except PayloadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
     return {"status": 200 }
 
 @app.get("/_temp_localstorage_data")
-def send_temp_session_data(uuid: str):
-    time.sleep(2)
-    data = _get_temp_localstorage_data(uuid)
-    return data
+async def send_temp_session_data(uuid: str, wait: Optional[float] = None):
+    """Return (and remove) the stored payload, waiting up to `wait` seconds for it to arrive."""
+    timeout = SESSION_WAIT_TIMEOUT if wait is None else min(max(wait, 0.0), SESSION_WAIT_TIMEOUT)
+    payload = await session_store.take(uuid, wait=timeout)
+    return Response(content=payload if payload is not None else "null", media_type="application/json")
+
+@app.get("/session_store_stats")
+def get_session_store_stats():
+    return session_store.stats()
 
 if __name__ == "__main__":
+    # Local development server; production runs gunicorn with uvicorn workers (see ./run)
     uvicorn.run(
         "__main__:app",
-        host="127.0.0.1",
-        port=8000, reload=True
+        host=HOST,
+        port=PORT,
+        reload=os.getenv("RELOAD", "true").lower() in ("1", "true", "yes")
     )
 
 """
@@ -0,0 +1,21 @@
+"""
+Importable entry point for process managers (gunicorn, `uvicorn --workers`).
+
+The application lives in `__main__.py`, which cannot be imported under its own
+name from another process' `__main__`, so it is loaded here as `patterns_backend`.
+"""
+
+import importlib.util
+import os
+import sys
+
+_root = os.path.dirname(os.path.abspath(__file__))
+if _root not in sys.path:
+    sys.path.insert(0, _root)
+
+_spec = importlib.util.spec_from_file_location("patterns_backend", os.path.join(_root, "__main__.py"))
+backend = importlib.util.module_from_spec(_spec)
+sys.modules["patterns_backend"] = backend
+_spec.loader.exec_module(backend)
+
+app = backend.app
@@ -0,0 +1,153 @@
+"""
+CPU micro-benchmark: what one request costs the backend itself, and how many cores that
+adds up to at a given request rate.
+
+Every stage is run --iterations times and timed with the process CPU clock, so waiting
+(on the stub provider, which runs in its own process) is not counted:
+
+    validate      JSON request body -> Pattern1Request (few-shot request with --examples examples)
+    prompt_build  build_prompt for that request
+    parse         provider answer -> Pattern1Response (extraction + schema validation)
+    serialize     Pattern1Response -> response body
+    end_to_end    POST /generate_shortcut through the whole app against the stub provider
+
+validate and serialize are measured per JSON path: the stdlib one FastAPI uses by default
+(`json` + jsonable_encoder) next to the one the app uses (utils/fast_json.py). Each stage
+is reported in CPU microseconds per request and as the cores needed at --rps:
+
+    python -m bench.cpu --rps 1000,10000 --out bench/results/cpu-$(git rev-parse --short HEAD).json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from bench.load import MODELS, STUB_PORT, load_backend
+from bench.stub_provider import ANSWER, serve_in_subprocess
+from bench.suite import git_commit, request_body
+from utils import fast_json
+
+
+def cpu_us(fn: Callable[[], Any], iterations: int) -> float:
+    """Mean process CPU time of fn() in microseconds, after a short warm-up."""
+    for _ in range(min(iterations, 100)):
+        fn()
+    start = time.process_time()
+    for _ in range(iterations):
+        fn()
+    return (time.process_time() - start) / iterations * 1e6
+
+
+def few_shot_body(provider: str, examples: int) -> Dict[str, Any]:
+    return {
+        **request_body(provider, 0),
+        "use_few_shot": True,
+        "few_shot_examples": [
+            {"A_label": f"Person{i}", "p_label": "worksFor", "B_label": "Company", "r_label": "locatedIn",
+             "C_label": f"City{i}", "Property": f"worksInCity{i}"}
+            for i in range(examples)
+        ],
+    }
+
+
+def micro_stages(backend, provider: str, examples: int, iterations: int) -> Dict[str, float]:
+    body = few_shot_body(provider, examples)
+    raw = json.dumps(body).encode("utf-8")
+    data = backend.Pattern1Request.model_validate(body)
+    backend.build_prompt(data)
+    response = backend.parse_answer(ANSWER, data)
+
+    return {
+        "validate[json]": cpu_us(lambda: backend.Pattern1Request.model_validate(json.loads(raw)), iterations),
+        f"validate[{fast_json.backend()}]": cpu_us(
+            lambda: backend.Pattern1Request.model_validate(fast_json.loads(raw)), iterations
+        ),
+        "prompt_build": cpu_us(lambda: backend.build_prompt(data.model_copy()), iterations),
+        "parse": cpu_us(lambda: backend.parse_answer(ANSWER, data), iterations),
+        "serialize[jsonable_encoder+json]": cpu_us(lambda: JSONResponse(jsonable_encoder(response)).body, iterations),
+        "serialize[pydantic-core]": cpu_us(lambda: fast_json.json_response(response).body, iterations),
+    }
+
+
+async def end_to_end(backend, provider: str, requests: int, users: int) -> float:
+    """CPU microseconds this process spends per /generate_shortcut request."""
+    transport = httpx.ASGITransport(app=backend.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        queue = asyncio.Queue()
+        for i in range(requests):
+            queue.put_nowait(i)
+
+        async def user():
+            while not queue.empty():
+                res = await client.post("/generate_shortcut", json=request_body(provider, queue.get_nowait()))
+                res.raise_for_status()
+
+        await client.post("/generate_shortcut", json=request_body(provider, requests))
+        start = time.process_time()
+        await asyncio.gather(*(user() for _ in range(users)))
+        return (time.process_time() - start) / requests * 1e6
+
+
+def print_report(report: Dict[str, Any]):
+    rates = report["settings"]["rps"]
+    print(f"commit {report['commit']}{' (dirty)' if report['dirty'] else ''}  json={report['json_backend']}  "
+          f"provider={report['settings']['provider']}")
+    print(f"{'stage':<34}{'CPU us/req':>12}" + "".join(f"{f'cores@{rate}/s':>14}" for rate in rates))
+    for name, us in report["stages"].items():
+        print(f"{name:<34}{us:>12.1f}" + "".join(f"{us * rate / 1e6:>14.2f}" for rate in rates))
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--provider", choices=sorted(MODELS), default="ollama")
+    parser.add_argument("--iterations", type=int, default=2000, help="Runs per micro stage.")
+    parser.add_argument("--examples", type=int, default=5, help="Few-shot examples in the request.")
+    parser.add_argument("--requests", type=int, default=500, help="Requests of the end_to_end stage (0 = skip).")
+    parser.add_argument("--users", type=int, default=50, help="Concurrent users of the end_to_end stage.")
+    parser.add_argument("--rps", default="1000,10000", help="Comma separated request rates to size cores for.")
+    parser.add_argument("--out", help="Write the report as JSON to this file.")
+    args = parser.parse_args(argv)
+
+    # Every request has to reach the provider
+    os.environ["RESPONSE_CACHE_BACKEND"] = "off"
+    os.environ["REQUEST_COALESCING"] = "false"
+    os.environ["GENERATION_STORE_BACKEND"] = "off"
+    os.environ["PROMPTS_RELOAD_INTERVAL"] = "0"
+
+    stub = serve_in_subprocess(port=STUB_PORT, latency_ms=1)
+    try:
+        backend = load_backend()
+        stages = micro_stages(backend, args.provider, args.examples, args.iterations)
+        if args.requests > 0:
+            stages["end_to_end"] = asyncio.run(end_to_end(backend, args.provider, args.requests, args.users))
+    finally:
+        stub.terminate()
+
+    report = {
+        **git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "json_backend": fast_json.backend(),
+        "settings": {"provider": args.provider, "iterations": args.iterations, "examples": args.examples,
+                     "requests": args.requests, "users": args.users,
+                     "rps": [int(rate) for rate in args.rps.split(",") if rate.strip()]},
+        "stages": {name: round(us, 1) for name, us in stages.items()},
+    }
+    print_report(report)
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Load benchmark: blocking provider calls vs. the async call path.
+
+Runs N generations against the local stub provider twice, once the way the old
+sync endpoints did it (blocking client inside a threadpool of THREADPOOL_SIZE
+workers, the Starlette default) and once through the async clients on a single
+event loop, then prints p50/p99 latency and throughput for both.
+
+    python -m bench.load --requests 500 --provider ollama
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench.stub_provider import serve_in_subprocess
+
+THREADPOOL_SIZE = 40
+STUB_PORT = 8999
+
+MODELS = {
+    "openai": "gpt-4o",
+    "ollama": "llama-3.3-70b-instruct:q4",
+}
+
+
+def load_backend():
+    """Import the backend module (it is called `__main__.py`, so it cannot be imported by name)."""
+    os.environ.setdefault("HOST", "127.0.0.1")
+    os.environ.setdefault("PORT", "8000")
+    os.environ.setdefault("ALLOWED_ORIGINS", "*")
+    os.environ.setdefault("OPENAI_API_KEY", "sk-stub")
+    # Measure the call path itself, not the per-engine concurrency limits
+    os.environ.setdefault("OPENAI_MAX_CONCURRENCY", "100000")
+    os.environ.setdefault("OLLAMA_MAX_CONCURRENCY", "100000")
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{STUB_PORT}/v1"
+    os.environ["OLLAMA_HOST"] = f"http://127.0.0.1:{STUB_PORT}"
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    spec = importlib.util.spec_from_file_location("backend", os.path.join(root, "__main__.py"))
+    backend = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(backend)
+    return backend
+
+
+def make_request(backend, provider: str):
+    return backend.Pattern1Request(
+        A_label="Person", p_label="worksFor", B_label="Company", r_label="locatedIn", C_label="City",
+        use_few_shot=False, model_name=MODELS[provider], output_schema={"type": "object"}
+    )
+
+
+def report(label: str, latencies: list, wall: float):
+    latencies = sorted(latencies)
+    p50 = statistics.median(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{label:<6} n={len(latencies):<5} p50={p50 * 1000:8.1f} ms  "
+          f"p99={p99 * 1000:8.1f} ms  throughput={len(latencies) / wall:8.1f} req/s")
+
+
+def run_sync(backend, provider: str, n: int):
+    engine = backend.engine_registry.engine_for(MODELS[provider])
+    data = make_request(backend, provider)
+    submitted = time.perf_counter()
+
+    def one(_):
+        engine.generate(data, "benchmark prompt")
+        return time.perf_counter() - submitted
+
+    with ThreadPoolExecutor(max_workers=THREADPOOL_SIZE) as pool:
+        latencies = list(pool.map(one, range(n)))
+    report("sync", latencies, time.perf_counter() - submitted)
+
+
+async def run_async(backend, provider: str, n: int):
+    engine = backend.engine_registry.engine_for(MODELS[provider])
+    data = make_request(backend, provider)
+    submitted = time.perf_counter()
+
+    async def one():
+        await engine.agenerate(data, "benchmark prompt")
+        return time.perf_counter() - submitted
+
+    latencies = await asyncio.gather(*(one() for _ in range(n)))
+    report("async", latencies, time.perf_counter() - submitted)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=400, help="Concurrent generations per run.")
+    parser.add_argument("--provider", choices=sorted(MODELS), default="ollama")
+    args = parser.parse_args()
+
+    stub = serve_in_subprocess(port=STUB_PORT)
+    try:
+        backend = load_backend()
+        print(f"{args.requests} generations via {args.provider}, stub latency "
+              f"{os.getenv('STUB_LATENCY_MS', '200')} ms, threadpool={THREADPOOL_SIZE}")
+        run_sync(backend, args.provider, args.requests)
+        asyncio.run(run_async(backend, args.provider, args.requests))
+    finally:
+        stub.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+"""
+Local stub LLM provider for benchmarks.
+
+Speaks just enough of the OpenAI (`/v1/chat/completions`) and Ollama (`/api/chat`)
+wire protocols for the backend to talk to it, answering every request with a
+fixed JSON payload after STUB_LATENCY_MS milliseconds (spread over the chunks
+when the client asks for `stream`).
+
+Behaviour is deterministic: latency jitter and injected errors are drawn from a
+random generator seeded with STUB_SEED, the request messages and how often the same
+messages were seen before, so a run replays identically regardless of arrival order.
+
+    STUB_LATENCY_MS   mean latency per request              (200)
+    STUB_JITTER_MS    uniform +/- jitter around the mean      (0)
+    STUB_ERROR_RATE   share of requests answered with errors  (0)
+    STUB_ERROR_STATUS HTTP status of injected errors        (500; 429 adds Retry-After)
+    STUB_MALFORMED_RATE share of answers that are not clean JSON (0)
+    STUB_LOAD_MS      Ollama model load time when the model is not loaded (0)
+
+Like Ollama, the stub keeps the last prompts per model (one per parallel slot) and reports prompt_eval_count /
+prompt_eval_duration only for the part after the prefix it shares with that prompt.
+    STUB_SEED         seed of the generator                   (0)
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+STUB_LATENCY_MS = float(os.getenv("STUB_LATENCY_MS", "200"))
+STUB_JITTER_MS = float(os.getenv("STUB_JITTER_MS", "0"))
+STUB_ERROR_RATE = float(os.getenv("STUB_ERROR_RATE", "0"))
+STUB_ERROR_STATUS = int(os.getenv("STUB_ERROR_STATUS", "500"))
+STUB_MALFORMED_RATE = float(os.getenv("STUB_MALFORMED_RATE", "0"))
+STUB_SEED = os.getenv("STUB_SEED", "0")
+STUB_LOAD_MS = float(os.getenv("STUB_LOAD_MS", "0"))
+
+ANSWER = json.dumps({
+    "property_name": "hasStubProperty",
+    "class_name": "StubClass",
+    "explanation": "Deterministic answer from the benchmark stub provider."
+})
+
+# What models get wrong: prose and fences around the JSON, a trailing comma, a missing field
+MALFORMED_ANSWERS = [
+    "Sure! Here is the suggestion:\n```json\n" + ANSWER + "\n```\nLet me know if you need more.",
+    ANSWER[:-1] + ",}",
+    json.dumps({"explanation": "Deterministic answer from the benchmark stub provider."}),
+]
+
+STREAM_CHUNK_CHARS = 8
+
+app = FastAPI(title="Stub LLM provider")
+
+# messages digest -> number of times seen, so retries of a request draw fresh numbers
+_attempts: dict = {}
+
+
+def request_rng(body: dict) -> random.Random:
+    digest = hashlib.sha256(json.dumps(body.get("messages", []), sort_keys=True).encode("utf-8")).hexdigest()
+    attempt = _attempts.get(digest, 0)
+    _attempts[digest] = attempt + 1
+    return random.Random(f"{STUB_SEED}:{digest}:{attempt}")
+
+
+def draw_latency(rng: random.Random) -> float:
+    """Latency of one request in seconds."""
+    return max(0.0, STUB_LATENCY_MS + rng.uniform(-STUB_JITTER_MS, STUB_JITTER_MS)) / 1000
+
+
+def injected_error(rng: random.Random, openai_format: bool):
+    if rng.random() >= STUB_ERROR_RATE:
+        return None
+    message = f"Injected stub error ({STUB_ERROR_STATUS})"
+    content = {"error": {"message": message, "type": "stub_error", "code": STUB_ERROR_STATUS}} if openai_format \
+        else {"error": message}
+    headers = {"Retry-After": "1"} if STUB_ERROR_STATUS == 429 else None
+    return JSONResponse(content, status_code=STUB_ERROR_STATUS, headers=headers)
+
+
+def draw_answer(rng: random.Random) -> str:
+    if rng.random() < STUB_MALFORMED_RATE:
+        return rng.choice(MALFORMED_ANSWERS)
+    return ANSWER
+
+
+def ollama_answer(body: dict, rng: random.Random) -> str:
+    """Answers a {"candidates": [...]} output schema with a list of (repeated) answers."""
+    answer = draw_answer(rng)
+    schema = body.get("format")
+    if isinstance(schema, dict) and "candidates" in schema.get("properties", {}):
+        count = schema["properties"]["candidates"].get("maxItems", 1)
+        return '{"candidates": [' + ", ".join([answer] * count) + "]}"
+    return answer
+
+
+def prompt_tokens(body: dict) -> int:
+    # Rough 4 characters per token, good enough for usage accounting
+    return sum(len(m.get("content", "")) for m in body.get("messages", [])) // 4 + 1
+
+
+# Ollama models "loaded" in the stub: model -> unix time it unloads (after keep_alive)
+loaded_models = {}
+
+
+def parse_keep_alive(value) -> float:
+    if value is None:
+        return 300.0
+    if isinstance(value, (int, float)):
+        return float(value) if value >= 0 else float("inf")
+    units = {"s": 1, "m": 60, "h": 3600}
+    return float(value[:-1]) * units[value[-1]] if value[-1] in units else float(value)
+
+
+async def load_model(body: dict) -> float:
+    """Simulated model load (STUB_LOAD_MS when the model is not loaded), returns its seconds."""
+    model, now = body.get("model", "stub"), time.time()
+    load = 0.0 if loaded_models.get(model, 0) > now else STUB_LOAD_MS / 1000
+    await asyncio.sleep(load)
+    loaded_models[model] = time.time() + parse_keep_alive(body.get("keep_alive"))
+    return load
+
+
+# Ollama model -> the most recent rendered prompts (one per parallel slot), whose KV cache a request can reuse
+STUB_PARALLEL = 4
+cached_prompts = {}
+
+
+def evaluated_prompt_tokens(body: dict) -> int:
+    """Prompt tokens after the longest prefix shared with a cached prompt (at least one)."""
+    prompt = "".join(f"<|{m.get('role')}|>{m.get('content', '')}" for m in body.get("messages", []))
+    slots = cached_prompts.setdefault(body.get("model", "stub"), [])
+    shared = max((len(os.path.commonprefix([previous, prompt])) for previous in slots), default=0)
+    slots.append(prompt)
+    del slots[:-STUB_PARALLEL]
+    return max(1, (len(prompt) - shared) // 4)
+
+
+def ollama_stats(body: dict, latency: float, answer: str, load: float = 0.0) -> dict:
+    latency_ns = int(latency * 1e9)
+    evaluated = evaluated_prompt_tokens(body)
+    return {
+        "total_duration": latency_ns + int(load * 1e9),
+        "load_duration": int(load * 1e9),
+        "prompt_eval_count": evaluated,
+        "prompt_eval_duration": latency_ns // 4 * evaluated // prompt_tokens(body),
+        "eval_count": len(answer) // 4,
+        "eval_duration": latency_ns - latency_ns // 4,
+    }
+
+
+def answer_chunks(answer: str):
+    return [answer[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(answer), STREAM_CHUNK_CHARS)]
+
+
+async def openai_stream(model: str, latency: float, answer: str):
+    delay = latency / len(answer_chunks(answer))
+    for piece in answer_chunks(answer):
+        await asyncio.sleep(delay)
+        chunk = {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]
+        }
+        yield f"data: {json.dumps(chunk)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+async def ollama_stream(model: str, body: dict, latency: float, answer: str, load: float = 0.0):
+    delay = latency / len(answer_chunks(answer))
+    for piece in answer_chunks(answer):
+        await asyncio.sleep(delay)
+        yield json.dumps({
+            "model": model,
+            "created_at": "1970-01-01T00:00:00Z",
+            "message": {"role": "assistant", "content": piece},
+            "done": False
+        }) + "\n"
+    yield json.dumps({
+        "model": model,
+        "created_at": "1970-01-01T00:00:00Z",
+        "message": {"role": "assistant", "content": ""},
+        "done": True,
+        "done_reason": "stop",
+        **ollama_stats(body, latency, answer, load)
+    }) + "\n"
+
+
+@app.post("/v1/chat/completions")
+async def openai_chat(request: Request):
+    body = await request.json()
+    rng = request_rng(body)
+    latency = draw_latency(rng)
+    error = injected_error(rng, openai_format=True)
+    if error is not None:
+        return error
+    answer = draw_answer(rng)
+    if body.get("stream"):
+        return StreamingResponse(openai_stream(body.get("model", "stub"), latency, answer), media_type="text/event-stream")
+    await asyncio.sleep(latency)
+    n = body.get("n") or 1
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stub"),
+        "choices": [{
+            "index": index,
+            "message": {"role": "assistant", "content": answer},
+            "finish_reason": "stop"
+        } for index in range(n)],
+        "usage": {
+            "prompt_tokens": prompt_tokens(body),
+            "completion_tokens": n * len(answer) // 4,
+            "total_tokens": prompt_tokens(body) + n * len(answer) // 4
+        }
+    }
+
+
+@app.post("/api/chat")
+async def ollama_chat(request: Request):
+    body = await request.json()
+    rng = request_rng(body)
+    latency = draw_latency(rng)
+    error = injected_error(rng, openai_format=False)
+    if error is not None:
+        return error
+    answer = ollama_answer(body, rng)
+    load = await load_model(body)
+    if body.get("stream"):
+        return StreamingResponse(ollama_stream(body.get("model", "stub"), body, latency, answer, load),
+                                 media_type="application/x-ndjson")
+    await asyncio.sleep(latency)
+    return {
+        "model": body.get("model", "stub"),
+        "created_at": "1970-01-01T00:00:00Z",
+        "message": {"role": "assistant", "content": answer},
+        "done": True,
+        "done_reason": "stop",
+        **ollama_stats(body, latency, answer, load)
+    }
+
+
+@app.post("/api/generate")
+async def ollama_generate(request: Request):
+    # Only the empty-prompt form, which loads the model (warm-up)
+    body = await request.json()
+    load = await load_model(body)
+    return {
+        "model": body.get("model", "stub"),
+        "created_at": "1970-01-01T00:00:00Z",
+        "response": "",
+        "done": True,
+        "done_reason": "load",
+        "load_duration": int(load * 1e9),
+    }
+
+
+@app.get("/api/ps")
+async def ollama_ps():
+    now = time.time()
+    return {"models": [
+        {"model": name, "name": name, "digest": "stub", "size": 0, "size_vram": 0,
+         "expires_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(min(expires_at, now + 10 * 365 * 86400)))}
+        for name, expires_at in loaded_models.items() if expires_at > now
+    ]}
+
+
+@app.get("/api/tags")
+async def ollama_tags():
+    return {"models": [
+        {"model": name, "name": name, "modified_at": "1970-01-01T00:00:00Z", "size": 0, "digest": "stub"}
+        for name in ("llama-3.3-70b-instruct:q4", "stub-model:latest")
+    ]}
+
+
+def serve_in_subprocess(port: int = 8999, **settings) -> subprocess.Popen:
+    """
+    Start the stub in its own process (so it does not compete with the measured
+    client for the GIL) and wait until it accepts connections.
+    `settings` override the STUB_* environment, e.g. latency_ms=50, error_rate=0.01.
+    """
+    env = {**os.environ, "STUB_PORT": str(port)}
+    env.update({f"STUB_{name.upper()}": str(value) for name, value in settings.items()})
+    proc = subprocess.Popen([sys.executable, "-m", "bench.stub_provider"], env=env)
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"Stub provider did not start on port {port}")
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, host="127.0.0.1", port=int(os.getenv("STUB_PORT", "8999")), log_level="warning")
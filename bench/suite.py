@@ -0,0 +1,307 @@
+"""
+Offline benchmark suite: the backend's own overhead against the stub provider.
+
+Drives the full FastAPI app in-process (httpx ASGITransport, so the client side
+opens no sockets) through locust-style scenarios and reports throughput, latency
+percentiles and memory per scenario. The response cache, request coalescing and
+the generation store are switched off and every request carries distinct labels,
+so each request reaches the (stub) provider.
+
+    single      one request at a time
+    concurrent  --users workers sending requests back to back
+    batch       /generate_shortcut/batch with --batch-size items per call
+    stream      /generate_shortcut/stream, time to first token and to result
+
+ASGITransport hands the client the response only once the app has sent all of it, so the
+stream scenario talks to the same app served by uvicorn on a loopback socket (in this
+process and event loop, lifespan off like the other scenarios) to see tokens as they arrive.
+
+Results are written as JSON together with the git commit, so runs of two commits
+can be compared:
+
+    python -m bench.suite --provider ollama --out bench/results/$(git rev-parse --short HEAD).json
+    python -m bench.suite --compare bench/results/abc1234.json bench/results/def5678.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional
+
+import httpx
+import uvicorn
+
+from bench.load import MODELS, STUB_PORT, load_backend
+from bench.stub_provider import serve_in_subprocess
+
+SCENARIOS = ("single", "concurrent", "batch", "stream")
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, int(round(q / 100 * len(values))) - 1))]
+
+
+def rss_mb() -> float:
+    """Current resident set size (peak RSS where /proc is not available)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def git_commit() -> Dict[str, Any]:
+    def git(*args):
+        return subprocess.run(["git", *args], capture_output=True, text=True, check=True).stdout.strip()
+    try:
+        return {"commit": git("rev-parse", "--short", "HEAD"), "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": "unknown", "dirty": None}
+
+
+def request_body(provider: str, i: int) -> Dict[str, Any]:
+    # Distinct labels per request, identical across runs
+    return {
+        "A_label": "Person", "p_label": "worksFor", "B_label": "Company", "r_label": "locatedIn",
+        "C_label": f"City{i}", "use_few_shot": False, "model_name": MODELS[provider],
+    }
+
+
+def summarize(latencies: List[float], wall: float, units: int, errors: int) -> Dict[str, Any]:
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "wall_s": round(wall, 3),
+        "throughput_per_s": round(units / wall, 2) if wall else 0.0,
+        **{f"p{q}_ms": round(percentile(latencies, q) * 1000, 2) for q in (50, 90, 99)},
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+    }
+
+
+async def timed_post(client: httpx.AsyncClient, path: str, body: Any):
+    start = time.perf_counter()
+    res = await client.post(path, json=body)
+    return time.perf_counter() - start, res
+
+
+async def run_single(client, provider: str, requests: int, **_):
+    latencies, errors = [], 0
+    start = time.perf_counter()
+    for i in range(requests):
+        latency, res = await timed_post(client, "/generate_shortcut", request_body(provider, i))
+        latencies.append(latency)
+        errors += res.status_code != 200
+    return summarize(latencies, time.perf_counter() - start, requests, errors)
+
+
+async def run_concurrent(client, provider: str, requests: int, users: int, **_):
+    latencies, errors = [], 0
+    next_index = iter(range(requests))
+
+    async def user():
+        nonlocal errors
+        for i in next_index:
+            latency, res = await timed_post(client, "/generate_shortcut", request_body(provider, i))
+            latencies.append(latency)
+            errors += res.status_code != 200
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(users)))
+    return summarize(latencies, time.perf_counter() - start, requests, errors)
+
+
+async def run_batch(client, provider: str, requests: int, batch_size: int, **_):
+    """Throughput is items per second, latencies are per batch call."""
+    latencies, errors, items = [], 0, 0
+    start = time.perf_counter()
+    for offset in range(0, requests, batch_size):
+        body = [request_body(provider, i) for i in range(offset, min(offset + batch_size, requests))]
+        latency, res = await timed_post(client, "/generate_shortcut/batch", body)
+        latencies.append(latency)
+        items += len(body)
+        errors += len(body) if res.status_code != 200 else sum(item["error"] is not None for item in res.json())
+    return summarize(latencies, time.perf_counter() - start, items, errors)
+
+
+async def run_stream(client, provider: str, requests: int, users: int, **_):
+    latencies, first_token, errors = [], [], 0
+    next_index = iter(range(requests))
+
+    async def user():
+        nonlocal errors
+        for i in next_index:
+            start = time.perf_counter()
+            got_token, ok = False, False
+            async with client.stream("POST", "/generate_shortcut/stream", json=request_body(provider, i)) as res:
+                async for line in res.aiter_lines():
+                    if line == "event: token" and not got_token:
+                        got_token = True
+                        first_token.append(time.perf_counter() - start)
+                    ok = ok or line == "event: result"
+            latencies.append(time.perf_counter() - start)
+            errors += not ok
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(users)))
+    summary = summarize(latencies, time.perf_counter() - start, requests, errors)
+    first_token.sort()
+    summary.update({f"ttft_p{q}_ms": round(percentile(first_token, q) * 1000, 2) for q in (50, 99)})
+    return summary
+
+
+RUNNERS = {"single": run_single, "concurrent": run_concurrent, "batch": run_batch, "stream": run_stream}
+
+
+# Scenarios that need a real server: ASGITransport buffers whole responses
+SERVED_SCENARIOS = ("stream",)
+SERVER_PORT = 8998
+
+
+async def start_server(app) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=SERVER_PORT, lifespan="off", log_level="warning"))
+    server.task = asyncio.ensure_future(server.serve())
+    while not server.started:
+        if server.task.done():
+            server.task.result()
+        await asyncio.sleep(0.01)
+    return server
+
+
+async def run_scenario(backend, name: str, trace_memory: bool, **options) -> Dict[str, Any]:
+    server = None
+    if name in SERVED_SCENARIOS:
+        server = await start_server(backend.app)
+        client = httpx.AsyncClient(base_url=f"http://127.0.0.1:{SERVER_PORT}", timeout=None,
+                                   limits=httpx.Limits(max_connections=None, max_keepalive_connections=None))
+    else:
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=backend.app), base_url="http://bench", timeout=None)
+    async with client:
+        rss_before = rss_mb()
+        if trace_memory:
+            tracemalloc.start()
+        try:
+            summary = await RUNNERS[name](client, **options)
+            if trace_memory:
+                summary["py_alloc_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2)
+        finally:
+            if trace_memory:
+                tracemalloc.stop()
+        summary["rss_mb"] = round(rss_mb(), 1)
+        summary["rss_growth_mb"] = round(summary["rss_mb"] - rss_before, 1)
+    if server is not None:
+        server.should_exit = True
+        await server.task
+    return summary
+
+
+def print_report(report: Dict[str, Any]):
+    stub = report["settings"]["stub"]
+    print(f"commit {report['commit']}{' (dirty)' if report['dirty'] else ''}  provider={report['settings']['provider']}  "
+          f"stub latency={stub['latency_ms']}±{stub['jitter_ms']} ms  error rate={stub['error_rate']}")
+    for name, s in report["scenarios"].items():
+        line = (f"{name:<11} n={s['requests']:<5} err={s['errors']:<4} {s['throughput_per_s']:9.1f}/s  "
+                f"p50={s['p50_ms']:8.1f}  p90={s['p90_ms']:8.1f}  p99={s['p99_ms']:8.1f} ms  "
+                f"rss={s['rss_mb']:.0f} MB ({s['rss_growth_mb']:+.1f})")
+        if "ttft_p50_ms" in s:
+            line += f"  ttft p50={s['ttft_p50_ms']:.1f} ms"
+        if "py_alloc_peak_mb" in s:
+            line += f"  py peak={s['py_alloc_peak_mb']:.1f} MB"
+        print(line)
+
+
+def compare(old_path: str, new_path: str):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{old['commit']} -> {new['commit']}")
+    for name in new["scenarios"]:
+        if name not in old["scenarios"]:
+            continue
+        parts = []
+        for metric in ("throughput_per_s", "p50_ms", "p99_ms", "rss_mb"):
+            before, after = old["scenarios"][name][metric], new["scenarios"][name][metric]
+            change = (after - before) / before * 100 if before else 0.0
+            parts.append(f"{metric}={before:g}->{after:g} ({change:+.1f}%)")
+        print(f"{name:<11} " + "  ".join(parts))
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--provider", choices=sorted(MODELS), default="ollama")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma separated subset of: " + ", ".join(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=200, help="Requests (or batch items) per scenario.")
+    parser.add_argument("--users", type=int, default=50, help="Concurrent users of the concurrent/stream scenarios.")
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Stub provider latency.")
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Share of stub answers that are not clean JSON.")
+    parser.add_argument("--seed", default="0")
+    parser.add_argument("--trace-memory", action="store_true", help="Also report peak Python allocations (slower).")
+    parser.add_argument("--out", help="Write the report as JSON to this file.")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Compare two JSON reports and exit.")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    stub_settings = {"latency_ms": args.latency_ms, "jitter_ms": args.jitter_ms, "error_rate": args.error_rate,
+                     "error_status": args.error_status, "malformed_rate": args.malformed_rate, "seed": args.seed}
+    # Every request has to reach the provider
+    os.environ["RESPONSE_CACHE_BACKEND"] = "off"
+    os.environ["REQUEST_COALESCING"] = "false"
+    os.environ["GENERATION_STORE_BACKEND"] = "off"
+    os.environ["PROMPTS_RELOAD_INTERVAL"] = "0"
+
+    stub = serve_in_subprocess(port=STUB_PORT, **stub_settings)
+    try:
+        backend = load_backend()
+        report = {
+            **git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "settings": {"provider": args.provider, "requests": args.requests, "users": args.users,
+                         "batch_size": args.batch_size, "stub": stub_settings},
+            "scenarios": {},
+        }
+        options = dict(provider=args.provider, requests=args.requests, users=args.users, batch_size=args.batch_size)
+
+        async def run_all():
+            # One event loop for all scenarios, the provider clients are bound to it
+            for name in scenarios:
+                report["scenarios"][name] = await run_scenario(backend, name, args.trace_memory, **options)
+
+        asyncio.run(run_all())
+    finally:
+        stub.terminate()
+
+    print_report(report)
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+# Gunicorn configuration for production serving: `gunicorn -c gunicorn.conf.py asgi:app`
+import multiprocessing
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '8000')}"
+
+# Async workers are I/O bound (waiting on LLM providers), one per core is enough
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Import the app once in the master and fork it, so workers start (and restart) in milliseconds.
+# Provider clients, pools and network probes are created lazily inside each worker.
+preload_app = True
+
+# Long generations stream for a while; graceful_timeout lets in-flight requests finish on shutdown
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "300"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+
+# Recycle workers now and then to bound memory growth of in-process caches
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "10000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "1000"))
+
+accesslog = "-"
+errorlog = "-"
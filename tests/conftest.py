@@ -0,0 +1,31 @@
+import asyncio
+import os
+
+import httpx
+import pytest
+
+
+@pytest.fixture(scope="session")
+def backend():
+    """The app module, with every on-disk store and background task switched off."""
+    os.environ["GENERATION_STORE_BACKEND"] = "off"
+    os.environ["JOB_STORE_BACKEND"] = "off"
+    os.environ["RESPONSE_CACHE_BACKEND"] = "memory"
+    os.environ["PROMPTS_RELOAD_INTERVAL"] = "0"
+    os.environ["OLLAMA_WARMUP"] = "false"
+    from bench.load import load_backend
+    return load_backend()
+
+
+@pytest.fixture
+def call_app(backend):
+    """call_app(method, path, **kwargs) -> httpx.Response, through the ASGI app in-process."""
+
+    def call(method: str, path: str, **kwargs) -> httpx.Response:
+        async def request():
+            transport = httpx.ASGITransport(app=backend.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                return await client.request(method, path, **kwargs)
+        return asyncio.run(request())
+
+    return call
@@ -0,0 +1,188 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from utils.admission import AdmissionConfig, AdmissionController, CircuitBreaker, CircuitOpen
+from utils.engines import ProviderEngine
+
+
+class Request:
+    model_name = "m"
+
+
+class FakeEngine(ProviderEngine):
+    """Engine whose provider answers with the `tokens` list, after `delay` seconds."""
+
+    def __init__(self, tokens=("{", "}"), delay=0.0, error=None):
+        super().__init__(max_concurrency=4)
+        self.tokens = tokens
+        self.delay = delay
+        self.error = error
+
+    async def _agenerate(self, data, prompt_text):
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return "".join(self.tokens)
+
+    async def _astream(self, data, prompt_text):
+        for token in self.tokens:
+            await asyncio.sleep(self.delay)
+            yield token
+
+
+def controller(**config) -> AdmissionController:
+    settings = dict(breaker_threshold=1, breaker_reset=0.0, max_retries=0)
+    settings.update(config)
+    return AdmissionController("test", AdmissionConfig(**settings))
+
+
+def half_open(admission: AdmissionController):
+    # One failure opens the breaker; with reset 0 the next call is the probe
+    admission.breaker.record_failure()
+    assert admission.breaker.state == "open"
+
+
+def test_breaker_states():
+    breaker = CircuitBreaker(threshold=2, reset=0.0)
+    assert breaker.before_call() is False
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    assert breaker.before_call() is True
+    assert breaker.state == "half_open"
+    with pytest.raises(CircuitOpen):
+        # Only one probe at a time
+        breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    assert breaker.before_call() is True
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.before_call() is False
+
+
+def test_open_breaker_fails_fast():
+    admission = controller(breaker_reset=60.0)
+    half_open(admission)
+
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(admission.admit("m", "prompt"))
+    assert e.value.status_code == 503
+    assert admission.rejections["circuit_open"] == 1
+
+
+def test_cancelled_probe_frees_the_breaker():
+    admission = controller()
+    half_open(admission)
+    engine = FakeEngine(delay=10)
+    engine.admission = admission
+
+    async def cancel_probe():
+        task = asyncio.ensure_future(engine.agenerate(Request(), "prompt"))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_probe())
+    assert admission.breaker.state == "half_open"
+    engine.delay = 0
+    assert asyncio.run(engine.agenerate(Request(), "prompt")) == "{}"
+    assert admission.breaker.state == "closed"
+
+
+def test_rate_limited_probe_frees_the_breaker():
+    admission = controller(rpm=1, max_queue_wait=0.0)
+    half_open(admission)
+    # Use up the one request of this minute
+    admission.limiter("m").reserve(admission.estimate_tokens("prompt"))
+
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(admission.admit("m", "prompt"))
+    assert e.value.status_code == 429
+    assert admission.breaker.before_call() is True
+
+
+def test_engine_error_frees_the_breaker():
+    admission = controller()
+    half_open(admission)
+    # Raised by the engine itself (no provider error as its cause), tells nothing about the provider
+    engine = FakeEngine(error=HTTPException(status_code=500, detail="OPENAI_API_KEY is not set"))
+    engine.admission = admission
+
+    with pytest.raises(HTTPException):
+        asyncio.run(engine.agenerate(Request(), "prompt"))
+    assert admission.breaker.before_call() is True
+
+
+def test_failed_probe_reopens_the_breaker():
+    admission = controller()
+    half_open(admission)
+    engine = FakeEngine(error=httpx.ConnectError("down"))
+    engine.admission = admission
+
+    with pytest.raises(httpx.ConnectError):
+        asyncio.run(engine.agenerate(Request(), "prompt"))
+    assert admission.breaker.state == "open"
+
+
+def test_stream_closed_early_records_success():
+    admission = controller()
+    half_open(admission)
+    engine = FakeEngine(tokens=("{", "}", "trailing", "text"))
+    engine.admission = admission
+
+    async def read_first_two():
+        stream = engine.astream(Request(), "prompt")
+        tokens = [await stream.__anext__(), await stream.__anext__()]
+        # What stream_generation does once the JSON object is complete
+        await stream.aclose()
+        return tokens
+
+    assert asyncio.run(read_first_two()) == ["{", "}"]
+    assert admission.breaker.state == "closed"
+
+
+def test_stream_cancelled_before_first_token_frees_the_breaker():
+    admission = controller()
+    half_open(admission)
+    engine = FakeEngine(delay=10)
+    engine.admission = admission
+
+    async def cancel_stream():
+        async def consume():
+            async for _ in engine.astream(Request(), "prompt"):
+                pass
+        task = asyncio.ensure_future(consume())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_stream())
+    assert admission.breaker.state == "half_open"
+    assert admission.breaker.before_call() is True
+
+
+def test_engine_counts_running_and_waiting_calls():
+    engine = FakeEngine(delay=0.05)
+    engine.max_concurrency = 2
+
+    async def run():
+        calls = [asyncio.ensure_future(engine.agenerate(Request(), "prompt")) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        during = engine.stats()
+        calls[2].cancel()
+        await asyncio.gather(*calls, return_exceptions=True)
+        return during
+
+    during = asyncio.run(run())
+    assert (during["in_use"], during["waiting"]) == (2, 1)
+    # Also after a call was cancelled while it waited for its slot
+    assert (engine.stats()["in_use"], engine.stats()["waiting"]) == (0, 0)
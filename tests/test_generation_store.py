@@ -0,0 +1,92 @@
+import asyncio
+import sqlite3
+import time
+
+from utils.generation_store import SQLiteGenerationStore, make_record
+
+
+def record(key, response=None, inputs=None):
+    return make_record(
+        request={"pattern_name": "3_custom", "model_name": "m", "X_label": "x"},
+        inputs=inputs or {"X_label": "x"},
+        provider="p", prompt_key=key, prompt="prompt", raw_output=f"raw {key}", response=response,
+    )
+
+
+def test_inputs_follow_the_pattern_spec(tmp_path):
+    store = SQLiteGenerationStore(str(tmp_path / "g.sqlite3"))
+    asyncio.run(store.append(record("k", inputs={"X_label": "x", "Y_label": "y"})))
+    [stored] = store.iter_records(pattern_name="3_custom")
+    assert stored["inputs"] == {"X_label": "x", "Y_label": "y"}
+
+
+def test_records_are_found_by_their_inputs(tmp_path):
+    store = SQLiteGenerationStore(str(tmp_path / "g.sqlite3"))
+    asyncio.run(store.append(record("a", inputs={"X_label": "x", "Y_label": "y"})))
+    asyncio.run(store.append(record("b", inputs={"X_label": "other"})))
+    found = store.iter_records(pattern_name="3_custom", inputs={"Y_label": "y", "X_label": "x"}, model_name="m")
+    assert [r["prompt_key"] for r in found] == ["a"]
+
+    plan = store.conn.execute(
+        "EXPLAIN QUERY PLAN SELECT id FROM generations WHERE pattern_name = ? AND inputs_key = ? AND model_name = ?",
+        ("3_custom", "k", "m"),
+    ).fetchall()
+    assert "idx_generations_pattern_inputs" in str(plan)
+
+
+def test_lookup_returns_parsed_generations_only(tmp_path):
+    store = SQLiteGenerationStore(str(tmp_path / "g.sqlite3"))
+    asyncio.run(store.append(record("k", response={"ok": True})))
+    asyncio.run(store.append(record("k")))
+    assert asyncio.run(store.lookup("k")) == "raw k"
+    assert asyncio.run(store.lookup("other")) is None
+
+
+def test_max_rows_and_retention(tmp_path, monkeypatch):
+    monkeypatch.setattr("utils.generation_store.PRUNE_EVERY", 1)
+    store = SQLiteGenerationStore(str(tmp_path / "g.sqlite3"), max_rows=3)
+    for i in range(5):
+        asyncio.run(store.append(record(str(i))))
+    assert [r["prompt_key"] for r in store.iter_records()] == ["2", "3", "4"]
+
+    store.retention = 60.0
+    old = record("old")
+    old["created_at"] = time.time() - 120
+    asyncio.run(store.append(old))
+    assert "old" not in [r["prompt_key"] for r in store.iter_records()]
+
+
+def test_store_written_before_the_inputs_column(tmp_path):
+    path = str(tmp_path / "old.sqlite3")
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "CREATE TABLE generations (id INTEGER PRIMARY KEY AUTOINCREMENT, pattern_name TEXT, A_label TEXT, "
+            "p_label TEXT, B_label TEXT, r_label TEXT, C_label TEXT, model_name TEXT, provider TEXT, "
+            "prompt_key TEXT NOT NULL, request TEXT, prompt TEXT, raw_output TEXT, response TEXT, "
+            "latency_ms REAL, prompt_tokens INTEGER, completion_tokens INTEGER, created_at REAL)"
+        )
+        conn.execute("INSERT INTO generations (pattern_name, A_label, prompt_key) VALUES ('1_shortcut', 'A', 'a')")
+    store = SQLiteGenerationStore(path)
+    asyncio.run(store.append(record("b")))
+    assert [r["inputs"] for r in store.iter_records()] == [None, {"X_label": "x"}]
+    assert [r["prompt_key"] for r in store.iter_records(inputs={"X_label": "x"})] == ["b"]
+    indexes = {row[1] for row in store.conn.execute("PRAGMA index_list(generations)")}
+    assert "idx_generations_pattern_inputs" in indexes
+
+
+def test_generation_is_recorded_with_its_pattern_inputs(tmp_path, monkeypatch, backend):
+    store = SQLiteGenerationStore(str(tmp_path / "g.sqlite3"))
+    monkeypatch.setattr(backend, "generation_store", store)
+
+    async def call_llm_chat(data, prompt_text):
+        backend.mark_provider_answer(time.perf_counter())
+        return '{"property_name": "hasCity", "explanation": ""}'
+
+    monkeypatch.setattr(backend, "call_llm_chat", call_llm_chat)
+    data = backend.Pattern1Request(A_label="Recorded", p_label="p", B_label="B", r_label="r", C_label="C",
+                                   use_few_shot=False, model_name="gpt-4o", temperature=0.5)
+    asyncio.run(backend.run_pattern_once(data))
+
+    [stored] = store.iter_records()
+    assert stored["inputs"] == {"A_label": "Recorded", "p_label": "p", "B_label": "B", "r_label": "r", "C_label": "C"}
+    assert stored["response"]["property_name"] == "hasCity"
@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from utils.hedging import race
+
+
+def answer(result, delay=0.0, error=None, cancelled=None):
+    async def call():
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            if cancelled is not None:
+                cancelled.append(result)
+            raise
+        if error is not None:
+            raise error
+        return result
+    return call
+
+
+def test_fast_primary_is_not_hedged():
+    assert asyncio.run(race(answer("primary"), answer("fallback"), delay=1.0)) == ("primary", "primary", False)
+
+
+def test_slow_primary_loses_to_the_fallback():
+    cancelled = []
+    result = asyncio.run(race(answer("primary", delay=1.0, cancelled=cancelled), answer("fallback"), delay=0.01))
+    assert result == ("fallback", "fallback", True)
+    assert cancelled == ["primary"]
+
+
+def test_slow_primary_can_still_win():
+    cancelled = []
+    result = asyncio.run(race(answer("primary", delay=0.02), answer("fallback", delay=1.0, cancelled=cancelled),
+                              delay=0.01))
+    assert result == ("primary", "primary", True)
+    assert cancelled == ["fallback"]
+
+
+def test_failed_primary_starts_the_fallback_at_once():
+    result = asyncio.run(race(answer("primary", error=ValueError("down")), answer("fallback"), delay=10.0))
+    assert result == ("fallback", "fallback", True)
+
+
+def test_both_failing_raise_the_primary_error():
+    with pytest.raises(ValueError, match="primary"):
+        asyncio.run(race(answer("p", delay=0.02, error=ValueError("primary")),
+                         answer("f", error=KeyError("fallback")), delay=0.01))
+
+
+def test_cancelled_race_cancels_both_calls():
+    cancelled = []
+
+    async def main():
+        task = asyncio.ensure_future(race(answer("primary", delay=1.0, cancelled=cancelled),
+                                          answer("fallback", delay=1.0, cancelled=cancelled), delay=0.01))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert sorted(cancelled) == ["fallback", "primary"]
@@ -0,0 +1,102 @@
+import asyncio
+import time
+
+from utils.jobs import JobWorker, SQLiteJobStore
+
+
+def job_store(tmp_path, items=3):
+    store = SQLiteJobStore(str(tmp_path / "jobs.sqlite3"))
+    job_id = asyncio.run(store.submit("echo", {}, ({"n": n} for n in range(items))))
+    return store, job_id
+
+
+def test_expired_lease_is_claimed_by_another_worker(tmp_path):
+    store, job_id = job_store(tmp_path, items=1)
+    [item] = asyncio.run(store.claim("dead", 10, lease=0.05))
+    assert asyncio.run(store.claim("alive", 10, lease=60)) == []
+
+    time.sleep(0.1)
+    [again] = asyncio.run(store.claim("alive", 10, lease=60))
+    assert again[:2] == item[:2] == (job_id, 0)
+
+    # The worker that lost the lease cannot complete the item any more
+    assert asyncio.run(store.complete("dead", job_id, 0, {"index": 0}, failed=False)) is False
+    assert asyncio.run(store.complete("alive", job_id, 0, {"index": 0}, failed=False)) is True
+    assert asyncio.run(store.progress(job_id))["status"] == "done"
+
+
+def test_renewed_lease_is_kept(tmp_path):
+    store, job_id = job_store(tmp_path, items=1)
+    asyncio.run(store.claim("w", 10, lease=0.05))
+    asyncio.run(store.renew("w", [(job_id, 0)], lease=60))
+    time.sleep(0.1)
+    assert asyncio.run(store.claim("other", 10, lease=60)) == []
+
+
+def test_released_items_are_claimable_at_once(tmp_path):
+    store, job_id = job_store(tmp_path, items=2)
+    claimed = asyncio.run(store.claim("w", 10, lease=60))
+    asyncio.run(store.release("w", [item[:2] for item in claimed]))
+    assert [item[1] for item in asyncio.run(store.claim("other", 10, lease=60))] == [0, 1]
+
+
+def test_cancelled_job_is_not_claimed(tmp_path):
+    store, job_id = job_store(tmp_path, items=2)
+    asyncio.run(store.claim("w", 1, lease=60))
+    assert asyncio.run(store.cancel(job_id)) is True
+    assert asyncio.run(store.renew("w", [(job_id, 0)], lease=60)) == {job_id}
+    assert asyncio.run(store.claim("other", 10, lease=60)) == []
+
+
+def test_stopped_worker_hands_its_items_to_the_next(tmp_path):
+    store, job_id = job_store(tmp_path, items=3)
+    started = []
+
+    async def stuck(idx, payload, settings):
+        started.append(idx)
+        await asyncio.sleep(10)
+
+    async def echo(idx, payload, settings):
+        return {"index": idx, "n": payload["n"]}
+
+    async def main():
+        first = JobWorker(store, {"echo": stuck}, concurrency=2, poll_interval=0.01)
+        first.start()
+        while len(started) < 2:
+            await asyncio.sleep(0.01)
+        await first.stop()
+
+        second = JobWorker(store, {"echo": echo}, concurrency=2, poll_interval=0.01)
+        second.start()
+        while (await store.progress(job_id))["status"] != "done":
+            await asyncio.sleep(0.01)
+        await second.stop()
+        return second
+
+    second = asyncio.run(main())
+    assert second.completed == 3
+    results = asyncio.run(store.results(job_id))
+    assert sorted(result["n"] for result in results) == [0, 1, 2]
+
+
+def test_item_outliving_its_leases_is_failed(tmp_path):
+    store, job_id = job_store(tmp_path, items=1)
+    store.max_attempts = 2
+    for _ in range(2):
+        assert len(asyncio.run(store.claim("w", 10, lease=0.01))) == 1
+        time.sleep(0.02)
+
+    assert asyncio.run(store.claim("w", 10, lease=60)) == []
+    progress = asyncio.run(store.progress(job_id))
+    assert (progress["status"], progress["completed"], progress["failed"]) == ("done", 1, 1)
+    [result] = asyncio.run(store.results(job_id))
+    assert result["index"] == 0 and "claimed 2 times" in result["error"]["detail"]
+
+
+def test_released_item_keeps_its_attempts(tmp_path):
+    store, job_id = job_store(tmp_path, items=1)
+    store.max_attempts = 1
+    for _ in range(3):
+        [item] = asyncio.run(store.claim("w", 10, lease=60))
+        asyncio.run(store.release("w", [item[:2]]))
+    assert len(asyncio.run(store.claim("w", 10, lease=60))) == 1
@@ -0,0 +1,24 @@
+BODY = dict(A_label="Person", p_label="worksFor", B_label="Company", r_label="locatedIn", C_label="City",
+            use_few_shot=False)
+
+
+def test_unknown_model_is_rejected_without_new_series(call_app):
+    res = call_app("POST", "/generate_shortcut", json={**BODY, "model_name": "nope"})
+    assert res.status_code == 400
+    assert "gpt-4o" in res.json()["detail"]
+
+    res = call_app("POST", "/generate/subclass/batch", json=[{**BODY, "model_name": "nope2"}])
+    assert res.json()[0]["error"]["status_code"] == 400
+
+    res = call_app("POST", "/generate_shortcut/stream", json={**BODY, "model_name": "nope3"})
+    assert '"status_code":400' in res.text
+
+    assert call_app("POST", "/shortcut_prompt", json={**BODY, "model_name": "nope4"}).status_code == 400
+
+    metrics = call_app("GET", "/metrics").text
+    assert 'model="nope' not in metrics
+
+
+def test_stage_labels_of_unknown_model(backend):
+    data = backend.Pattern1Request(**BODY, model_name="x" * 100)
+    assert backend.stage_labels(data) == {"pattern": "1_shortcut", "model": "unknown", "provider": "unknown"}
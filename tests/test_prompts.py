@@ -0,0 +1,24 @@
+BODY = dict(A_label="Person", p_label="worksFor", B_label="Company", r_label="locatedIn", C_label="City",
+            use_few_shot=False, model_name="gpt-4o")
+
+
+def test_prompt_endpoint_returns_the_full_prompt(call_app):
+    for path in ("/shortcut_prompt", "/prompt/shortcut"):
+        res = call_app("POST", path, json=BODY).json()
+        assert res["system"] and res["user"]
+        assert res["prompt"] == res["system"] + "\n\n" + res["user"]
+        assert "Person" in res["prompt"] and "Property p" in res["prompt"]
+
+
+def test_shipped_example_libraries(capsys):
+    from utils.examples import ExampleIndex, embed_examples, read_examples
+    for pattern in ("1_shortcut", "2_subclass"):
+        path = f"prompts/{pattern}/examples.jsonl"
+        index = ExampleIndex.from_file(path)
+        assert "Warning" not in capsys.readouterr().out, f"rebuild {pattern}/examples.npy"
+        assert (index.embeddings == embed_examples(read_examples(path))).all()
+
+
+def test_few_shot_prompt_uses_the_library(call_app):
+    res = call_app("POST", "/shortcut_prompt", json={**BODY, "use_few_shot": True}).json()
+    assert "worksInCity" in res["prompt"]
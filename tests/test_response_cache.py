@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+BODY = dict(p_label="worksFor", B_label="Company", r_label="locatedIn", C_label="City",
+            use_few_shot=False, model_name="gpt-4o", temperature=0.0)
+
+VALID = '{"property_name": "employerLocatedIn", "explanation": "x"}'
+
+
+def answer_with(monkeypatch, backend, answers):
+    """Replace the provider call by one returning `answers` in turn, returns the list of prompts sent."""
+    prompts = []
+
+    async def call_llm_chat(data, prompt_text):
+        prompts.append(prompt_text)
+        backend.mark_provider_answer(0.0)
+        return answers.pop(0)
+
+    monkeypatch.setattr(backend, "call_llm_chat", call_llm_chat)
+    return prompts
+
+
+def generate(backend, a_label):
+    return asyncio.run(backend.run_pattern_once(backend.Pattern1Request(**BODY, A_label=a_label)))
+
+
+def test_unusable_answer_is_not_cached(monkeypatch, backend):
+    monkeypatch.setattr(backend, "STRUCTURED_OUTPUT_REASK", False)
+    prompts = answer_with(monkeypatch, backend, ["no json here", VALID])
+
+    with pytest.raises(HTTPException):
+        generate(backend, "Unusable")
+    assert generate(backend, "Unusable").property_name == "employerLocatedIn"
+    assert len(prompts) == 2
+
+    # The parsed answer is served from the cache from now on
+    assert generate(backend, "Unusable").property_name == "employerLocatedIn"
+    assert len(prompts) == 2
+
+
+def test_reasked_answer_is_cached(monkeypatch, backend):
+    monkeypatch.setattr(backend, "STRUCTURED_OUTPUT_REASK", True)
+    prompts = answer_with(monkeypatch, backend, ["no json here", VALID])
+
+    assert generate(backend, "Reasked").property_name == "employerLocatedIn"
+    assert generate(backend, "Reasked").property_name == "employerLocatedIn"
+    assert len(prompts) == 2
@@ -0,0 +1,24 @@
+import json
+
+
+def test_payload_items_are_decoded(call_app):
+    data = json.dumps([json.dumps({"a": 1}), {"b": "ü"}, json.dumps([1, 2])])
+    assert call_app("POST", "/_temp_localstorage_data", json={"uuid": "ok", "data": data}).status_code == 200
+
+    res = call_app("GET", "/_temp_localstorage_data", params={"uuid": "ok", "wait": 0})
+    assert res.json() == [{"a": 1}, {"b": "ü"}, [1, 2]]
+
+
+def test_item_cannot_inject_json(call_app):
+    data = json.dumps(['not json,1],"x":[2]'])
+    res = call_app("POST", "/_temp_localstorage_data", json={"uuid": "inject", "data": data})
+    assert res.status_code == 400
+
+    res = call_app("GET", "/_temp_localstorage_data", params={"uuid": "inject", "wait": 0})
+    assert res.json() is None
+
+
+def test_payload_must_be_a_list(call_app):
+    for data in (json.dumps({"a": "1"}), {"a": "1"}, "not json"):
+        res = call_app("POST", "/_temp_localstorage_data", json={"uuid": "shape", "data": data})
+        assert res.status_code == 400, data
@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+from utils.singleflight import SingleFlight
+
+
+def test_identical_calls_share_one_call():
+    flight = SingleFlight()
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    async def main():
+        return await asyncio.gather(*(flight.do("k", call) for _ in range(3)))
+
+    assert asyncio.run(main()) == ["answer"] * 3
+    assert len(calls) == 1
+    assert flight.stats()["deduplicated"] == 2
+    assert flight.stats()["in_flight"] == {}
+
+
+def test_cancelled_caller_does_not_cancel_the_others():
+    flight = SingleFlight()
+    cancelled = []
+
+    async def call():
+        try:
+            await asyncio.sleep(0.05)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+        return "answer"
+
+    async def main():
+        first = asyncio.ensure_future(flight.do("k", call))
+        second = asyncio.ensure_future(flight.do("k", call))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(main()) == "answer"
+    assert cancelled == []
+
+
+def test_call_is_cancelled_with_its_last_caller():
+    flight = SingleFlight()
+    cancelled = []
+
+    async def call():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+
+    async def main():
+        callers = [asyncio.ensure_future(flight.do("k", call)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0)
+        assert flight.stats()["in_flight"] == {}
+        # A new caller starts a fresh call instead of joining the cancelled one
+        return await flight.do("k", lambda: asyncio.sleep(0, result="fresh"))
+
+    assert asyncio.run(main()) == "fresh"
+    assert cancelled == [1]
+
+
+def test_error_reaches_every_caller():
+    flight = SingleFlight()
+
+    async def call():
+        await asyncio.sleep(0.01)
+        raise ValueError("provider down")
+
+    async def main():
+        return await asyncio.gather(*(flight.do("k", call) for _ in range(2)), return_exceptions=True)
+
+    assert [type(result) for result in asyncio.run(main())] == [ValueError, ValueError]
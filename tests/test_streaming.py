@@ -0,0 +1,27 @@
+import json
+
+BODY = dict(A_label="Person", p_label="worksFor", B_label="Company", r_label="locatedIn", C_label="City",
+            use_few_shot=False, model_name="gpt-4o", temperature=0.0)
+
+
+def events(text):
+    """(event, data) pairs of an SSE body."""
+    parsed = []
+    for block in text.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        parsed.append((fields["event"], json.loads(fields["data"])))
+    return parsed
+
+
+def test_unexpected_error_ends_the_stream_with_an_error_event(monkeypatch, backend, call_app):
+    async def stream_llm_chat(data, prompt_text):
+        yield '{"property_name": '
+        raise RuntimeError("connection reset")
+
+    monkeypatch.setattr(backend, "stream_llm_chat", stream_llm_chat)
+    response = call_app("POST", "/generate_shortcut/stream", json=BODY)
+
+    assert response.status_code == 200
+    received = events(response.text)
+    assert received[0] == ("token", {"delta": '{"property_name": '})
+    assert received[-1] == ("error", {"status_code": 500, "detail": "connection reset"})
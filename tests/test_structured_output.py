@@ -0,0 +1,49 @@
+import pytest
+
+from utils.structured_output import (JsonObjectExtractor, StructuredOutputError, compile_schema,
+                                     parse_structured_output)
+
+SCHEMA = {"type": "object", "properties": {"property_name": {"type": "string"}}, "required": ["property_name"]}
+
+
+def feed_chunks(text, size):
+    extractor = JsonObjectExtractor()
+    completed = [extractor.feed(text[i:i + size]) for i in range(0, len(text), size)]
+    return extractor, [c for c in completed if c is not None]
+
+
+@pytest.mark.parametrize("size", [1, 3, 1000])
+def test_object_is_reported_when_its_brace_arrives(size):
+    text = 'Sure!\n```json\n{"property_name": "a}b{", "explanation": "say \\"hi\\" {"}\n```\nmore'
+    extractor, completed = feed_chunks(text, size)
+    assert completed == ['{"property_name": "a}b{", "explanation": "say \\"hi\\" {"}']
+    assert extractor.partial is None
+
+
+def test_first_completed_object_of_a_chunk():
+    extractor = JsonObjectExtractor()
+    assert extractor.feed('{"a": [1, {"b": 2}]} {"c": 3}') == '{"a": [1, {"b": 2}]}'
+    assert extractor.objects == ['{"a": [1, {"b": 2}]}', '{"c": 3}']
+
+
+def test_truncated_stream_is_closed():
+    extractor, completed = feed_chunks('{"property_name": "hasCi', 4)
+    assert completed == []
+    assert extractor.close_partial() == '{"property_name": "hasCi"}'
+    value, repaired = parse_structured_output("", compile_schema(SCHEMA), extractor)
+    assert value == {"property_name": "hasCi"} and repaired
+
+
+def test_streamed_extractor_is_reused_by_the_parser():
+    text = '{"other": 1} then {"property_name": "hasCity",}'
+    extractor, _ = feed_chunks(text, 5)
+    value, repaired = parse_structured_output(text, compile_schema(SCHEMA), extractor)
+    assert value == {"property_name": "hasCity"} and repaired
+
+
+def test_no_object_raises():
+    with pytest.raises(StructuredOutputError, match="no JSON object"):
+        parse_structured_output("no json here", compile_schema(SCHEMA))
+    with pytest.raises(StructuredOutputError) as e:
+        parse_structured_output('{"property_name": 1}', compile_schema(SCHEMA))
+    assert e.value.errors
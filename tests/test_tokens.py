@@ -0,0 +1,60 @@
+import sys
+import threading
+import types
+from types import SimpleNamespace
+
+from utils.engines import OllamaEngine
+from utils.tokens import TokenCounter
+
+
+class FixedCounter:
+    def __init__(self):
+        self.tokens = 0
+
+    def count(self, model_name, text):
+        return self.tokens
+
+
+def request(model_name="llama"):
+    return SimpleNamespace(model_name=model_name, output_schema={}, temperature=0.0, top_p=1.0, repeat_penalty=1.0)
+
+
+def test_num_ctx_only_grows_per_model():
+    counter = FixedCounter()
+    engine = OllamaEngine(lambda: None, lambda: None, token_counter=counter, completion_tokens=512)
+
+    def num_ctx(model_name="llama"):
+        return engine.chat_kwargs(request(model_name), "prompt")["options"]["num_ctx"]
+
+    assert num_ctx() == 4096
+    counter.tokens = 6000
+    assert num_ctx() == 8192
+    # A small prompt keeps the larger context, switching back would reload the model
+    counter.tokens = 10
+    assert num_ctx() == 8192
+    assert num_ctx("other") == 4096
+
+
+def test_counts_are_estimated_until_the_encoder_is_loaded(monkeypatch):
+    release = threading.Event()
+
+    def get_encoding(name):
+        release.wait(5)
+        return SimpleNamespace(encode_ordinary=lambda text: text.split())
+
+    def encoding_for_model(model_name):
+        return get_encoding("o200k_base")
+
+    fake = types.ModuleType("tiktoken")
+    fake.get_encoding = get_encoding
+    fake.encoding_for_model = encoding_for_model
+    monkeypatch.setitem(sys.modules, "tiktoken", fake)
+
+    counter = TokenCounter()
+    text = "one two three"
+    # The first count must not wait for the (downloading) encoder
+    assert counter.count("gpt-4o", text) == 5
+    release.set()
+    counter.preload(["gpt-4o"])
+    assert counter.count("gpt-4o", text) == 3
+    assert counter.stats()["encoders"] == ["gpt-4o"]
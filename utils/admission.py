@@ -0,0 +1,361 @@
+import asyncio
+import email.utils
+import json
+import os
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import httpx
+from fastapi import HTTPException
+
+# -----------------------------
+# Provider admission control
+# -----------------------------
+# Sits in front of every provider call of an engine:
+#   circuit breaker  - while the provider keeps failing, calls fail fast with 503
+#   token buckets    - per model requests/minute and tokens/minute; callers queue for
+#                      capacity and are rejected with 429 if the wait would be too long.
+#                      A provider 429 halves the model's rate, successes restore it.
+#   retries          - transient failures and 429s are retried with exponential backoff
+#                      and full jitter, or after the provider's Retry-After.
+# Configured per provider from the environment (e.g. OPENAI_RPM) with per-model
+# overrides from MODEL_RATE_LIMITS.
+
+RETRYABLE_STATUS = (408, 409, 425, 429, 500, 502, 503, 504)
+TRANSIENT_ERRORS = (httpx.TransportError, ConnectionError, TimeoutError, asyncio.TimeoutError)
+
+
+class CircuitOpen(Exception):
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionConfig:
+    def __init__(
+        self,
+        rpm: float = 0,
+        tpm: float = 0,
+        max_queue_wait: float = 30.0,
+        completion_tokens_estimate: int = 256,
+        max_retries: int = 3,
+        retry_base_delay: float = 0.5,
+        retry_max_delay: float = 30.0,
+        breaker_threshold: int = 5,
+        breaker_reset: float = 30.0,
+    ):
+        self.rpm = rpm  # 0 = unlimited
+        self.tpm = tpm
+        self.max_queue_wait = max_queue_wait
+        self.completion_tokens_estimate = completion_tokens_estimate
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.breaker_threshold = breaker_threshold  # 0 = no circuit breaker
+        self.breaker_reset = breaker_reset
+
+    @classmethod
+    def from_env(cls, provider: str) -> "AdmissionConfig":
+        prefix = provider.upper()
+        default = cls()
+        return cls(
+            rpm=float(os.getenv(f"{prefix}_RPM", default.rpm)),
+            tpm=float(os.getenv(f"{prefix}_TPM", default.tpm)),
+            max_queue_wait=float(os.getenv(f"{prefix}_MAX_QUEUE_WAIT", default.max_queue_wait)),
+            completion_tokens_estimate=int(os.getenv(f"{prefix}_COMPLETION_TOKENS_ESTIMATE", default.completion_tokens_estimate)),
+            max_retries=int(os.getenv(f"{prefix}_MAX_RETRIES", default.max_retries)),
+            retry_base_delay=float(os.getenv(f"{prefix}_RETRY_BASE_DELAY", default.retry_base_delay)),
+            retry_max_delay=float(os.getenv(f"{prefix}_RETRY_MAX_DELAY", default.retry_max_delay)),
+            breaker_threshold=int(os.getenv(f"{prefix}_BREAKER_THRESHOLD", default.breaker_threshold)),
+            breaker_reset=float(os.getenv(f"{prefix}_BREAKER_RESET", default.breaker_reset)),
+        )
+
+    def as_dict(self) -> Dict[str, Any]:
+        return dict(vars(self))
+
+
+def parse_model_limits(value: Optional[str]) -> Dict[str, Dict[str, float]]:
+    """MODEL_RATE_LIMITS: JSON object model_name -> {"rpm": ..., "tpm": ...}."""
+    if not value:
+        return {}
+    try:
+        limits = json.loads(value)
+    except json.JSONDecodeError as e:
+        print(f"Warning: MODEL_RATE_LIMITS is not valid JSON, ignoring it: {e}")
+        return {}
+    return {model: {key: float(limit) for key, limit in entry.items()} for model, entry in limits.items()}
+
+
+def parse_retry_after(headers: Any) -> Optional[float]:
+    """Seconds to wait according to Retry-After (seconds or HTTP date) or OpenAI's retry-after-ms."""
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value is not None:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_error(exc: BaseException, transient_errors: Tuple[type, ...] = TRANSIENT_ERRORS) -> Tuple[Optional[int], Optional[float], bool]:
+    """(HTTP status, Retry-After seconds, transient) of a provider SDK error."""
+    status = getattr(exc, "status_code", None)
+    status = status if isinstance(status, int) and status > 0 else None
+    response = getattr(exc, "response", None)
+    retry_after = parse_retry_after(getattr(response, "headers", None))
+    transient = status in RETRYABLE_STATUS if status is not None else isinstance(exc, transient_errors)
+    return status, retry_after, transient
+
+
+class TokenBucket:
+    """
+    Refills `per_minute` units per minute, holding at most one minute's worth. Callers
+    reserve units up front and wait for the balance to recover, which keeps them in
+    FIFO order without a lock.
+    """
+
+    def __init__(self, per_minute: float):
+        self.per_minute = per_minute
+        self.rate = per_minute / 60.0
+        self.capacity = per_minute
+        self.balance = per_minute
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.balance = min(self.capacity, self.balance + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Take `amount` (at most the capacity) and return the seconds until it is covered."""
+        self._refill()
+        self.balance -= min(amount, self.capacity)
+        return max(0.0, -self.balance / self.rate)
+
+    def refund(self, amount: float):
+        self._refill()
+        self.balance = min(self.capacity, self.balance + min(amount, self.capacity))
+
+    def set_rate(self, per_minute: float):
+        self._refill()
+        self.rate = per_minute / 60.0
+
+
+class ModelLimiter:
+    """RPM and TPM buckets of one model, with multiplicative decrease on provider 429s."""
+
+    MIN_FACTOR = 0.1
+    RECOVERY_STEP = 0.05
+
+    def __init__(self, rpm: float, tpm: float):
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.factor = 1.0
+
+    def reserve(self, tokens: float) -> Tuple[float, Callable[[], None]]:
+        """Reserve one request plus `tokens`; returns the wait and a function undoing the reservation."""
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.reserve(tokens))
+
+        def refund():
+            if self.requests is not None:
+                self.requests.refund(1)
+            if self.tokens is not None:
+                self.tokens.refund(tokens)
+        return wait, refund
+
+    def _apply_factor(self):
+        for bucket in (self.requests, self.tokens):
+            if bucket is not None:
+                bucket.set_rate(bucket.per_minute * self.factor)
+
+    def throttle(self):
+        self.factor = max(self.MIN_FACTOR, self.factor / 2)
+        self._apply_factor()
+
+    def recover(self):
+        if self.factor < 1.0:
+            self.factor = min(1.0, self.factor + self.RECOVERY_STEP)
+            self._apply_factor()
+
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive transient failures; after `reset` seconds one probe call is let through."""
+
+    def __init__(self, threshold: int, reset: float):
+        self.threshold = threshold
+        self.reset = reset
+        self.failures = 0
+        self.state = "closed"
+        self._opened_at = 0.0
+        self._probing = False
+
+    def before_call(self) -> bool:
+        """Raise CircuitOpen to fail fast; returns True when this call is the half-open probe."""
+        if self.threshold <= 0 or self.state == "closed":
+            return False
+        remaining = self._opened_at + self.reset - time.monotonic()
+        if self.state == "open" and remaining <= 0:
+            self.state = "half_open"
+        if self.state == "open" or self._probing:
+            raise CircuitOpen("Provider is unavailable, failing fast.", retry_after=max(remaining, 1.0))
+        self._probing = True
+        return True
+
+    def release_probe(self):
+        """The probe ended without an outcome (cancelled, rejected, engine error): let the next call probe."""
+        self._probing = False
+
+    def record_success(self):
+        self.failures = 0
+        self.state = "closed"
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.threshold > 0 and (self.state == "half_open" or self.failures >= self.threshold):
+            self.state = "open"
+            self._opened_at = time.monotonic()
+
+
+class AdmissionController:
+    """Rate limits, retries and circuit breaker of one provider engine."""
+
+    def __init__(self, provider: str, config: Optional[AdmissionConfig] = None,
+                 model_limits: Optional[Dict[str, Dict[str, float]]] = None):
+        self.provider = provider
+        self.config = config or AdmissionConfig.from_env(provider)
+        self.model_limits = model_limits or {}
+        self.breaker = CircuitBreaker(self.config.breaker_threshold, self.config.breaker_reset)
+        self._limiters: Dict[str, ModelLimiter] = {}
+        self.queued = 0
+        self.retries = 0
+        self.rejections = {"rate_limited": 0, "circuit_open": 0}
+        self.upstream_rate_limited = 0
+
+    def limiter(self, model_name: str) -> ModelLimiter:
+        limiter = self._limiters.get(model_name)
+        if limiter is None:
+            limits = self.model_limits.get(model_name, {})
+            limiter = ModelLimiter(limits.get("rpm", self.config.rpm), limits.get("tpm", self.config.tpm))
+            self._limiters[model_name] = limiter
+        return limiter
+
+    def estimate_tokens(self, prompt_text: str) -> int:
+        # ~4 characters per token plus the expected answer length
+        return len(prompt_text) // 4 + self.config.completion_tokens_estimate
+
+    async def admit(self, model_name: str, prompt_text: str) -> bool:
+        """
+        Wait for the circuit breaker and the model's rate limits to let one call through.
+        Returns True when the call is the breaker's probe: the caller must record its outcome
+        or `breaker.release_probe()` once it is done.
+        """
+        try:
+            probe = self.breaker.before_call()
+        except CircuitOpen as e:
+            self.rejections["circuit_open"] += 1
+            raise HTTPException(status_code=503, detail=f"{self.provider}: {e}",
+                                headers={"Retry-After": str(int(e.retry_after + 0.999))})
+
+        try:
+            wait, refund = self.limiter(model_name).reserve(self.estimate_tokens(prompt_text))
+            if wait > self.config.max_queue_wait:
+                refund()
+                self.rejections["rate_limited"] += 1
+                raise HTTPException(status_code=429, detail=f"Rate limit for {model_name} reached, try again later.",
+                                    headers={"Retry-After": str(int(wait + 0.999))})
+            if wait > 0:
+                self.queued += 1
+                try:
+                    await asyncio.sleep(wait)
+                finally:
+                    self.queued -= 1
+        except BaseException:
+            # Rejected or cancelled while queued, the probe never reached the provider
+            if probe:
+                self.breaker.release_probe()
+            raise
+        return probe
+
+    def on_success(self, model_name: str):
+        self.breaker.record_success()
+        self.limiter(model_name).recover()
+
+    def on_failure(self, model_name: str, exc: Exception, attempt: int, transient_errors: Tuple[type, ...],
+                   can_retry: bool = True) -> float:
+        """Account for a failed call and return the delay before retrying, or raise the error to give up."""
+        if isinstance(exc, HTTPException) and exc.__cause__ is None:
+            # Raised by the engine itself (e.g. missing API key), not by the provider
+            raise exc
+        cause = exc.__cause__ if isinstance(exc, HTTPException) else exc
+        status, retry_after, transient = classify_error(cause, transient_errors)
+        if status == 429:
+            self.upstream_rate_limited += 1
+            self.limiter(model_name).throttle()
+        elif transient:
+            self.breaker.record_failure()
+        elif status is not None:
+            # The provider answered, it is up
+            self.breaker.record_success()
+
+        delay = min(self.config.retry_max_delay, self.config.retry_base_delay * 2 ** attempt) * random.random()
+        if retry_after is not None:
+            delay = retry_after
+        if not (transient and can_retry and attempt < self.config.max_retries and delay <= self.config.retry_max_delay):
+            if status == 429:
+                headers = {"Retry-After": str(int(retry_after + 0.999))} if retry_after is not None else None
+                raise HTTPException(status_code=429, detail=f"{self.provider} rate limit reached for {model_name}.",
+                                    headers=headers) from cause
+            raise exc
+        self.retries += 1
+        return delay
+
+    async def run(self, model_name: str, prompt_text: str, call: Callable[[], Awaitable[Any]],
+                  transient_errors: Tuple[type, ...] = TRANSIENT_ERRORS) -> Any:
+        """Await `call()` under admission control, retrying transient failures."""
+        attempt = 0
+        while True:
+            probe = await self.admit(model_name, prompt_text)
+            try:
+                result = await call()
+            except Exception as e:
+                delay = self.on_failure(model_name, e, attempt, transient_errors)
+            else:
+                self.on_success(model_name)
+                return result
+            finally:
+                # No-op after an outcome was recorded; frees the probe when the call was cancelled
+                # or failed without telling anything about the provider
+                if probe:
+                    self.breaker.release_probe()
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "config": self.config.as_dict(),
+            "queued": self.queued,
+            "retries": self.retries,
+            "rejections": dict(self.rejections),
+            "upstream_rate_limited": self.upstream_rate_limited,
+            "circuit": {"state": self.breaker.state, "consecutive_failures": self.breaker.failures},
+            "rate_factor": {model: limiter.factor for model, limiter in self._limiters.items()},
+        }
@@ -0,0 +1,140 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+# -----------------------------
+# Response cache
+# -----------------------------
+# Caches raw LLM answers keyed on the rendered prompt plus every parameter that
+# influences sampling, so resubmitting the same A/p/B/r/C tuple with the same
+# model and settings does not pay for another provider call.
+
+SAMPLING_FIELDS = ("temperature", "top_p", "frequency_penalty", "presence_penalty", "repeat_penalty")
+
+
+class MemoryCacheBackend:
+    """In-process LRU cache with per-entry TTL."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.evictions = 0
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.evictions += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: str):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def size(self) -> int:
+        return len(self._entries)
+
+
+class RedisCacheBackend:
+    """
+    Redis-backed cache shared by all workers. Entries expire via Redis TTL,
+    size is bounded by the server's `maxmemory` / `maxmemory-policy allkeys-lru`.
+    """
+
+    def __init__(self, url: str, ttl: float = 3600.0, prefix: str = "patterns:cache:"):
+        try:
+            import redis.asyncio as aioredis
+        except ImportError as e:
+            raise RuntimeError("RESPONSE_CACHE_BACKEND=redis requires the 'redis' package") from e
+        self.ttl = ttl
+        self.prefix = prefix
+        self.evictions = 0
+        self._redis = aioredis.Redis.from_url(url, decode_responses=True)
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self._redis.get(self.prefix + key)
+
+    async def set(self, key: str, value: str):
+        await self._redis.set(self.prefix + key, value, ex=max(1, int(self.ttl)))
+
+    def size(self) -> Optional[int]:
+        return None
+
+
+class ResponseCache:
+    """Cache in front of the provider dispatch with hit/miss accounting."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.errors = 0
+
+    @staticmethod
+    def make_key(prompt_text: str, model_name: str, params: Dict[str, Any]) -> str:
+        payload = json.dumps(
+            {"prompt": prompt_text, "model": model_name, "params": params},
+            sort_keys=True,
+            separators=(",", ":"),
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def is_cacheable(self, params: Dict[str, Any], cache_sampled: bool = False) -> bool:
+        """Sampled generations (temperature > 0) bypass the cache unless `cache_sampled` is set."""
+        return params.get("temperature", 0.0) <= 0 or cache_sampled
+
+    async def lookup(self, key: str) -> Optional[str]:
+        try:
+            cached = await self.backend.get(key)
+        except Exception as e:
+            print(f"Warning: response cache lookup failed: {e}")
+            self.errors += 1
+            cached = None
+        if cached is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return cached
+
+    async def store(self, key: str, answer: str):
+        try:
+            await self.backend.set(key, answer)
+        except Exception as e:
+            print(f"Warning: response cache store failed: {e}")
+            self.errors += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "skipped": self.skipped,
+            "errors": self.errors,
+            "evictions": self.backend.evictions,
+            "size": self.backend.size(),
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def build_response_cache(backend: str, maxsize: int, ttl: float, redis_url: Optional[str]) -> Optional[ResponseCache]:
+    """Create the response cache from configuration, `backend="off"` disables it."""
+    if backend == "off":
+        return None
+    if backend == "redis":
+        if not redis_url:
+            raise RuntimeError("RESPONSE_CACHE_BACKEND=redis requires REDIS_URL")
+        return ResponseCache(RedisCacheBackend(redis_url, ttl=ttl))
+    return ResponseCache(MemoryCacheBackend(maxsize=maxsize, ttl=ttl))
@@ -0,0 +1,104 @@
+import re
+from string import Template
+from typing import Any, Dict, List, Optional
+
+from utils.structured_output import JsonObjectExtractor, StructuredOutputError, Validator, parse_structured_output
+
+# -----------------------------
+# Multi-candidate generation
+# -----------------------------
+# Several alternative names from one provider call. Engines with a native `n`
+# (OpenAI) return n completions, joined into one raw answer; all other engines get
+# one completion asked for a {"candidates": [...]} list, constrained by a list schema
+# where the provider supports output schemas (Ollama `format`). Either way the raw
+# answer is a text holding JSON objects, so it is cached and stored like any other.
+# Candidates are deduplicated on their normalized name and ranked by votes.
+
+CANDIDATES_INSTRUCTION = Template("""
+
+Propose $n distinct alternatives instead of a single answer, best first. Answer with only a JSON object of the form
+{"candidates": [<answer>, ...]} where every <answer> follows the format above.""")
+
+# Naming conventions of the generated names, matching names rank higher
+NAME_CONVENTIONS = {
+    "property_name": re.compile(r"^[a-z][A-Za-z0-9]*$"),  # lowerCamelCase
+    "class_name": re.compile(r"^[A-Z][A-Za-z0-9]*$"),     # UpperCamelCase
+}
+
+_CAMEL_BOUNDARY = re.compile(r"(?<=[a-z0-9])(?=[A-Z])|(?<=[A-Z])(?=[A-Z][a-z])")
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+
+
+def candidates_schema(item_schema: Optional[Dict[str, Any]], n: int) -> Dict[str, Any]:
+    return {
+        "type": "object",
+        "properties": {
+            "candidates": {"type": "array", "items": item_schema or {"type": "object"}, "minItems": 1, "maxItems": n},
+        },
+        "required": ["candidates"],
+    }
+
+
+def candidates_instruction(n: int) -> str:
+    return CANDIDATES_INSTRUCTION.substitute(n=n)
+
+
+def normalize_name(name: str) -> str:
+    """`hasCity`, `has_city`, `HasCity` and `has city` all normalize to `hascity`."""
+    return _NON_ALNUM.sub("", _CAMEL_BOUNDARY.sub(" ", name.strip()).lower())
+
+
+def parse_candidates(raw_answer: str, name_field: str, validator: Optional[Validator] = None,
+                     extractor: Optional[JsonObjectExtractor] = None) -> List[Dict[str, Any]]:
+    """
+    Every answer in the raw output, in order: top-level objects (one per native completion)
+    and the items of a {"candidates": [...]} list. Items failing `validator` are dropped;
+    raises StructuredOutputError if no answer with a `name_field` is left.
+    """
+    if extractor is None:
+        extractor = JsonObjectExtractor()
+        extractor.feed(raw_answer)
+
+    answers: List[Dict[str, Any]] = []
+    errors: List[str] = []
+    for text in extractor.objects:
+        try:
+            value, _ = parse_structured_output(text)
+        except StructuredOutputError as e:
+            errors.extend(e.errors)
+            continue
+        items = value["candidates"] if isinstance(value.get("candidates"), list) else [value]
+        for item in items:
+            problems = validator(item) if validator is not None else []
+            if problems:
+                errors.extend(problems)
+            elif isinstance(item, dict):
+                answers.append(item)
+    if not any(str(answer.get(name_field, "")).strip() for answer in answers):
+        raise StructuredOutputError("Answer contains no valid candidate.", errors or [f"$.{name_field} is required"])
+    return answers
+
+
+def rank_candidates(answers: List[Dict[str, Any]], name_field: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Deduplicate answers on their normalized name and rank them: the share of answers
+    proposing the name, plus a bonus for following the naming convention; ties keep the
+    provider's order. The first answer of each name is kept, with `votes` and `score`.
+    """
+    convention = NAME_CONVENTIONS.get(name_field)
+    groups: Dict[str, Dict[str, Any]] = {}
+    for position, answer in enumerate(answers):
+        name = str(answer.get(name_field, ""))
+        key = normalize_name(name)
+        if not key:
+            continue
+        if key in groups:
+            groups[key]["votes"] += 1
+            continue
+        groups[key] = {"answer": answer, "votes": 1, "position": position,
+                       "conventional": bool(convention and convention.match(name))}
+
+    for group in groups.values():
+        group["score"] = round(group["votes"] / len(answers) + (0.1 if group["conventional"] else 0.0), 4)
+    ranked = sorted(groups.values(), key=lambda group: (-group["score"], group["position"]))
+    return [{**group["answer"], "votes": group["votes"], "score": group["score"]} for group in ranked[:limit]]
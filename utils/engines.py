@@ -0,0 +1,444 @@
+import asyncio
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import openai
+from fastapi import HTTPException
+
+from utils.admission import TRANSIENT_ERRORS, AdmissionController
+from utils.tokens import TokenCounter, context_size
+
+# -----------------------------
+# Provider engines
+# -----------------------------
+# An engine wraps one LLM backend behind the same interface: blocking and async
+# generation, token streaming and batch. Engines are registered in an EngineRegistry
+# that routes every model name to its engine, so the endpoints never branch on the
+# provider. `data` is any generation request carrying model_name and the sampling
+# fields of GenerationRequest (every pattern's request). Provider errors are raised as
+# HTTPException chained to the SDK error, which the admission controller inspects.
+
+
+def chat_messages(data: Any, prompt_text: str) -> List[Dict[str, str]]:
+    """
+    The template's system part (data.system_prompt, same for every request of a pattern)
+    first, then the request itself, so providers can reuse the cached shared prefix.
+    """
+    system_prompt = getattr(data, "system_prompt", None)
+    messages = [{"role": "system", "content": system_prompt}] if system_prompt else []
+    messages.append({"role": "user", "content": prompt_text})
+    return messages
+
+
+def clean_llm_output(text: str) -> str:
+    # Code fences and prose around the JSON are handled by utils.structured_output
+    return (text or "").strip()
+
+
+class ProviderEngine:
+    """Base class of all provider engines."""
+
+    name = "base"
+    # SDK errors (without an HTTP status) worth retrying
+    transient_errors: Tuple[type, ...] = TRANSIENT_ERRORS
+    # Whether _agenerate returns data.n_candidates completions itself (joined by newlines)
+    supports_n = False
+
+    def __init__(
+        self,
+        max_concurrency: int = 4,
+        client_factory: Optional[Callable[[], Any]] = None,
+        async_client_factory: Optional[Callable[[], Any]] = None,
+    ):
+        self.max_concurrency = max_concurrency
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        # Calls holding a concurrency slot / waiting for one
+        self.in_use = 0
+        self.waiting = 0
+        # Provider clients are built on first use, so importing the app (and forking workers) stays cheap
+        self._client_factory = client_factory
+        self._async_client_factory = async_client_factory
+        self._client = None
+        self._async_client = None
+        # Called as usage_observer(engine_name, model_name, usage) after every provider response
+        self.usage_observer: Optional[Callable[[str, str, Dict[str, float]], None]] = None
+        # Rate limits, retries and circuit breaker of async calls (none if unset)
+        self.admission: Optional[AdmissionController] = None
+
+    def report_usage(self, model_name: str, usage: Dict[str, Optional[float]]):
+        usage = {key: value for key, value in usage.items() if value is not None}
+        if self.usage_observer is not None and usage:
+            self.usage_observer(self.name, model_name, usage)
+
+    @property
+    def client(self) -> Any:
+        if self._client is None and self._client_factory is not None:
+            self._client = self._client_factory()
+        return self._client
+
+    @property
+    def async_client(self) -> Any:
+        if self._async_client is None and self._async_client_factory is not None:
+            self._async_client = self._async_client_factory()
+        return self._async_client
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # Created lazily so it binds to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    @asynccontextmanager
+    async def _slot(self):
+        """Hold one of the engine's concurrency slots, counted in stats() while waiting and running."""
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_use += 1
+        try:
+            yield
+        finally:
+            self.in_use -= 1
+            self.semaphore.release()
+
+    def generate(self, data: Any, prompt_text: str) -> str:
+        """Blocking generation, returns the cleaned completion text."""
+        raise NotImplementedError
+
+    async def _agenerate(self, data: Any, prompt_text: str) -> str:
+        raise NotImplementedError
+
+    async def _astream(self, data: Any, prompt_text: str) -> AsyncIterator[str]:
+        # Engines without native streaming yield the whole answer at once
+        yield await self._agenerate(data, prompt_text)
+
+    async def _agenerate_limited(self, data: Any, prompt_text: str) -> str:
+        async with self._slot():
+            return await self._agenerate(data, prompt_text)
+
+    async def agenerate(self, data: Any, prompt_text: str) -> str:
+        """Async generation under the engine's concurrency limit and admission control."""
+        if self.admission is None:
+            return await self._agenerate_limited(data, prompt_text)
+        return await self.admission.run(
+            data.model_name, prompt_text, lambda: self._agenerate_limited(data, prompt_text), self.transient_errors
+        )
+
+    async def astream(self, data: Any, prompt_text: str) -> AsyncIterator[str]:
+        """
+        Yield completion tokens as they arrive, under the engine's concurrency limit and
+        admission control. Failures are only retried before the first token was yielded.
+        """
+        attempt = 0
+        while True:
+            probe = await self.admission.admit(data.model_name, prompt_text) if self.admission is not None else False
+            yielded = False
+            tokens = self._astream(data, prompt_text)
+            try:
+                async with self._slot():
+                    try:
+                        async for token in tokens:
+                            yielded = True
+                            yield token
+                    finally:
+                        # Also when the consumer stops early: release the provider response now, not at GC
+                        await tokens.aclose()
+            except GeneratorExit:
+                # The consumer closed the stream (e.g. once the JSON answer was complete): the provider answered
+                if yielded and self.admission is not None:
+                    self.admission.on_success(data.model_name)
+                raise
+            except Exception as e:
+                if self.admission is None:
+                    raise
+                delay = self.admission.on_failure(data.model_name, e, attempt, self.transient_errors, can_retry=not yielded)
+            else:
+                if self.admission is not None:
+                    self.admission.on_success(data.model_name)
+                return
+            finally:
+                if probe:
+                    self.admission.breaker.release_probe()
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def list_models(self) -> List[str]:
+        """Models the backend can serve, used for dynamic discovery (empty if unsupported)."""
+        return []
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {"max_concurrency": self.max_concurrency, "in_use": self.in_use, "waiting": self.waiting}
+        if self.admission is not None:
+            stats["admission"] = self.admission.stats()
+        return stats
+
+
+class OpenAIEngine(ProviderEngine):
+    """OpenAI chat completions (also any OpenAI-compatible server)."""
+
+    name = "openai"
+    transient_errors = TRANSIENT_ERRORS + (openai.APIConnectionError,)
+    supports_n = True
+
+    def __init__(self, client_factory: Callable[[], Any], async_client_factory: Callable[[], Any], max_concurrency: int = 16):
+        super().__init__(max_concurrency, client_factory, async_client_factory)
+
+    def completion_kwargs(self, data: Any, prompt_text: str) -> Dict[str, Any]:
+        temperature = data.temperature
+        if data.model_name in ["o1-preview", "o1-mini"]:
+            temperature = 1.0
+        return dict(
+            model=data.model_name,
+            messages=chat_messages(data, prompt_text),
+            temperature=temperature,
+            top_p=data.top_p,
+            frequency_penalty=data.frequency_penalty,
+            presence_penalty=data.presence_penalty
+        )
+
+    def stream_kwargs(self) -> Dict[str, Any]:
+        # Makes the last chunk carry token usage
+        return {"stream_options": {"include_usage": True}}
+
+    def candidate_kwargs(self, data: Any) -> Dict[str, Any]:
+        """`n` completions in one call; n greedy samples would all be the same, so they are sampled."""
+        n = getattr(data, "n_candidates", 1)
+        if n <= 1:
+            return {}
+        return {"n": n, "temperature": data.temperature if data.temperature > 0 else 0.7}
+
+    def report_response_usage(self, model_name: str, usage: Any):
+        if usage is not None:
+            counts = {"prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens}
+            # Part of the prompt served from OpenAI's prompt cache (the shared system prefix)
+            details = getattr(usage, "prompt_tokens_details", None)
+            if details is not None and details.cached_tokens is not None:
+                counts["cached_prompt_tokens"] = details.cached_tokens
+            self.report_usage(model_name, counts)
+
+    def _check_client(self, client: Any):
+        if client is None:
+            raise HTTPException(status_code=500, detail="Missing OPENAI_API_KEY.")
+
+    def generate(self, data: Any, prompt_text: str) -> str:
+        self._check_client(self.client)
+        try:
+            response = self.client.chat.completions.create(**self.completion_kwargs(data, prompt_text))
+            self.report_response_usage(data.model_name, response.usage)
+            return clean_llm_output(response.choices[0].message.content)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"OpenAI API call failed: {e}") from e
+
+    async def _agenerate(self, data: Any, prompt_text: str) -> str:
+        self._check_client(self.async_client)
+        try:
+            response = await self.async_client.chat.completions.create(
+                **{**self.completion_kwargs(data, prompt_text), **self.candidate_kwargs(data)}
+            )
+            self.report_response_usage(data.model_name, response.usage)
+            return "\n".join(clean_llm_output(choice.message.content) for choice in response.choices)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"OpenAI API call failed: {e}") from e
+
+    async def _astream(self, data: Any, prompt_text: str) -> AsyncIterator[str]:
+        self._check_client(self.async_client)
+        try:
+            stream = await self.async_client.chat.completions.create(
+                **self.completion_kwargs(data, prompt_text), **self.stream_kwargs(), stream=True
+            )
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+                self.report_response_usage(data.model_name, getattr(chunk, "usage", None))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"OpenAI API call failed: {e}") from e
+
+
+class OllamaEngine(ProviderEngine):
+    """Ollama chat API with JSON-schema constrained output."""
+
+    name = "ollama"
+
+    def __init__(
+        self,
+        client_factory: Callable[[], Any],
+        async_client_factory: Callable[[], Any],
+        max_concurrency: int = 4,
+        token_counter: Optional[TokenCounter] = None,
+        completion_tokens: int = 512,
+        min_num_ctx: int = 4096,
+        max_num_ctx: int = 32768,
+        keep_alive: Optional[Union[str, float]] = None,
+        cold_start_seconds: float = 1.0,
+    ):
+        super().__init__(max_concurrency, client_factory, async_client_factory)
+        # Without a token counter every call uses min_num_ctx
+        self.token_counter = token_counter
+        self.completion_tokens = completion_tokens
+        self.min_num_ctx = min_num_ctx
+        self.max_num_ctx = max_num_ctx
+        # How long Ollama keeps a model loaded after a call (e.g. "30m", -1 = forever), server default if None
+        self.keep_alive = keep_alive
+        # Calls whose model load took at least this long count as cold starts
+        self.cold_start_seconds = cold_start_seconds
+        self.cold_starts: Dict[str, int] = defaultdict(int)
+        # Per model: unix time of the last call and its num_ctx (a different num_ctx reloads the model)
+        self.last_used: Dict[str, float] = {}
+        self.last_num_ctx: Dict[str, int] = {}
+
+    def num_ctx(self, data: Any, prompt_text: str) -> int:
+        """
+        Context for the call: grows to the smallest power of two that fits, never shrinks per model.
+        Ollama reloads the model whenever num_ctx changes, so a model keeps its largest size so far.
+        """
+        current = self.last_num_ctx.get(data.model_name, self.min_num_ctx)
+        if self.token_counter is None:
+            return current
+        needed = context_size(
+            sum(self.token_counter.count(data.model_name, m["content"]) for m in chat_messages(data, prompt_text)),
+            self.completion_tokens * getattr(data, "n_candidates", 1),
+            self.min_num_ctx,
+            self.max_num_ctx,
+        )
+        return max(needed, current)
+
+    def chat_kwargs(self, data: Any, prompt_text: str) -> Dict[str, Any]:
+        output_schema = data.output_schema
+        if output_schema is None:
+            print("Warning: No response schema provided for the call to Ollama API." +
+                  "Defaulting 'format' parameter to generic 'json'")
+        num_ctx = self.num_ctx(data, prompt_text)
+        self.last_used[data.model_name] = time.time()
+        self.last_num_ctx[data.model_name] = num_ctx
+        kwargs = dict(
+            model=data.model_name,
+            messages=chat_messages(data, prompt_text),
+            format=output_schema if output_schema is not None else "json",
+            options={
+                "temperature": data.temperature,
+                "top_p": data.top_p,
+                "repeat_penalty": data.repeat_penalty,
+                "num_ctx": num_ctx
+            }
+        )
+        if self.keep_alive is not None:
+            kwargs["keep_alive"] = self.keep_alive
+        return kwargs
+
+    def report_response_usage(self, model_name: str, response: Any):
+        """Token counts and server-side timings (nanoseconds) from a final Ollama response."""
+        def seconds(ns: Optional[int]) -> Optional[float]:
+            return ns / 1e9 if ns is not None else None
+
+        if (seconds(response.load_duration) or 0.0) >= self.cold_start_seconds:
+            self.cold_starts[model_name] += 1
+        self.report_usage(model_name, {
+            "prompt_tokens": response.prompt_eval_count,
+            "completion_tokens": response.eval_count,
+            "load_seconds": seconds(response.load_duration),
+            "prompt_eval_seconds": seconds(response.prompt_eval_duration),
+            "eval_seconds": seconds(response.eval_duration),
+        })
+
+    def generate(self, data: Any, prompt_text: str) -> str:
+        try:
+            response = self.client.chat(**self.chat_kwargs(data, prompt_text))
+            self.report_response_usage(data.model_name, response)
+            return clean_llm_output(response.message.content)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Ollama API call failed: {e}") from e
+
+    async def _agenerate(self, data: Any, prompt_text: str) -> str:
+        try:
+            response = await self.async_client.chat(**self.chat_kwargs(data, prompt_text))
+            self.report_response_usage(data.model_name, response)
+            return clean_llm_output(response.message.content)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Ollama API call failed: {e}") from e
+
+    async def _astream(self, data: Any, prompt_text: str) -> AsyncIterator[str]:
+        try:
+            stream = await self.async_client.chat(**self.chat_kwargs(data, prompt_text), stream=True)
+            async for chunk in stream:
+                if chunk.message.content:
+                    yield chunk.message.content
+                if chunk.done:
+                    self.report_response_usage(data.model_name, chunk)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Ollama API call failed: {e}") from e
+
+    async def list_models(self) -> List[str]:
+        response = await self.async_client.list()
+        return sorted(model.model for model in response.models)
+
+    async def warm(self, model_name: str) -> float:
+        """
+        Load the model (or extend its keep-alive) with an empty prompt, which generates nothing.
+        Uses the model's last num_ctx, so the next call does not reload it. Returns the load seconds.
+        """
+        kwargs = {"options": {"num_ctx": self.last_num_ctx.get(model_name, self.min_num_ctx)}}
+        if self.keep_alive is not None:
+            kwargs["keep_alive"] = self.keep_alive
+        response = await self.async_client.generate(model=model_name, prompt="", **kwargs)
+        return (response.load_duration or 0) / 1e9
+
+    async def loaded_models(self) -> Dict[str, Dict[str, Any]]:
+        """Models currently loaded on the Ollama host (`ollama ps`), with their unload time and VRAM use."""
+        response = await self.async_client.ps()
+        return {
+            model.model: {
+                "expires_at": model.expires_at.timestamp() if model.expires_at is not None else None,
+                "size_vram": model.size_vram,
+            }
+            for model in response.models
+        }
+
+
+class EngineRegistry:
+    """Routes model names to registered engines; `model_map` is the live model -> engine name table."""
+
+    def __init__(self, model_map: Dict[str, str]):
+        self.model_map = model_map
+        self._engines: Dict[str, ProviderEngine] = {}
+
+    def register(self, engine: ProviderEngine, models: Sequence[str] = ()):
+        self._engines[engine.name] = engine
+        for model_name in models:
+            self.model_map[model_name] = engine.name
+
+    def engines(self) -> Dict[str, ProviderEngine]:
+        return dict(self._engines)
+
+    def provider_of(self, model_name: str) -> str:
+        """Engine name serving the model, raises KeyError for unknown models."""
+        return self.model_map[model_name]
+
+    def engine_for(self, model_name: str) -> ProviderEngine:
+        provider = self.provider_of(model_name)
+        engine = self._engines.get(provider)
+        if engine is None:
+            raise HTTPException(status_code=500, detail=f"Unsupported provider '{provider}' for model {model_name}.")
+        return engine
+
+    async def discover_models(self) -> Dict[str, str]:
+        """Ask every engine for its models and route the ones not mapped yet. Returns the new routes."""
+        discovered = {}
+        for engine in self._engines.values():
+            try:
+                models = await engine.list_models()
+            except Exception as e:
+                print(f"Warning: model discovery failed for {engine.name}: {e}")
+                continue
+            for model_name in models:
+                if model_name not in self.model_map:
+                    self.model_map[model_name] = engine.name
+                    discovered[model_name] = engine.name
+        return discovered
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: engine.stats() for name, engine in self._engines.items()}
@@ -0,0 +1,145 @@
+import argparse
+import json
+import os
+import re
+import zlib
+from typing import Any, Dict, List
+
+import numpy as np
+
+# -----------------------------
+# Few-shot example library
+# -----------------------------
+# prompts/{pattern}/examples.jsonl holds one example per line (the pattern's example fields,
+# see utils/patterns.py).
+# Its embeddings are precomputed into prompts/{pattern}/examples.npy, a float32 matrix
+# with one unit-length row per example, memory-mapped at load. A request embeds its own
+# labels the same way and gets the k most similar examples from one matrix-vector product.
+#
+# Embeddings are hashed bag-of-features vectors over the label fields (every `*_label`
+# field, whatever the pattern): the words of the labels (camelCase and snake_case split),
+# the same words tagged with their field and their character trigrams. They need no model or provider call, are deterministic, and match
+# spelling variants of the short ontology labels well.
+
+EMBEDDING_DIM = 512
+LABEL_SUFFIX = "_label"
+
+_WORD_BOUNDARY = re.compile(r"(?<=[a-z0-9])(?=[A-Z])|[^0-9A-Za-z]+")
+
+
+def label_words(text: str) -> List[str]:
+    return [word.lower() for word in _WORD_BOUNDARY.split(text) if word]
+
+
+def example_features(example: Dict[str, Any]) -> List[str]:
+    features = []
+    for field in sorted(example):
+        if not field.endswith(LABEL_SUFFIX) or not example[field]:
+            continue
+        for word in label_words(str(example[field])):
+            features.append(word)
+            features.append(f"{field}:{word}")
+            padded = f" {word} "
+            features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+    return features
+
+
+def embed_examples(examples: List[Dict[str, Any]], dim: int = EMBEDDING_DIM) -> np.ndarray:
+    """Unit-length hashed feature vectors of the labels, one float32 row per example (zeros without labels)."""
+    matrix = np.zeros((len(examples), dim), dtype=np.float32)
+    for row, example in enumerate(examples):
+        for feature in example_features(example):
+            h = zlib.crc32(feature.encode("utf-8"))
+            # The sign bit keeps colliding features from only ever adding up
+            matrix[row, h % dim] += 1.0 if h & 0x80000000 else -1.0
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+
+def read_examples(path: str) -> List[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def embeddings_path(examples_path: str) -> str:
+    return os.path.splitext(examples_path)[0] + ".npy"
+
+
+class ExampleIndex:
+    """The examples of one pattern with their embedding matrix."""
+
+    def __init__(self, examples: List[Dict[str, Any]], embeddings: np.ndarray):
+        if embeddings.shape[0] != len(examples):
+            raise ValueError(f"{embeddings.shape[0]} embeddings for {len(examples)} examples")
+        self.examples = examples
+        self.embeddings = embeddings
+
+    @classmethod
+    def from_file(cls, path: str) -> "ExampleIndex":
+        """
+        Load examples.jsonl with its precomputed examples.npy (memory-mapped). A missing or
+        outdated .npy is recomputed in memory, with a warning to rebuild it.
+        """
+        examples = read_examples(path)
+        npy_path = embeddings_path(path)
+        try:
+            if os.stat(npy_path).st_mtime >= os.stat(path).st_mtime:
+                embeddings = np.load(npy_path, mmap_mode="r")
+                if embeddings.shape == (len(examples), EMBEDDING_DIM):
+                    return cls(examples, embeddings)
+        except (OSError, ValueError):
+            pass
+        print(f"Warning: {npy_path} is missing or outdated, embedding {len(examples)} examples at load "
+              f"(rebuild it with `python -m utils.examples {os.path.dirname(os.path.dirname(path)) or '.'}`)")
+        return cls.from_examples(examples)
+
+    @classmethod
+    def from_examples(cls, examples: List[Dict[str, Any]]) -> "ExampleIndex":
+        return cls(examples, embed_examples(examples))
+
+    def __len__(self) -> int:
+        return len(self.examples)
+
+    def top_k(self, query: Dict[str, Any], k: int) -> List[Dict[str, Any]]:
+        """The k examples most similar (cosine) to the query labels, most similar first."""
+        k = min(k, len(self.examples))
+        if k <= 0:
+            return []
+        scores = self.embeddings @ embed_examples([query])[0]
+        if k < len(scores):
+            # Partial selection, only the k winners are sorted
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [self.examples[i] for i in top]
+
+
+def build_embeddings(root: str) -> Dict[str, int]:
+    """Write examples.npy next to every examples.jsonl under `root`. Returns examples per file."""
+    built = {}
+    for dirpath, _, filenames in os.walk(root):
+        if "examples.jsonl" not in filenames:
+            continue
+        path = os.path.join(dirpath, "examples.jsonl")
+        examples = read_examples(path)
+        # Replaced atomically, running workers may have the old file memory-mapped
+        tmp_path = embeddings_path(path) + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, embed_examples(examples))
+        os.replace(tmp_path, embeddings_path(path))
+        built[path] = len(examples)
+    return built
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute the few-shot example embeddings (examples.npy).")
+    parser.add_argument("root", nargs="?", default="./prompts", help="Prompts directory")
+    args = parser.parse_args()
+    for path, count in build_embeddings(args.root).items():
+        print(f"{embeddings_path(path)}: {count} examples")
+
+
+if __name__ == "__main__":
+    main()
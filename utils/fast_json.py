@@ -0,0 +1,75 @@
+import json
+from typing import Any, Callable, Optional, Union
+
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import APIRoute
+from pydantic import TypeAdapter
+
+# -----------------------------
+# JSON fast path
+# -----------------------------
+# Request bodies are parsed and dict responses rendered with orjson when it is installed
+# (stdlib json otherwise, same results). Pydantic responses skip FastAPI's
+# jsonable_encoder: `json_response` serializes them in pydantic-core, with TypeAdapters
+# built once at import for lists of models.
+
+
+def _load_orjson():
+    try:
+        import orjson
+    except ImportError:
+        print("Warning: orjson is not installed, JSON is parsed and rendered with the slower stdlib json")
+        return None
+    return orjson
+
+
+orjson = _load_orjson()
+
+# Default response class of the app: ORJSONResponse needs orjson
+JSON_RESPONSE_CLASS = ORJSONResponse if orjson is not None else JSONResponse
+
+
+def backend() -> str:
+    return "orjson" if orjson is not None else "json"
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    """Parse JSON; errors are json.JSONDecodeError either way (orjson's is a subclass)."""
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def dumps(value: Any) -> str:
+    """Compact JSON text, non-ASCII characters as is."""
+    if orjson is not None:
+        return orjson.dumps(value).decode("utf-8")
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+def json_response(value: Any, adapter: Optional[TypeAdapter] = None, status_code: int = 200) -> Response:
+    """
+    A pydantic model (or, with its precompiled TypeAdapter, any value of the adapter's type)
+    serialized straight to JSON bytes by pydantic-core. Declare the type as the route's
+    response_model so the OpenAPI schema still documents it.
+    """
+    content = adapter.dump_json(value) if adapter is not None else value.model_dump_json()
+    return Response(content=content, status_code=status_code, media_type="application/json")
+
+
+class FastJSONRequest(Request):
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            self._json = loads(await self.body())
+        return self._json
+
+
+class FastJSONRoute(APIRoute):
+    """Route whose JSON request body is parsed with `loads` (FastAPI's body validation is unchanged)."""
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def route_handler(request: Request) -> Response:
+            return await handler(FastJSONRequest(request.scope, request.receive))
+
+        return route_handler
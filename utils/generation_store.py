@@ -0,0 +1,387 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import sqlite3
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterator, Optional
+
+# -----------------------------
+# Generation store
+# -----------------------------
+# Append-only log of every generation answered by a provider: the request, the
+# rendered prompt, the raw output, the parsed response, provider latency and token
+# usage. Rows are looked up by `prompt_key` (the response cache key), so an identical
+# generation can be answered from disk after a restart or deploy, and the log can be
+# exported to JSONL / Parquet for offline evaluation.
+#
+# The pattern inputs (the fields listed in the pattern's spec) are kept as one
+# `inputs` object, so patterns added under prompts/ are stored without a schema change.
+# `inputs_key` (a hash of the canonical inputs JSON) is what the pattern tuple is indexed
+# and filtered on, together with pattern_name and model_name.
+# Rows older than `retention` seconds and rows beyond the newest `max_rows` are
+# deleted on the first and then every PRUNE_EVERY-th append (0 keeps them).
+
+RECORD_FIELDS = (
+    "pattern_name", "inputs", "inputs_key", "model_name", "provider", "prompt_key", "request", "prompt", "raw_output",
+    "response", "latency_ms", "prompt_tokens", "completion_tokens", "created_at",
+)
+
+# Stored as JSON text in SQLite, as documents in MongoDB
+JSON_FIELDS = ("inputs", "request", "response")
+
+PRUNE_EVERY = 100
+
+
+def make_inputs_key(inputs: Dict[str, Any]) -> str:
+    payload = json.dumps(inputs, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def make_record(
+    request: Dict[str, Any],
+    inputs: Dict[str, Any],
+    provider: str,
+    prompt_key: str,
+    prompt: str,
+    raw_output: str,
+    response: Optional[Dict[str, Any]],
+    latency_ms: Optional[float] = None,
+    prompt_tokens: Optional[int] = None,
+    completion_tokens: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Build a store record from a generation request (model_dump), the pattern inputs taken from it
+    and its outcome; response is None if parsing failed.
+    """
+    return dict(
+        pattern_name=request.get("pattern_name"),
+        inputs=inputs,
+        inputs_key=make_inputs_key(inputs),
+        model_name=request.get("model_name"),
+        provider=provider,
+        prompt_key=prompt_key,
+        request=request,
+        prompt=prompt,
+        raw_output=raw_output,
+        response=response,
+        latency_ms=latency_ms,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        created_at=time.time(),
+    )
+
+
+def cutoff(retention: float) -> Optional[float]:
+    """created_at before which rows are deleted, None if they are kept forever."""
+    return time.time() - retention if retention > 0 else None
+
+
+class SQLiteGenerationStore:
+    """
+    Single-file store. WAL mode lets every worker process append to the same file
+    while exports read it. The connection is opened on first use, i.e. inside the worker.
+    """
+
+    def __init__(self, path: str, max_rows: int = 0, retention: float = 0.0):
+        self.path = path
+        self.max_rows = max_rows
+        self.retention = retention
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self.appends = 0
+        self.pruned = 0
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30.0, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS generations ("
+                    "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                    "pattern_name TEXT, inputs TEXT, inputs_key TEXT, model_name TEXT, provider TEXT, "
+                    "prompt_key TEXT NOT NULL, request TEXT, prompt TEXT, raw_output TEXT, response TEXT, latency_ms REAL, "
+                    "prompt_tokens INTEGER, completion_tokens INTEGER, created_at REAL)"
+                )
+                columns = {row[1] for row in conn.execute("PRAGMA table_info(generations)")}
+                # Files written before the inputs columns keep their label columns, unused from now on
+                for column in ("inputs", "inputs_key"):
+                    if column not in columns:
+                        conn.execute(f"ALTER TABLE generations ADD COLUMN {column} TEXT")
+                # Named apart from idx_generations_pattern, the label-column index of older files
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_generations_pattern_inputs "
+                    "ON generations (pattern_name, inputs_key, model_name)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_generations_created ON generations (created_at)")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_generations_model ON generations (model_name, created_at)")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_generations_prompt_key ON generations (prompt_key)")
+            self._conn = conn
+        return self._conn
+
+    def _append(self, record: Dict[str, Any]):
+        row = [json.dumps(record[field]) if field in JSON_FIELDS else record[field] for field in RECORD_FIELDS]
+        with self._lock, self.conn:
+            self.conn.execute(
+                f"INSERT INTO generations ({', '.join(RECORD_FIELDS)}) VALUES ({', '.join('?' * len(RECORD_FIELDS))})",
+                row,
+            )
+
+    def _prune(self) -> int:
+        deleted = 0
+        with self._lock, self.conn:
+            oldest = cutoff(self.retention)
+            if oldest is not None:
+                deleted += self.conn.execute("DELETE FROM generations WHERE created_at < ?", (oldest,)).rowcount
+            if self.max_rows > 0:
+                deleted += self.conn.execute(
+                    "DELETE FROM generations WHERE id <= "
+                    "(SELECT id FROM generations ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                    (self.max_rows,),
+                ).rowcount
+        return deleted
+
+    def _lookup(self, prompt_key: str) -> Optional[str]:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT raw_output FROM generations WHERE prompt_key = ? AND response IS NOT NULL "
+                "ORDER BY id DESC LIMIT 1",
+                (prompt_key,),
+            ).fetchone()
+        return row[0] if row else None
+
+    def iter_records(self, pattern_name: Optional[str] = None, model_name: Optional[str] = None,
+                     since: Optional[float] = None,
+                     inputs: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+        """Yield stored records oldest first, optionally filtered. Uses its own connection."""
+        clauses, params = [], []
+        inputs_key = make_inputs_key(inputs) if inputs is not None else None
+        for column, value in (("pattern_name", pattern_name), ("inputs_key", inputs_key), ("model_name", model_name)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            clauses.append("created_at >= ?")
+            params.append(since)
+        where = " WHERE " + " AND ".join(clauses) if clauses else ""
+
+        self.conn  # make sure the table exists
+        conn = self._connect()
+        try:
+            cursor = conn.execute(f"SELECT {', '.join(RECORD_FIELDS)} FROM generations{where} ORDER BY id", params)
+            while True:
+                rows = cursor.fetchmany(1000)
+                if not rows:
+                    break
+                for row in rows:
+                    record = dict(zip(RECORD_FIELDS, row))
+                    for field in JSON_FIELDS:
+                        record[field] = json.loads(record[field]) if record[field] is not None else None
+                    yield record
+        finally:
+            conn.close()
+
+    def count(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM generations").fetchone()[0]
+
+    async def append(self, record: Dict[str, Any]):
+        await asyncio.to_thread(self._append, record)
+        self.appends += 1
+        if (self.max_rows > 0 or self.retention > 0) and (self.appends - 1) % PRUNE_EVERY == 0:
+            self.pruned += await asyncio.to_thread(self._prune)
+
+    async def lookup(self, prompt_key: str) -> Optional[str]:
+        """Raw output of the latest successfully parsed generation for this key."""
+        raw_output = await asyncio.to_thread(self._lookup, prompt_key)
+        if raw_output is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return raw_output
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "sqlite", "path": self.path, "appends": self.appends, "hits": self.hits,
+                "misses": self.misses, "errors": self.errors, "pruned": self.pruned,
+                "max_rows": self.max_rows, "retention": self.retention}
+
+
+class MongoGenerationStore:
+    """Store shared by several hosts, using the (synchronous) pymongo driver off the event loop."""
+
+    def __init__(self, url: str, database: str = "patterns", collection: str = "generations",
+                 max_rows: int = 0, retention: float = 0.0):
+        try:
+            import pymongo
+        except ImportError as e:
+            raise RuntimeError("GENERATION_STORE_BACKEND=mongo requires the 'pymongo' package") from e
+        self._pymongo = pymongo
+        self.url = url
+        self.database = database
+        self.collection_name = collection
+        self.max_rows = max_rows
+        self.retention = retention
+        self._collection = None
+        self.appends = 0
+        self.pruned = 0
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    @property
+    def collection(self):
+        # MongoClient is not fork-safe, so it is created inside the worker
+        if self._collection is None:
+            collection = self._pymongo.MongoClient(self.url)[self.database][self.collection_name]
+            collection.create_index([("pattern_name", 1), ("inputs_key", 1), ("model_name", 1)])
+            collection.create_index([("model_name", 1), ("created_at", 1)])
+            collection.create_index("created_at")
+            collection.create_index("prompt_key")
+            self._collection = collection
+        return self._collection
+
+    def _lookup(self, prompt_key: str) -> Optional[str]:
+        document = self.collection.find_one(
+            {"prompt_key": prompt_key, "response": {"$ne": None}},
+            {"raw_output": 1},
+            sort=[("_id", -1)],
+        )
+        return document["raw_output"] if document else None
+
+    def _prune(self) -> int:
+        deleted = 0
+        oldest = cutoff(self.retention)
+        if oldest is not None:
+            deleted += self.collection.delete_many({"created_at": {"$lt": oldest}}).deleted_count
+        if self.max_rows > 0:
+            newest = list(self.collection.find({}, {"_id": 1}).sort("_id", -1).skip(self.max_rows).limit(1))
+            if newest:
+                deleted += self.collection.delete_many({"_id": {"$lte": newest[0]["_id"]}}).deleted_count
+        return deleted
+
+    def iter_records(self, pattern_name: Optional[str] = None, model_name: Optional[str] = None,
+                     since: Optional[float] = None,
+                     inputs: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+        query: Dict[str, Any] = {}
+        if pattern_name is not None:
+            query["pattern_name"] = pattern_name
+        if inputs is not None:
+            query["inputs_key"] = make_inputs_key(inputs)
+        if model_name is not None:
+            query["model_name"] = model_name
+        if since is not None:
+            query["created_at"] = {"$gte": since}
+        for document in self.collection.find(query, {"_id": 0}).sort("_id", 1):
+            yield {field: document.get(field) for field in RECORD_FIELDS}
+
+    def count(self) -> int:
+        return self.collection.estimated_document_count()
+
+    async def append(self, record: Dict[str, Any]):
+        # insert_one adds `_id` to the document it is given
+        await asyncio.to_thread(self.collection.insert_one, dict(record))
+        self.appends += 1
+        if (self.max_rows > 0 or self.retention > 0) and (self.appends - 1) % PRUNE_EVERY == 0:
+            self.pruned += await asyncio.to_thread(self._prune)
+
+    async def lookup(self, prompt_key: str) -> Optional[str]:
+        raw_output = await asyncio.to_thread(self._lookup, prompt_key)
+        if raw_output is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return raw_output
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "mongo", "database": self.database, "collection": self.collection_name,
+                "appends": self.appends, "hits": self.hits, "misses": self.misses, "errors": self.errors,
+                "pruned": self.pruned, "max_rows": self.max_rows, "retention": self.retention}
+
+
+def build_generation_store(backend: str, path: str, mongo_url: Optional[str], max_rows: int = 0,
+                           retention: float = 0.0):
+    """Create the generation store from configuration, `backend="off"` disables it."""
+    if backend in ("off", "none", ""):
+        return None
+    if backend == "mongo":
+        if not mongo_url:
+            raise RuntimeError("GENERATION_STORE_BACKEND=mongo requires MONGO_URL")
+        return MongoGenerationStore(mongo_url, max_rows=max_rows, retention=retention)
+    return SQLiteGenerationStore(path, max_rows=max_rows, retention=retention)
+
+
+# -----------------------------
+# Export
+# -----------------------------
+
+def iter_jsonl(records: Iterator[Dict[str, Any]]) -> Iterator[str]:
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False) + "\n"
+
+
+def write_parquet(records: Iterator[Dict[str, Any]], destination: Any, batch_size: int = 10000):
+    """Write records to a Parquet file (path or binary file object). Requires pyarrow."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("Parquet export requires the 'pyarrow' package") from e
+
+    # Nested request/response stay JSON text, their shape differs per pattern
+    schema = pa.schema([
+        (field, pa.float64() if field in ("latency_ms", "created_at")
+         else pa.int64() if field in ("prompt_tokens", "completion_tokens")
+         else pa.string())
+        for field in RECORD_FIELDS
+    ])
+
+    def to_row(record):
+        return {field: json.dumps(record[field]) if field in JSON_FIELDS and record[field] is not None else record[field]
+                for field in RECORD_FIELDS}
+
+    with pq.ParquetWriter(destination, schema) as writer:
+        batch = []
+        for record in records:
+            batch.append(to_row(record))
+            if len(batch) >= batch_size:
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+                batch = []
+        if batch:
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the generation store to JSONL or Parquet.")
+    parser.add_argument("output", help="Output file (.jsonl or .parquet), '-' for JSONL on stdout")
+    parser.add_argument("--backend", default="sqlite", choices=("sqlite", "mongo"))
+    parser.add_argument("--path", default="generations.sqlite3", help="SQLite database file")
+    parser.add_argument("--mongo-url")
+    parser.add_argument("--pattern-name")
+    parser.add_argument("--model-name")
+    args = parser.parse_args()
+
+    store = build_generation_store(args.backend, args.path, args.mongo_url)
+    records = store.iter_records(pattern_name=args.pattern_name, model_name=args.model_name)
+    if args.output.endswith(".parquet"):
+        write_parquet(records, args.output)
+    elif args.output == "-":
+        sys.stdout.writelines(iter_jsonl(records))
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.writelines(iter_jsonl(records))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import asyncio
+import json
+import math
+from collections import defaultdict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+# -----------------------------
+# Hedged requests
+# -----------------------------
+# A generation on a model with a configured fallback starts on the primary model alone. If
+# it has not answered by the deadline (a percentile of the primary's recent latencies),
+# the same request also goes to the fallback model; the first valid answer wins and the
+# other call is cancelled. A primary that fails before the deadline hands over to the
+# fallback right away. Only the slowest few percent of requests pay for a second call.
+
+
+def parse_hedge_models(raw: Optional[str]) -> Dict[str, str]:
+    """HEDGE_MODELS: JSON object of primary model name -> fallback model name."""
+    if not raw:
+        return {}
+    try:
+        return {str(model): str(fallback) for model, fallback in json.loads(raw).items()}
+    except (ValueError, TypeError, AttributeError) as e:
+        print(f"Warning: ignoring invalid HEDGE_MODELS: {e}")
+        return {}
+
+
+class LatencyTracker:
+    """Latencies (seconds) of the most recent calls per model, for percentiles."""
+
+    def __init__(self, window: int = 500):
+        self._samples: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=window))
+
+    def observe(self, model_name: str, seconds: float):
+        self._samples[model_name].append(seconds)
+
+    def count(self, model_name: str) -> int:
+        return len(self._samples.get(model_name, ()))
+
+    def quantile(self, model_name: str, q: float) -> Optional[float]:
+        """Nearest-rank quantile, None without samples."""
+        samples = self._samples.get(model_name)
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            model: {"samples": len(samples), **{f"p{round(q * 100)}": self.quantile(model, q) for q in (0.5, 0.95, 0.99)}}
+            for model, samples in self._samples.items() if samples
+        }
+
+
+class HedgePolicy:
+    """When to hedge: fallback per model and the deadline after which the fallback is asked too."""
+
+    def __init__(
+        self,
+        fallbacks: Dict[str, str],
+        latencies: LatencyTracker,
+        percentile: float = 0.95,
+        min_samples: int = 20,
+        default_delay: float = 10.0,
+        min_delay: float = 0.5,
+        max_delay: float = 60.0,
+    ):
+        self.fallbacks = fallbacks
+        self.latencies = latencies
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+
+    def fallback_for(self, model_name: str) -> Optional[str]:
+        return self.fallbacks.get(model_name)
+
+    def delay(self, model_name: str) -> float:
+        """The primary's latency percentile, `default_delay` until `min_samples` calls were seen."""
+        if self.latencies.count(model_name) < self.min_samples:
+            return self.default_delay
+        return min(max(self.latencies.quantile(model_name, self.percentile), self.min_delay), self.max_delay)
+
+
+async def race(
+    primary: Callable[[], Awaitable[Any]],
+    fallback: Callable[[], Awaitable[Any]],
+    delay: float,
+) -> Tuple[str, Any, bool]:
+    """
+    Run `primary()`, and `fallback()` too once `delay` seconds passed or the primary failed.
+    Returns (winner, result, hedged) where winner is "primary" or "fallback" and hedged tells
+    whether the fallback was started. The first call to succeed wins and the other one is
+    cancelled; if both fail, the primary's exception is raised.
+    """
+    primary_task = asyncio.ensure_future(primary())
+    tasks = {primary_task: "primary"}
+    try:
+        await asyncio.wait({primary_task}, timeout=delay)
+        if primary_task.done() and primary_task.exception() is None:
+            return "primary", primary_task.result(), False
+
+        fallback_task = asyncio.ensure_future(fallback())
+        tasks[fallback_task] = "fallback"
+        pending = {task for task in tasks if not task.done()}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            # On a tie the primary wins
+            for task in sorted(done, key=lambda task: tasks[task] != "primary"):
+                if task.exception() is None:
+                    return tasks[task], task.result(), True
+        raise primary_task.exception()
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
@@ -0,0 +1,243 @@
+import os
+from typing import Any, Dict, Optional
+
+import httpx
+
+# -----------------------------
+# Provider HTTP connection pools
+# -----------------------------
+# Every provider gets its own keep-alive pool, configured from the environment with
+# the provider name as prefix (e.g. OLLAMA_POOL_MAX_CONNECTIONS). A provider talks to
+# a single host, so the pool's max_connections is also its per-host limit.
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _env_float(name: str, default: Optional[float]) -> Optional[float]:
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    if value.strip().lower() == "none":
+        return None
+    return float(value)
+
+
+class PoolConfig:
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        http2: bool = False,
+        connect_timeout: Optional[float] = 10.0,
+        read_timeout: Optional[float] = 600.0,
+    ):
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.http2 = http2
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+    @classmethod
+    def from_env(cls, provider: str) -> "PoolConfig":
+        prefix = provider.upper()
+        default = cls()
+        return cls(
+            max_connections=int(os.getenv(f"{prefix}_POOL_MAX_CONNECTIONS", default.max_connections)),
+            max_keepalive_connections=int(os.getenv(f"{prefix}_POOL_MAX_KEEPALIVE", default.max_keepalive_connections)),
+            keepalive_expiry=float(os.getenv(f"{prefix}_POOL_KEEPALIVE_EXPIRY", default.keepalive_expiry)),
+            http2=_env_bool(f"{prefix}_HTTP2", default.http2),
+            connect_timeout=_env_float(f"{prefix}_CONNECT_TIMEOUT", default.connect_timeout),
+            read_timeout=_env_float(f"{prefix}_READ_TIMEOUT", default.read_timeout),
+        )
+
+    @property
+    def limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    @property
+    def timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return dict(vars(self))
+
+
+class PoolStats:
+    """In-flight request accounting for one provider pool."""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.requests = 0
+        self.errors = 0
+
+    def acquire(self):
+        self.in_flight += 1
+        self.requests += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def release(self):
+        self.in_flight -= 1
+
+
+class _CountingSyncStream(httpx.SyncByteStream):
+    def __init__(self, stream, stats: PoolStats):
+        self._stream = stream
+        self._stats = stats
+        self._closed = False
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            if not self._closed:
+                self._closed = True
+                self._stats.release()
+
+
+class _CountingAsyncStream(httpx.AsyncByteStream):
+    def __init__(self, stream, stats: PoolStats):
+        self._stream = stream
+        self._stats = stats
+        self._closed = False
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            if not self._closed:
+                self._closed = True
+                self._stats.release()
+
+
+class InstrumentedTransport(httpx.HTTPTransport):
+    """HTTPTransport that counts a request as in flight until its response body is closed."""
+
+    def __init__(self, stats: PoolStats, **kwargs):
+        super().__init__(**kwargs)
+        self.stats = stats
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        self.stats.acquire()
+        try:
+            response = super().handle_request(request)
+        except Exception:
+            self.stats.errors += 1
+            self.stats.release()
+            raise
+        response.stream = _CountingSyncStream(response.stream, self.stats)
+        return response
+
+
+class InstrumentedAsyncTransport(httpx.AsyncHTTPTransport):
+    """AsyncHTTPTransport that counts a request as in flight until its response body is closed."""
+
+    def __init__(self, stats: PoolStats, **kwargs):
+        super().__init__(**kwargs)
+        self.stats = stats
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.stats.acquire()
+        try:
+            response = await super().handle_async_request(request)
+        except Exception:
+            self.stats.errors += 1
+            self.stats.release()
+            raise
+        response.stream = _CountingAsyncStream(response.stream, self.stats)
+        return response
+
+
+def _http2_available(provider: str, config: PoolConfig) -> bool:
+    if not config.http2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        print(f"Warning: {provider.upper()}_HTTP2 is set but the 'h2' package is missing, using HTTP/1.1")
+        return False
+    return True
+
+
+class ProviderPool:
+    """
+    Pooled sync + async httpx clients for one provider, with utilization stats.
+    Transports (and their SSL contexts) are built on first use, i.e. inside the worker process.
+    """
+
+    def __init__(self, provider: str, config: Optional[PoolConfig] = None):
+        self.provider = provider
+        self.config = config or PoolConfig.from_env(provider)
+        self.sync_stats = PoolStats()
+        self.async_stats = PoolStats()
+        self._sync_transport: Optional[InstrumentedTransport] = None
+        self._async_transport: Optional[InstrumentedAsyncTransport] = None
+
+    def _transport(self, asynchronous: bool):
+        if asynchronous and self._async_transport is None:
+            self._async_transport = InstrumentedAsyncTransport(
+                self.async_stats, limits=self.config.limits, http2=_http2_available(self.provider, self.config)
+            )
+        if not asynchronous and self._sync_transport is None:
+            self._sync_transport = InstrumentedTransport(
+                self.sync_stats, limits=self.config.limits, http2=_http2_available(self.provider, self.config)
+            )
+        return self._async_transport if asynchronous else self._sync_transport
+
+    def client_kwargs(self, asynchronous: bool) -> Dict[str, Any]:
+        """Keyword arguments for an httpx client (or a provider SDK passing them through to one)."""
+        return {
+            "transport": self._transport(asynchronous),
+            "timeout": self.config.timeout,
+        }
+
+    async def aclose(self):
+        """Close pooled connections (graceful shutdown)."""
+        if self._async_transport is not None:
+            await self._async_transport.aclose()
+        if self._sync_transport is not None:
+            self._sync_transport.close()
+
+    def sync_client(self, **kwargs) -> httpx.Client:
+        return httpx.Client(**self.client_kwargs(asynchronous=False), **kwargs)
+
+    def async_client(self, **kwargs) -> httpx.AsyncClient:
+        return httpx.AsyncClient(**self.client_kwargs(asynchronous=True), **kwargs)
+
+    @staticmethod
+    def _connection_stats(transport) -> Dict[str, int]:
+        # httpcore does not expose pool state publicly, read it defensively (None = not built yet)
+        connections = getattr(getattr(transport, "_pool", None), "connections", None) or []
+        idle = sum(1 for conn in connections if conn.is_idle())
+        return {"open_connections": len(connections), "idle_connections": idle}
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {"config": self.config.as_dict()}
+        for name, transport, counters in (
+            ("sync", self._sync_transport, self.sync_stats),
+            ("async", self._async_transport, self.async_stats),
+        ):
+            stats[name] = {
+                **vars(counters),
+                **self._connection_stats(transport),
+                "utilization": counters.in_flight / self.config.max_connections,
+            }
+        return stats
@@ -0,0 +1,577 @@
+import asyncio
+import itertools
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+# -----------------------------
+# Job queue
+# -----------------------------
+# Long generation runs become jobs: a list of items (one generation each) persisted in a
+# store, worked off by a bounded JobWorker pool that can run outside the request-serving
+# processes. Workers claim items under a lease and renew it while the item runs. When a
+# worker dies its leases expire, and any worker (or its restart) claims those items again,
+# so a job resumes from its in-flight items instead of starting over. An item whose lease
+# ran out `max_attempts` times (it keeps crashing or outliving its worker) is failed with an
+# error result instead of being claimed again, so the job still finishes. Items are persisted
+# in chunks while they are enumerated, so submitting a large job stays memory-bounded.
+#
+# Job status: submitting -> queued -> running -> done, or cancelled at any point.
+# Item status: pending -> running -> done | failed (the generation failed) | cancelled.
+
+FINISHED_STATES = ("done", "cancelled")
+CLAIMABLE_STATES = ("submitting", "queued", "running")
+SUBMIT_CHUNK = 1000
+DEFAULT_MAX_ATTEMPTS = 3
+
+# claimed item: (job_id, index, payload, kind, settings)
+JobItem = Tuple[str, int, Dict[str, Any], str, Dict[str, Any]]
+
+
+def new_job_id() -> str:
+    return uuid.uuid4().hex
+
+
+def attempts_exhausted(idx: int, attempts: int) -> Dict[str, Any]:
+    """Result of an item given up on after `attempts` claims."""
+    detail = f"Item was claimed {attempts} times without finishing (worker crashed or lease expired)."
+    return {"index": idx, "error": {"status_code": 500, "detail": detail}}
+
+
+class SQLiteJobStore:
+    """
+    Single-host store. WAL mode and BEGIN IMMEDIATE claims let the API workers and any
+    number of worker processes share one file. Connections are opened on first use.
+    """
+
+    def __init__(self, path: str, retention: float = 7 * 86400.0, max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+        self.path = path
+        self.retention = retention
+        self.max_attempts = max_attempts
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=30.0, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, kind TEXT, settings TEXT, status TEXT, total INTEGER DEFAULT 0, "
+                "completed INTEGER DEFAULT 0, failed INTEGER DEFAULT 0, created_at REAL, finished_at REAL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_items ("
+                "job_id TEXT, idx INTEGER, payload TEXT, status TEXT, result TEXT, seq INTEGER, "
+                "lease_owner TEXT, lease_expires REAL, attempts INTEGER DEFAULT 0, PRIMARY KEY (job_id, idx))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_job_items_claim ON job_items (status, lease_expires)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_job_items_seq ON job_items (job_id, seq)")
+            self._conn = conn
+        return self._conn
+
+    @contextmanager
+    def _transaction(self):
+        # IMMEDIATE takes the write lock up front, so two processes never claim the same item
+        with self._lock:
+            conn = self.conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def _submit(self, job_id: str, kind: str, settings: Dict[str, Any], items: Iterable[Dict[str, Any]]) -> int:
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, settings, status, created_at) VALUES (?, ?, ?, 'submitting', ?)",
+                (job_id, kind, json.dumps(settings), time.time()),
+            )
+        total = 0
+        items = iter(items)
+        while True:
+            chunk = [(job_id, total + i, json.dumps(item)) for i, item in enumerate(itertools.islice(items, SUBMIT_CHUNK))]
+            if not chunk:
+                break
+            with self._transaction() as conn:
+                conn.executemany("INSERT INTO job_items (job_id, idx, payload, status) VALUES (?, ?, ?, 'pending')", chunk)
+            total += len(chunk)
+        with self._transaction() as conn:
+            # Items may already be done, and the job may have been cancelled meanwhile
+            conn.execute("UPDATE jobs SET total = ? WHERE id = ?", (total, job_id))
+            conn.execute(
+                "UPDATE jobs SET status = CASE WHEN completed >= total THEN 'done' "
+                "WHEN completed > 0 THEN 'running' ELSE 'queued' END, "
+                "finished_at = CASE WHEN completed >= total THEN ? ELSE NULL END "
+                "WHERE id = ? AND status = 'submitting'",
+                (time.time(), job_id),
+            )
+        return total
+
+    def _claim(self, worker_id: str, limit: int, lease: float) -> List[JobItem]:
+        now = time.time()
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT i.job_id, i.idx, i.payload, j.kind, j.settings, i.attempts "
+                "FROM job_items i JOIN jobs j ON j.id = i.job_id "
+                f"WHERE j.status IN ({', '.join('?' * len(CLAIMABLE_STATES))}) "
+                "AND (i.status = 'pending' OR (i.status = 'running' AND i.lease_expires < ?)) "
+                "ORDER BY j.created_at, i.idx LIMIT ?",
+                (*CLAIMABLE_STATES, now, limit),
+            ).fetchall()
+            for job_id, idx, _, _, _, attempts in rows:
+                if attempts >= self.max_attempts:
+                    self._record_result(conn, job_id, idx, attempts_exhausted(idx, attempts), failed=True)
+            rows = [row[:5] for row in rows if row[5] < self.max_attempts]
+            conn.executemany(
+                "UPDATE job_items SET status = 'running', lease_owner = ?, lease_expires = ?, attempts = attempts + 1 "
+                "WHERE job_id = ? AND idx = ?",
+                [(worker_id, now + lease, job_id, idx) for job_id, idx, _, _, _ in rows],
+            )
+            conn.executemany(
+                "UPDATE jobs SET status = 'running' WHERE id = ? AND status = 'queued'",
+                [(job_id,) for job_id in {row[0] for row in rows}],
+            )
+        return [(job_id, idx, json.loads(payload), kind, json.loads(settings))
+                for job_id, idx, payload, kind, settings in rows]
+
+    def _renew(self, worker_id: str, keys: List[Tuple[str, int]], lease: float) -> Set[str]:
+        with self._transaction() as conn:
+            conn.executemany(
+                "UPDATE job_items SET lease_expires = ? WHERE job_id = ? AND idx = ? AND lease_owner = ? AND status = 'running'",
+                [(time.time() + lease, job_id, idx, worker_id) for job_id, idx in keys],
+            )
+            job_ids = sorted({job_id for job_id, _ in keys})
+            if not job_ids:
+                return set()
+            rows = conn.execute(
+                f"SELECT id FROM jobs WHERE status = 'cancelled' AND id IN ({', '.join('?' * len(job_ids))})", job_ids
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def _record_result(self, conn: sqlite3.Connection, job_id: str, idx: int, result: Dict[str, Any], failed: bool,
+                       worker_id: Optional[str] = None) -> bool:
+        """Store an item's result and count it, within a transaction. With `worker_id`, only if it holds the lease."""
+        owner = " AND status = 'running' AND lease_owner = ?" if worker_id is not None else ""
+        updated = conn.execute(
+            "UPDATE job_items SET status = ?, result = ?, lease_owner = NULL, "
+            "seq = (SELECT completed FROM jobs WHERE id = ?) "
+            "WHERE job_id = ? AND idx = ?" + owner,
+            ("failed" if failed else "done", json.dumps(result), job_id, job_id, idx,
+             *((worker_id,) if worker_id is not None else ())),
+        ).rowcount
+        if not updated:
+            return False
+        conn.execute(
+            "UPDATE jobs SET completed = completed + 1, failed = failed + ? WHERE id = ?", (int(failed), job_id)
+        )
+        conn.execute(
+            "UPDATE jobs SET status = 'done', finished_at = ? WHERE id = ? AND status IN ('queued', 'running') "
+            "AND completed >= total",
+            (time.time(), job_id),
+        )
+        return True
+
+    def _complete(self, worker_id: str, job_id: str, idx: int, result: Dict[str, Any], failed: bool) -> bool:
+        with self._transaction() as conn:
+            # False if the lease was lost to another worker, or the job was cancelled
+            return self._record_result(conn, job_id, idx, result, failed, worker_id)
+
+    def _release(self, worker_id: str, keys: List[Tuple[str, int]]):
+        with self._transaction() as conn:
+            # A handed back item did not use up an attempt
+            conn.executemany(
+                "UPDATE job_items SET status = 'pending', lease_owner = NULL, attempts = attempts - 1 "
+                "WHERE job_id = ? AND idx = ? AND lease_owner = ? AND status = 'running'",
+                [(job_id, idx, worker_id) for job_id, idx in keys],
+            )
+
+    def _cancel(self, job_id: str) -> bool:
+        with self._transaction() as conn:
+            updated = conn.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status NOT IN ('done', 'cancelled')",
+                (time.time(), job_id),
+            ).rowcount
+            if updated:
+                conn.execute(
+                    "UPDATE job_items SET status = 'cancelled', lease_owner = NULL "
+                    "WHERE job_id = ? AND status IN ('pending', 'running')",
+                    (job_id,),
+                )
+        return bool(updated)
+
+    def _progress(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT id, kind, status, total, completed, failed, created_at, finished_at FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("job_id", "kind", "status", "total", "completed", "failed", "created_at", "finished_at"), row))
+
+    def _results(self, job_id: str, start: int, limit: int) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT result FROM job_items WHERE job_id = ? AND seq >= ? ORDER BY seq LIMIT ?",
+                (job_id, start, limit),
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def _purge(self) -> int:
+        cutoff = time.time() - self.retention
+        with self._transaction() as conn:
+            job_ids = [row[0] for row in conn.execute(
+                "SELECT id FROM jobs WHERE status IN ('done', 'cancelled') AND finished_at < ?", (cutoff,)
+            ).fetchall()]
+            conn.executemany("DELETE FROM job_items WHERE job_id = ?", [(job_id,) for job_id in job_ids])
+            conn.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in job_ids])
+        return len(job_ids)
+
+    def _counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self.conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
+
+    async def submit(self, kind: str, settings: Dict[str, Any], items: Iterable[Dict[str, Any]],
+                     job_id: Optional[str] = None) -> str:
+        job_id = job_id or new_job_id()
+        await asyncio.to_thread(self._submit, job_id, kind, settings, items)
+        return job_id
+
+    async def claim(self, worker_id: str, limit: int, lease: float) -> List[JobItem]:
+        return await asyncio.to_thread(self._claim, worker_id, limit, lease)
+
+    async def renew(self, worker_id: str, keys: List[Tuple[str, int]], lease: float) -> Set[str]:
+        """Extend the worker's leases; returns the ids of cancelled jobs among them."""
+        return await asyncio.to_thread(self._renew, worker_id, keys, lease)
+
+    async def complete(self, worker_id: str, job_id: str, idx: int, result: Dict[str, Any], failed: bool) -> bool:
+        return await asyncio.to_thread(self._complete, worker_id, job_id, idx, result, failed)
+
+    async def release(self, worker_id: str, keys: List[Tuple[str, int]]):
+        """Hand unfinished items back right away (graceful shutdown) instead of waiting for the lease."""
+        await asyncio.to_thread(self._release, worker_id, keys)
+
+    async def cancel(self, job_id: str) -> bool:
+        return await asyncio.to_thread(self._cancel, job_id)
+
+    async def progress(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self._progress, job_id)
+
+    async def results(self, job_id: str, start: int = 0, limit: int = 1000) -> List[Dict[str, Any]]:
+        """Item results in completion order, from position `start`."""
+        return await asyncio.to_thread(self._results, job_id, start, limit)
+
+    async def purge(self) -> int:
+        """Delete jobs finished longer than `retention` seconds ago."""
+        return await asyncio.to_thread(self._purge)
+
+    async def stats(self) -> Dict[str, Any]:
+        return {"backend": "sqlite", "path": self.path, "jobs": await asyncio.to_thread(self._counts)}
+
+
+class RedisJobStore:
+    """
+    Store shared by several hosts. Pending items wait in a list, claimed ones move
+    atomically (LMOVE) to a processing list and get a lease key with a TTL. Items in
+    processing whose lease key is gone for two sweeps in a row are put back in front of
+    the queue; a done flag per item keeps a resumed item from being counted twice.
+    """
+
+    def __init__(self, url: str, retention: float = 7 * 86400.0, prefix: str = "patterns:jobs:",
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+        try:
+            import redis.asyncio as aioredis
+        except ImportError as e:
+            raise RuntimeError("JOB_STORE_BACKEND=redis requires the 'redis' package") from e
+        self.retention = retention
+        self.max_attempts = max_attempts
+        self.prefix = prefix
+        self._redis = aioredis.Redis.from_url(url, decode_responses=True)
+        self._suspects: Set[str] = set()
+
+    def _key(self, *parts: Any) -> str:
+        return self.prefix + ":".join(str(part) for part in parts)
+
+    async def submit(self, kind: str, settings: Dict[str, Any], items: Iterable[Dict[str, Any]],
+                     job_id: Optional[str] = None) -> str:
+        job_id = job_id or new_job_id()
+        job_key = self._key("job", job_id)
+        await self._redis.hset(job_key, mapping={
+            "kind": kind, "settings": json.dumps(settings), "status": "submitting",
+            "total": 0, "completed": 0, "failed": 0, "created_at": time.time(),
+        })
+        total = 0
+        items = iter(items)
+        while True:
+            chunk = list(itertools.islice(items, SUBMIT_CHUNK))
+            if not chunk:
+                break
+            pipe = self._redis.pipeline(transaction=False)
+            pipe.hset(self._key("job", job_id, "items"), mapping={total + i: json.dumps(item) for i, item in enumerate(chunk)})
+            pipe.rpush(self._key("queue"), *(f"{job_id}:{total + i}" for i in range(len(chunk))))
+            await pipe.execute()
+            total += len(chunk)
+        await self._redis.hset(job_key, "total", total)
+        if await self._redis.hget(job_key, "status") == "submitting":
+            await self._redis.hset(job_key, "status", "queued")
+            # Completions before the status change did not finish the job, completions after it can
+            if int(await self._redis.hget(job_key, "completed") or 0) >= total:
+                await self._finish(job_id, "done")
+        return job_id
+
+    async def _finish(self, job_id: str, status: str):
+        await self._redis.hset(self._key("job", job_id), mapping={"status": status, "finished_at": time.time()})
+        ttl = max(1, int(self.retention))
+        for suffix in ((), ("items",), ("results",), ("done",), ("attempts",)):
+            await self._redis.expire(self._key("job", job_id, *suffix), ttl)
+
+    async def _requeue_expired(self):
+        processing = await self._redis.lrange(self._key("processing"), 0, -1)
+        orphans = set()
+        for member in processing:
+            if not await self._redis.exists(self._key("lease", member)):
+                orphans.add(member)
+        # Only members seen without a lease twice: a claimer may be between LMOVE and SET
+        for member in orphans & self._suspects:
+            if await self._redis.lrem(self._key("processing"), 1, member):
+                await self._redis.lpush(self._key("queue"), member)
+        self._suspects = orphans
+
+    async def claim(self, worker_id: str, limit: int, lease: float) -> List[JobItem]:
+        await self._requeue_expired()
+        claimed: List[JobItem] = []
+        settings_cache: Dict[str, Tuple[str, str, Dict[str, Any]]] = {}
+        while len(claimed) < limit:
+            member = await self._redis.lmove(self._key("queue"), self._key("processing"), "LEFT", "RIGHT")
+            if member is None:
+                break
+            job_id, idx = member.rsplit(":", 1)
+            if job_id not in settings_cache:
+                status, kind, settings = await self._redis.hmget(self._key("job", job_id), "status", "kind", "settings")
+                settings_cache[job_id] = (status, kind, json.loads(settings) if settings else {})
+            status, kind, settings = settings_cache[job_id]
+            if status not in CLAIMABLE_STATES:
+                await self._redis.lrem(self._key("processing"), 1, member)
+                continue
+            attempts = await self._redis.hincrby(self._key("job", job_id, "attempts"), idx, 1)
+            if attempts > self.max_attempts:
+                await self._redis.lrem(self._key("processing"), 1, member)
+                await self._record_result(job_id, int(idx), attempts_exhausted(int(idx), attempts - 1), failed=True)
+                continue
+            await self._redis.set(self._key("lease", member), worker_id, px=int(lease * 1000))
+            payload = await self._redis.hget(self._key("job", job_id, "items"), idx)
+            if status == "queued":
+                await self._redis.hset(self._key("job", job_id), "status", "running")
+            claimed.append((job_id, int(idx), json.loads(payload), kind, settings))
+        return claimed
+
+    async def renew(self, worker_id: str, keys: List[Tuple[str, int]], lease: float) -> Set[str]:
+        for job_id, idx in keys:
+            await self._redis.set(self._key("lease", f"{job_id}:{idx}"), worker_id, px=int(lease * 1000), xx=True)
+        cancelled = set()
+        for job_id in {job_id for job_id, _ in keys}:
+            if await self._redis.hget(self._key("job", job_id), "status") == "cancelled":
+                cancelled.add(job_id)
+        return cancelled
+
+    async def complete(self, worker_id: str, job_id: str, idx: int, result: Dict[str, Any], failed: bool) -> bool:
+        member = f"{job_id}:{idx}"
+        await self._redis.lrem(self._key("processing"), 1, member)
+        await self._redis.delete(self._key("lease", member))
+        return await self._record_result(job_id, idx, result, failed)
+
+    async def _record_result(self, job_id: str, idx: int, result: Dict[str, Any], failed: bool) -> bool:
+        job_key = self._key("job", job_id)
+        if await self._redis.hget(job_key, "status") == "cancelled":
+            return False
+        if not await self._redis.hsetnx(self._key("job", job_id, "done"), idx, 1):
+            return False
+        pipe = self._redis.pipeline(transaction=True)
+        pipe.rpush(self._key("job", job_id, "results"), json.dumps(result))
+        pipe.hincrby(job_key, "completed", 1)
+        pipe.hincrby(job_key, "failed", int(failed))
+        pipe.hmget(job_key, "status", "total")
+        _, completed, _, (status, total) = await pipe.execute()
+        if status in ("queued", "running") and completed >= int(total):
+            await self._finish(job_id, "done")
+        return True
+
+    async def release(self, worker_id: str, keys: List[Tuple[str, int]]):
+        for job_id, idx in keys:
+            member = f"{job_id}:{idx}"
+            if await self._redis.lrem(self._key("processing"), 1, member):
+                await self._redis.delete(self._key("lease", member))
+                # A handed back item did not use up an attempt
+                await self._redis.hincrby(self._key("job", job_id, "attempts"), idx, -1)
+                await self._redis.lpush(self._key("queue"), member)
+
+    async def cancel(self, job_id: str) -> bool:
+        status = await self._redis.hget(self._key("job", job_id), "status")
+        if status is None or status in FINISHED_STATES:
+            return False
+        # Queued items of the job are dropped when they are claimed
+        await self._finish(job_id, "cancelled")
+        return True
+
+    async def progress(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = await self._redis.hgetall(self._key("job", job_id))
+        if not job:
+            return None
+        return {
+            "job_id": job_id,
+            "kind": job.get("kind"),
+            "status": job.get("status"),
+            "total": int(job.get("total", 0)),
+            "completed": int(job.get("completed", 0)),
+            "failed": int(job.get("failed", 0)),
+            "created_at": float(job["created_at"]) if job.get("created_at") else None,
+            "finished_at": float(job["finished_at"]) if job.get("finished_at") else None,
+        }
+
+    async def results(self, job_id: str, start: int = 0, limit: int = 1000) -> List[Dict[str, Any]]:
+        rows = await self._redis.lrange(self._key("job", job_id, "results"), start, start + limit - 1)
+        return [json.loads(row) for row in rows]
+
+    async def purge(self) -> int:
+        # Finished jobs expire via TTL
+        return 0
+
+    async def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "redis",
+            "queued_items": await self._redis.llen(self._key("queue")),
+            "processing_items": await self._redis.llen(self._key("processing")),
+        }
+
+
+def build_job_store(backend: str, path: str, redis_url: Optional[str], retention: float,
+                    max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+    if backend in ("off", "none", ""):
+        return None
+    if backend == "redis":
+        if not redis_url:
+            raise RuntimeError("JOB_STORE_BACKEND=redis requires REDIS_URL")
+        return RedisJobStore(redis_url, retention=retention, max_attempts=max_attempts)
+    return SQLiteJobStore(path, retention=retention, max_attempts=max_attempts)
+
+
+# -----------------------------
+# Worker pool
+# -----------------------------
+
+class JobWorker:
+    """
+    Runs up to `concurrency` job items at a time. `handlers` maps a job kind to
+    handler(index, payload, settings) -> result dict; a result with a non-null "error"
+    counts as failed.
+    """
+
+    def __init__(
+        self,
+        store: Any,
+        handlers: Dict[str, Callable[[int, Dict[str, Any], Dict[str, Any]], Awaitable[Dict[str, Any]]]],
+        concurrency: int = 8,
+        lease: float = 60.0,
+        poll_interval: float = 0.5,
+    ):
+        self.store = store
+        self.handlers = handlers
+        self.concurrency = concurrency
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._running: Dict[Tuple[str, int], asyncio.Task] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.completed = 0
+        self.failed = 0
+        self.lost = 0
+
+    async def _run_item(self, item: JobItem):
+        job_id, idx, payload, kind, settings = item
+        handler = self.handlers.get(kind)
+        if handler is None:
+            result = {"index": idx, "error": {"status_code": 500, "detail": f"Unknown job kind: {kind}"}}
+        else:
+            try:
+                result = await handler(idx, payload, settings)
+            except Exception as e:
+                result = {"index": idx, "error": {"status_code": 500, "detail": str(e)}}
+        failed = result.get("error") is not None
+        if await self.store.complete(self.worker_id, job_id, idx, result, failed):
+            self.completed += 1
+            self.failed += failed
+        else:
+            self.lost += 1
+
+    async def run(self):
+        """Claim and run items until cancelled; unfinished items are released on the way out."""
+        last_renewal = time.monotonic()
+        try:
+            while True:
+                try:
+                    if time.monotonic() - last_renewal >= self.lease / 3:
+                        last_renewal = time.monotonic()
+                        cancelled = await self.store.renew(self.worker_id, list(self._running), self.lease)
+                        for key, task in list(self._running.items()):
+                            if key[0] in cancelled:
+                                task.cancel()
+                    free = self.concurrency - len(self._running)
+                    claimed = await self.store.claim(self.worker_id, free, self.lease) if free > 0 else []
+                except Exception as e:
+                    print(f"Warning: job store unavailable: {e}")
+                    claimed = []
+                for item in claimed:
+                    key = (item[0], item[1])
+                    task = asyncio.ensure_future(self._run_item(item))
+                    self._running[key] = task
+                    task.add_done_callback(lambda _, key=key: self._running.pop(key, None))
+                if self._running and (claimed or len(self._running) >= self.concurrency):
+                    await asyncio.wait(list(self._running.values()), timeout=self.poll_interval,
+                                       return_when=asyncio.FIRST_COMPLETED)
+                elif not claimed:
+                    await asyncio.sleep(self.poll_interval)
+        finally:
+            keys = list(self._running)
+            for task in self._running.values():
+                task.cancel()
+            if keys:
+                try:
+                    await self.store.release(self.worker_id, keys)
+                except Exception as e:
+                    print(f"Warning: could not release {len(keys)} job items, they resume after their lease: {e}")
+
+    def start(self) -> asyncio.Task:
+        self._task = asyncio.ensure_future(self.run())
+        return self._task
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "worker_id": self.worker_id,
+            "running": self._task is not None and not self._task.done(),
+            "concurrency": self.concurrency,
+            "in_flight": len(self._running),
+            "completed": self.completed,
+            "failed": self.failed,
+            "lost_leases": self.lost,
+        }
@@ -0,0 +1,149 @@
+import io
+from collections import defaultdict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# -----------------------------
+# Ontology mining
+# -----------------------------
+# Indexes an uploaded ontology by the domain and range of its object properties and by
+# rdfs:subClassOf, then enumerates the pattern inputs with hash joins:
+#
+#   Pattern 1 (shortcut)  A -p-> B -r-> C   range(p) joined with domain(r) on B
+#   Pattern 2 (subclass)  A -p-> B, C ⊑ B    range(p) joined with the subclasses of B
+#
+# Every property probes one dict, so enumeration costs O(properties + output) instead
+# of the nested loops' O(properties²), and inputs are yielded lazily. After parsing,
+# only the index (labels, property signatures, subclass edges) is kept, not the graph.
+
+RDF_FORMATS = {
+    "turtle": "turtle", "ttl": "turtle",
+    "xml": "xml", "rdf": "xml", "owl": "xml", "rdf+xml": "xml",
+    "nt": "nt", "ntriples": "nt", "n3": "n3", "json-ld": "json-ld",
+}
+CONTENT_TYPES = {
+    "text/turtle": "turtle",
+    "application/x-turtle": "turtle",
+    "application/rdf+xml": "xml",
+    "application/owl+xml": "xml",
+    "application/n-triples": "nt",
+    "text/n3": "n3",
+    "application/ld+json": "json-ld",
+}
+PATTERNS = ("shortcut", "subclass")
+
+
+class OntologyParseError(ValueError):
+    pass
+
+
+def local_name(iri: str) -> str:
+    return iri.rstrip("/#").replace("#", "/").rsplit("/", 1)[-1]
+
+
+def detect_format(requested: Optional[str], content_type: Optional[str], data: bytes) -> str:
+    """rdflib parser name from the `format` parameter, the Content-Type, or the document's first byte."""
+    if requested:
+        try:
+            return RDF_FORMATS[requested.lower()]
+        except KeyError:
+            raise OntologyParseError(f"Unsupported format '{requested}', use one of: {', '.join(sorted(RDF_FORMATS))}")
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    if media_type in CONTENT_TYPES:
+        return CONTENT_TYPES[media_type]
+    return "xml" if data.lstrip()[:1] == b"<" else "turtle"
+
+
+class OntologyIndex:
+    """Named classes and object properties of an ontology, keyed for the pattern joins."""
+
+    def __init__(self):
+        self.labels: Dict[str, str] = {}
+        # (property, domain, range), one entry per declared domain/range combination
+        self.properties: List[Tuple[str, str, str]] = []
+        # domain -> [(property, range)]
+        self.by_domain: Dict[str, List[Tuple[str, str]]] = defaultdict(list)
+        # superclass -> direct subclasses
+        self.subclasses: Dict[str, List[str]] = defaultdict(list)
+
+    def label(self, iri: str) -> str:
+        return self.labels.get(iri) or local_name(iri)
+
+    def add_property(self, prop: str, domain: str, range_: str):
+        self.properties.append((prop, domain, range_))
+        self.by_domain[domain].append((prop, range_))
+
+    def add_subclass(self, subclass: str, superclass: str):
+        if subclass != superclass:
+            self.subclasses[superclass].append(subclass)
+
+    def count(self, pattern: str) -> int:
+        """Number of inputs the pattern enumerates, without enumerating them."""
+        joined = self.by_domain if pattern == "shortcut" else self.subclasses
+        return sum(len(joined.get(range_, ())) for _, _, range_ in self.properties)
+
+    def iter_inputs(self, pattern: str) -> Iterator[Dict[str, str]]:
+        """Input fields of the shortcut / subclass pattern requests for every chain, lazily."""
+        label = self.label
+        if pattern == "shortcut":
+            for prop, domain, range_ in self.properties:
+                for next_prop, next_range in self.by_domain.get(range_, ()):
+                    yield {"A_label": label(domain), "p_label": label(prop), "B_label": label(range_),
+                           "r_label": label(next_prop), "C_label": label(next_range)}
+        else:
+            for prop, domain, range_ in self.properties:
+                for subclass in self.subclasses.get(range_, ()):
+                    yield {"A_label": label(domain), "p_label": label(prop), "B_label": label(range_),
+                           "C_label": label(subclass)}
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "object_properties": len({prop for prop, _, _ in self.properties}),
+            "signatures": len(self.properties),
+            "subclass_axioms": sum(len(children) for children in self.subclasses.values()),
+            "labelled": len(self.labels),
+        }
+
+
+def parse_ontology(data: bytes, rdf_format: str) -> OntologyIndex:
+    """Parse an ontology document and index it. Requires rdflib; CPU bound, run it off the event loop."""
+    try:
+        import rdflib
+        from rdflib.namespace import OWL, RDF, RDFS
+    except ImportError as e:
+        raise RuntimeError(
+            "Ontology upload requires the 'rdflib' package: install the `ontology` extra "
+            "(`poetry install -E ontology`) or `pip install rdflib`"
+        ) from e
+
+    graph = rdflib.Graph()
+    try:
+        graph.parse(source=io.BytesIO(data), format=rdf_format)
+    except Exception as e:
+        raise OntologyParseError(f"Could not parse the ontology as {rdf_format}: {e}") from e
+
+    def named(nodes) -> List[str]:
+        # Anonymous class expressions (unions, restrictions) cannot be named in a prompt
+        return [str(node) for node in nodes if isinstance(node, rdflib.URIRef)]
+
+    index = OntologyIndex()
+    for prop in named(set(graph.subjects(RDF.type, OWL.ObjectProperty))):
+        node = rdflib.URIRef(prop)
+        ranges = named(graph.objects(node, RDFS.range))
+        for domain in named(graph.objects(node, RDFS.domain)):
+            for range_ in ranges:
+                index.add_property(prop, domain, range_)
+    for subclass, superclass in graph.subject_objects(RDFS.subClassOf):
+        if isinstance(subclass, rdflib.URIRef) and isinstance(superclass, rdflib.URIRef):
+            index.add_subclass(str(subclass), str(superclass))
+
+    # English labels win over untagged ones, which win over other languages
+    rank = {}
+    for subject, literal in graph.subject_objects(RDFS.label):
+        language = getattr(literal, "language", None)
+        score = 2 if language in ("en", "en-us", "en-gb") else 1 if not language else 0
+        key = str(subject)
+        if score > rank.get(key, -1):
+            rank[key] = score
+            index.labels[key] = str(literal).strip()
+    return index
+
@@ -0,0 +1,104 @@
+import json
+from string import Template
+from typing import Any, Dict, List, Optional
+
+# -----------------------------
+# Pattern specs
+# -----------------------------
+# A directory prompts/<n>_<pattern>/ with a pattern.json is a pattern. The spec names the
+# request's input fields (ontology labels), the response field holding the answer, and
+# how a few-shot example is written into the prompt (example.txt next to it, with the
+# input fields and ${answer}). Request, response and example models and the routes under
+# /generate/{pattern} are derived from it, so a new pattern is a new directory, no code:
+#
+#   {"name": "shortcut", "inputs": ["A_label", "p_label", "B_label", "r_label", "C_label"],
+#    "answer_field": "property_name", "answer_default": "UnknownProperty",
+#    "example_answer_field": "Property", "example_defaults": {"r_label": "..."}}
+
+
+class PatternSpecError(ValueError):
+    pass
+
+
+class PatternSpec:
+    def __init__(
+        self,
+        key: str,
+        name: str,
+        inputs: List[str],
+        answer_field: str,
+        answer_default: str = "",
+        example_answer_field: Optional[str] = None,
+        example_defaults: Optional[Dict[str, str]] = None,
+        example_template: Optional[str] = None,
+        description: str = "",
+    ):
+        # Directory name (the requests' pattern_name) and the short name used in routes
+        self.key = key
+        self.name = name
+        self.inputs = list(inputs)
+        self.answer_field = answer_field
+        # Used when the model's JSON lacks the answer field
+        self.answer_default = answer_default
+        # Field of the example library entries holding the answer (default: answer_field)
+        self.example_answer_field = example_answer_field or answer_field
+        # Written instead of empty example fields, which examples may leave out
+        self.example_defaults = dict(example_defaults or {})
+        self.example_template = Template(example_template.strip() if example_template else self.default_example())
+        self.description = description
+
+    @classmethod
+    def from_json(cls, key: str, raw: Dict[str, Any], example_template: Optional[str] = None) -> "PatternSpec":
+        if not isinstance(raw, dict):
+            raise PatternSpecError("pattern.json must hold an object")
+        inputs = raw.get("inputs")
+        if not inputs or not isinstance(inputs, list) or not all(isinstance(field, str) and field.isidentifier() for field in inputs):
+            raise PatternSpecError("`inputs` must be a non-empty list of field names")
+        example_defaults = raw.get("example_defaults") or {}
+        if not isinstance(example_defaults, dict) or set(example_defaults) - set(inputs):
+            raise PatternSpecError("`example_defaults` must map input fields to text")
+        answer_field = raw.get("answer_field")
+        if not isinstance(answer_field, str) or not answer_field.isidentifier():
+            raise PatternSpecError("`answer_field` must be a field name")
+        if answer_field in inputs or answer_field == "explanation":
+            raise PatternSpecError(f"`answer_field` {answer_field} clashes with another field")
+        return cls(
+            key=key,
+            name=raw.get("name") or key.split("_", 1)[-1],
+            inputs=inputs,
+            answer_field=answer_field,
+            answer_default=raw.get("answer_default", ""),
+            example_answer_field=raw.get("example_answer_field"),
+            example_defaults=example_defaults,
+            example_template=example_template,
+            description=raw.get("description", ""),
+        )
+
+    @property
+    def title(self) -> str:
+        """CamelCase name, the prefix of the pattern's model names."""
+        return "".join(part.capitalize() for part in self.name.split("_"))
+
+    @property
+    def signature(self) -> str:
+        """Identifies this version of the spec (models are rebuilt when it changes)."""
+        return json.dumps([
+            self.key, self.name, self.inputs, sorted(self.example_defaults), self.answer_field, self.example_answer_field
+        ])
+
+    def default_example(self) -> str:
+        return "Input:\n" + "\n".join(f"- {field}: ${{{field}}}" for field in self.inputs) + "\n\nAnswer: ${answer}\n---"
+
+    def format_example(self, example: Dict[str, Any]) -> str:
+        """One few-shot example as it goes into the prompt."""
+        values = {field: example.get(field) or self.example_defaults.get(field, "") for field in self.inputs}
+        return self.example_template.safe_substitute(values, answer=example.get(self.example_answer_field)).strip()
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "pattern_name": self.key,
+            "description": self.description,
+            "inputs": self.inputs,
+            "answer_field": self.answer_field,
+        }
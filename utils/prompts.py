@@ -0,0 +1,202 @@
+import json
+import os
+import threading
+from string import Template
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.examples import ExampleIndex
+from utils.patterns import PatternSpec, PatternSpecError
+from utils.structured_output import Validator, compile_schema
+
+# -----------------------------
+# Prompt registry
+# -----------------------------
+# Scans ./prompts/{pattern}/{provider}/{technique}.txt, ./prompts/{pattern}/output_schema.json,
+# ./prompts/{pattern}/pattern.json (+ example.txt, see utils/patterns.py) and
+# ./prompts/{pattern}/examples.jsonl once, keeping compiled templates, pattern specs, parsed,
+# pre-serialized and compiled (validator) schemas and few-shot example indexes in memory
+# so the request path does no disk I/O or JSON parsing. A background thread polls the
+# tree's mtimes and swaps in a fresh snapshot when something changes.
+#
+# A template may be split by a line `[user]`: the part above it is the system message,
+# identical for every request of the pattern (only ${output_schema} may appear in it),
+# and the part below is the per-request user message. Sending the shared part first lets
+# the provider reuse its cached prompt prefix across requests.
+
+SYSTEM_SPLIT = "\n[user]\n"
+SYSTEM_FIELDS = {"output_schema"}
+
+
+def split_template(path: str, content: str) -> Tuple[Optional[Template], Template]:
+    """(system part, user part) of a template file; (None, whole file) without a `[user]` line."""
+    system, separator, user = content.partition(SYSTEM_SPLIT)
+    if not separator:
+        return None, Template(content)
+    system_tpl = Template(system.strip())
+    fields = set(system_tpl.get_identifiers())
+    if fields - SYSTEM_FIELDS:
+        print(f"Warning: the system part of {path} uses per-request fields {sorted(fields - SYSTEM_FIELDS)}, "
+              "its prefix cannot be shared between requests")
+    return system_tpl, Template(user.lstrip("\n"))
+
+
+class PromptRegistry:
+    def __init__(self, root: str = "./prompts"):
+        self.root = root
+        self.reloads = 0
+        self._templates: Dict[Tuple[str, str, str], Template] = {}
+        self._system_templates: Dict[Tuple[str, str, str], Template] = {}
+        self._specs: Dict[str, PatternSpec] = {}
+        self._spec_names: Dict[str, str] = {}
+        self._schemas: Dict[str, Dict[str, Any]] = {}
+        self._schema_json: Dict[str, str] = {}
+        self._validators: Dict[str, Validator] = {}
+        self._examples: Dict[str, ExampleIndex] = {}
+        self._mtimes: Dict[str, float] = {}
+        self._stop = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
+        self.load()
+
+    def _scan_mtimes(self) -> Dict[str, float]:
+        mtimes = {}
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith((".txt", ".json", ".jsonl", ".npy")):
+                    path = os.path.join(dirpath, filename)
+                    try:
+                        mtimes[path] = os.stat(path).st_mtime
+                    except OSError:
+                        pass
+        return mtimes
+
+    def load(self):
+        """(Re)read the whole prompts tree and atomically replace the in-memory snapshot."""
+        mtimes = self._scan_mtimes()
+        templates, system_templates, schemas, schema_json, validators, examples = {}, {}, {}, {}, {}, {}
+        spec_json, example_templates = {}, {}
+
+        for path in mtimes:
+            rel = os.path.relpath(path, self.root).split(os.sep)
+            if len(rel) == 2 and rel[1] == "examples.jsonl":
+                try:
+                    examples[rel[0]] = ExampleIndex.from_file(path)
+                except Exception as e:
+                    print(f"Error reading few-shot examples for {rel[0]}: {e}")
+                continue
+            if not path.endswith((".txt", ".json")):
+                continue
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    content = f.read()
+            except Exception as e:
+                print(f"Error reading {path}: {e}")
+                continue
+
+            if len(rel) == 2 and rel[1] == "output_schema.json":
+                try:
+                    schema = json.loads(content)
+                except Exception as e:
+                    print(f"Error reading output schema for {rel[0]}: {e}")
+                    continue
+                schemas[rel[0]] = schema
+                schema_json[rel[0]] = json.dumps(schema)
+                validators[rel[0]] = compile_schema(schema)
+            elif len(rel) == 2 and rel[1] == "pattern.json":
+                spec_json[rel[0]] = content
+            elif len(rel) == 2 and rel[1] == "example.txt":
+                example_templates[rel[0]] = content
+            elif len(rel) == 3 and rel[2].endswith(".txt") and content:
+                pattern_name, provider, filename = rel
+                key = (pattern_name, provider, filename[:-len(".txt")])
+                system_tpl, templates[key] = split_template(path, content)
+                if system_tpl is not None:
+                    system_templates[key] = system_tpl
+
+        self._templates, self._schemas, self._schema_json = templates, schemas, schema_json
+        self._system_templates = system_templates
+        self._specs, self._spec_names = self._load_specs(spec_json, example_templates)
+        self._validators = validators
+        self._examples = examples
+        self._mtimes = mtimes
+        self.reloads += 1
+
+    @staticmethod
+    def _load_specs(spec_json: Dict[str, str], example_templates: Dict[str, str]):
+        specs, names = {}, {}
+        for key in sorted(spec_json):
+            try:
+                spec = PatternSpec.from_json(key, json.loads(spec_json[key]), example_templates.get(key))
+            except (ValueError, PatternSpecError) as e:
+                print(f"Error reading pattern spec for {key}: {e}")
+                continue
+            if spec.name in names:
+                print(f"Error reading pattern spec for {key}: name {spec.name} is taken by {names[spec.name]}")
+                continue
+            specs[key], names[spec.name] = spec, key
+        return specs, names
+
+    def pattern_spec(self, pattern: str) -> Optional[PatternSpec]:
+        """Spec by directory name (`1_shortcut`) or pattern name (`shortcut`)."""
+        return self._specs.get(pattern) or self._specs.get(self._spec_names.get(pattern, ""))
+
+    def pattern_specs(self) -> List[PatternSpec]:
+        return [self._specs[key] for key in sorted(self._specs)]
+
+    def template(self, pattern_name: str, provider: str, technique: str) -> Optional[Template]:
+        """The per-request (user) part of the template, the whole template if it is not split."""
+        return self._templates.get((pattern_name, provider, technique))
+
+    def system_template(self, pattern_name: str, provider: str, technique: str) -> Optional[Template]:
+        """The shared (system) part of the template, None if it is not split."""
+        return self._system_templates.get((pattern_name, provider, technique))
+
+    def schema(self, pattern_name: str) -> Optional[Dict[str, Any]]:
+        """Parsed output schema. Shared between requests, treat it as read-only."""
+        return self._schemas.get(pattern_name)
+
+    def validator(self, pattern_name: str) -> Optional[Validator]:
+        """Output schema compiled at load time, returns the list of violations of an answer."""
+        return self._validators.get(pattern_name)
+
+    def schema_json(self, pattern_name: str) -> str:
+        """Output schema serialized once at load time (`null` when the pattern has none)."""
+        return self._schema_json.get(pattern_name, "null")
+
+    def examples(self, pattern_name: str, query: Dict[str, Any], k: int) -> List[Dict[str, Any]]:
+        """The k library examples most similar to the query labels ([] without a library)."""
+        index = self._examples.get(pattern_name)
+        return index.top_k(query, k) if index is not None else []
+
+    def example_counts(self) -> Dict[str, int]:
+        return {pattern_name: len(index) for pattern_name, index in self._examples.items()}
+
+    def patterns(self):
+        return sorted(self._schemas.keys() | {key[0] for key in self._templates})
+
+    def check_for_changes(self) -> bool:
+        """Reload if any prompt file was added, removed or modified. Returns True on reload."""
+        if self._scan_mtimes() != self._mtimes:
+            self.load()
+            return True
+        return False
+
+    def start_watching(self, interval: float):
+        """Poll the prompts tree every `interval` seconds in a daemon thread."""
+        if interval <= 0 or self._watcher is not None:
+            return
+
+        def watch():
+            while not self._stop.wait(interval):
+                try:
+                    if self.check_for_changes():
+                        print(f"Prompt registry reloaded from {self.root}", flush=True)
+                except Exception as e:
+                    print(f"Warning: prompt registry reload failed: {e}")
+
+        self._stop.clear()
+        self._watcher = threading.Thread(target=watch, name="prompt-registry-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        self._stop.set()
+        self._watcher = None
@@ -0,0 +1,127 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+# -----------------------------
+# Session hand-off store
+# -----------------------------
+# Backs /_temp_localstorage_data: one client stores a payload under a uuid, another
+# fetches it once. Payloads are kept as JSON text (never decoded server-side), expire
+# after a TTL and are bounded in bytes. The first write for a uuid wins and a read
+# removes the entry, as before. Readers wait until the payload arrives instead of
+# sleeping for a fixed time.
+
+
+class PayloadTooLarge(Exception):
+    pass
+
+
+class MemorySessionStore:
+    """Per-process store with TTL and total size cap (oldest entries are evicted first)."""
+
+    def __init__(self, ttl: float = 300.0, max_bytes: int = 64 * 1024 * 1024, max_entry_bytes: int = 16 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._arrived: Dict[str, asyncio.Event] = {}
+        self.evictions = 0
+
+    def _drop(self, uuid: str) -> Optional[str]:
+        _, size, payload = self._entries.pop(uuid)
+        self._bytes -= size
+        return payload
+
+    def _purge_expired(self):
+        now = time.monotonic()
+        while self._entries:
+            uuid, (expires_at, _, _) = next(iter(self._entries.items()))
+            if expires_at > now:
+                break
+            self._drop(uuid)
+            self.evictions += 1
+
+    async def put(self, uuid: str, payload: str):
+        size = len(payload.encode("utf-8"))
+        if size > self.max_entry_bytes:
+            raise PayloadTooLarge(f"Payload exceeds {self.max_entry_bytes} bytes")
+        self._purge_expired()
+        if uuid in self._entries:
+            return
+        self._entries[uuid] = (time.monotonic() + self.ttl, size, payload)
+        self._bytes += size
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+        if uuid in self._arrived:
+            self._arrived[uuid].set()
+
+    def _take(self, uuid: str) -> Optional[str]:
+        entry = self._entries.get(uuid)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            self._drop(uuid)
+            self.evictions += 1
+            return None
+        return self._drop(uuid)
+
+    async def take(self, uuid: str, wait: float = 0.0) -> Optional[str]:
+        """Remove and return the payload, waiting up to `wait` seconds for it to be stored."""
+        payload = self._take(uuid)
+        if payload is not None or wait <= 0:
+            return payload
+        event = self._arrived.setdefault(uuid, asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), timeout=wait)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self._arrived.pop(uuid, None)
+        return self._take(uuid)
+
+    def stats(self):
+        return {"backend": "memory", "entries": len(self._entries), "bytes": self._bytes, "evictions": self.evictions}
+
+
+class RedisSessionStore:
+    """Store shared by all workers; entries expire via Redis TTL."""
+
+    def __init__(self, url: str, ttl: float = 300.0, max_entry_bytes: int = 16 * 1024 * 1024,
+                 prefix: str = "patterns:session:", poll_interval: float = 0.1):
+        try:
+            import redis.asyncio as aioredis
+        except ImportError as e:
+            raise RuntimeError("SESSION_STORE_BACKEND=redis requires the 'redis' package") from e
+        self.ttl = ttl
+        self.max_entry_bytes = max_entry_bytes
+        self.prefix = prefix
+        self.poll_interval = poll_interval
+        self._redis = aioredis.Redis.from_url(url, decode_responses=True)
+
+    async def put(self, uuid: str, payload: str):
+        if len(payload.encode("utf-8")) > self.max_entry_bytes:
+            raise PayloadTooLarge(f"Payload exceeds {self.max_entry_bytes} bytes")
+        # NX keeps the first write, like the in-memory store
+        await self._redis.set(self.prefix + uuid, payload, ex=max(1, int(self.ttl)), nx=True)
+
+    async def take(self, uuid: str, wait: float = 0.0) -> Optional[str]:
+        deadline = time.monotonic() + wait
+        while True:
+            payload = await self._redis.getdel(self.prefix + uuid)
+            if payload is not None or time.monotonic() >= deadline:
+                return payload
+            await asyncio.sleep(self.poll_interval)
+
+    def stats(self):
+        return {"backend": "redis"}
+
+
+def build_session_store(backend: str, ttl: float, max_bytes: int, max_entry_bytes: int, redis_url: Optional[str]):
+    if backend == "redis":
+        if not redis_url:
+            raise RuntimeError("SESSION_STORE_BACKEND=redis requires REDIS_URL")
+        return RedisSessionStore(redis_url, ttl=ttl, max_entry_bytes=max_entry_bytes)
+    return MemorySessionStore(ttl=ttl, max_bytes=max_bytes, max_entry_bytes=max_entry_bytes)
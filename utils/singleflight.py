@@ -0,0 +1,56 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+# -----------------------------
+# Request coalescing (single-flight)
+# -----------------------------
+# Concurrent callers with the same key share one in-flight provider call instead of
+# each starting their own. The call runs as its own task, so a caller that goes away
+# (client disconnect, losing hedged call) does not cancel it for the others; it is only
+# cancelled when the last caller goes away.
+
+
+class SingleFlight:
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[str, int] = {}
+        self.calls = 0
+        self.deduplicated = 0
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+            del self._waiters[key]
+        if not task.cancelled():
+            task.exception()  # mark as retrieved, the waiters already got it
+
+    async def do(self, key: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """Await `call()`, or the identical call already in flight for `key`."""
+        task = self._inflight.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(call())
+            self._inflight[key] = task
+            self._waiters[key] = 0
+            task.add_done_callback(lambda done, key=key: self._forget(key, done))
+        else:
+            self.deduplicated += 1
+
+        self._waiters[key] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            if key in self._waiters and self._inflight.get(key) is task:
+                self._waiters[key] -= 1
+                if not self._waiters[key] and not task.done():
+                    task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.calls + self.deduplicated
+        return {
+            "provider_calls": self.calls,
+            "deduplicated": self.deduplicated,
+            "saved_ratio": self.deduplicated / total if total else 0.0,
+            # short key prefix -> callers currently waiting on that call
+            "in_flight": {key[:12]: waiters for key, waiters in self._waiters.items()},
+        }
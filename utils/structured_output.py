@@ -0,0 +1,280 @@
+import ast
+import json
+import re
+from string import Template
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from utils import fast_json
+
+# -----------------------------
+# Structured output
+# -----------------------------
+# Pulls the JSON answer out of an LLM completion and checks it against the pattern's
+# output schema. The extractor is incremental: it is fed chunks as they stream in and
+# reports the first balanced top-level object as soon as its closing brace arrives,
+# regardless of code fences or prose around it. Schemas are compiled once into plain
+# Python checks. Answers that still fail get one repair attempt: cheap local fixes
+# first, a re-ask of the provider (REPAIR_PROMPT) last.
+
+Validator = Callable[[Any], List[str]]
+
+
+class StructuredOutputError(Exception):
+    """The completion holds no JSON object matching the schema; `errors` says why."""
+
+    def __init__(self, message: str, errors: Optional[List[str]] = None):
+        super().__init__(message)
+        self.errors = errors or [message]
+
+
+class JsonObjectExtractor:
+    """Finds balanced `{...}` spans in streamed text, respecting JSON strings and escapes."""
+
+    def __init__(self):
+        self.buffer: List[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._start: Optional[int] = None
+        self._length = 0
+        self.objects: List[str] = []
+
+    def feed(self, chunk: str) -> Optional[str]:
+        """Consume a chunk; returns the text of an object completed in it (the first one, if several)."""
+        completed = None
+        for char in chunk:
+            self.buffer.append(char)
+            self._length += 1
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif self._depth == 0:
+                if char == "{":
+                    self._depth = 1
+                    self._start = self._length - 1
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self.objects.append("".join(self.buffer[self._start:]))
+                    completed = completed or self.objects[-1]
+        return completed
+
+    @property
+    def partial(self) -> Optional[str]:
+        """Text of an object that was opened but not closed (e.g. a truncated answer)."""
+        if self._depth == 0 or self._start is None:
+            return None
+        return "".join(self.buffer[self._start:])
+
+    def close_partial(self) -> Optional[str]:
+        """The unfinished object with its open string and brackets closed, for a truncated answer."""
+        partial = self.partial
+        if partial is None:
+            return None
+        closers, in_string, escaped = [], False, False
+        for char in partial:
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif char == "\\":
+                    escaped = True
+                elif char == '"':
+                    in_string = False
+            elif char == '"':
+                in_string = True
+            elif char in "{[":
+                closers.append("}" if char == "{" else "]")
+            elif char in "}]" and closers:
+                closers.pop()
+        text = partial + ('"' if in_string else "")
+        return _strip_trailing_commas(text.rstrip().rstrip(",:")) + "".join(reversed(closers))
+
+
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+
+def _strip_trailing_commas(text: str) -> str:
+    # Outside strings only: split on string literals and fix the code in between
+    parts = re.split(r'("(?:[^"\\]|\\.)*")', text)
+    return "".join(part if i % 2 else _TRAILING_COMMA.sub(r"\1", part) for i, part in enumerate(parts))
+
+
+def _loads(text: str) -> Tuple[Any, bool]:
+    """Parsed value and whether the text needed fixing to parse."""
+    try:
+        return fast_json.loads(text), False
+    except json.JSONDecodeError:
+        pass
+    try:
+        return fast_json.loads(_strip_trailing_commas(text)), True
+    except json.JSONDecodeError:
+        pass
+    # Python dict syntax (single quotes, True/None)
+    try:
+        value = ast.literal_eval(text)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        raise StructuredOutputError("Answer contains no parsable JSON object.")
+    if not isinstance(value, dict):
+        raise StructuredOutputError("Answer contains no parsable JSON object.")
+    return value, True
+
+
+def parse_structured_output(text: str, validator: Optional[Validator] = None,
+                            extractor: Optional[JsonObjectExtractor] = None) -> Tuple[Dict[str, Any], bool]:
+    """
+    Return the first JSON object in `text` that parses and passes `validator`, and whether
+    it needed a local repair (trailing commas, Python syntax, truncation). `extractor` may
+    be one that already consumed `text` while it streamed.
+    """
+    if extractor is None:
+        extractor = JsonObjectExtractor()
+        extractor.feed(text)
+
+    errors: List[str] = []
+    candidates = [(candidate, False) for candidate in extractor.objects]
+    truncated = extractor.close_partial()
+    if truncated is not None:
+        candidates.append((truncated, True))
+    for candidate, repaired in candidates:
+        try:
+            value, fixed = _loads(candidate)
+        except StructuredOutputError as e:
+            errors.extend(e.errors)
+            continue
+        problems = validator(value) if validator is not None else []
+        if not problems:
+            return value, repaired or fixed
+        errors.extend(problems)
+
+    if not candidates:
+        raise StructuredOutputError("Answer contains no JSON object.")
+    raise StructuredOutputError("Answer does not match the output schema.", errors)
+
+
+REPAIR_PROMPT = Template("""$prompt
+
+Your previous answer was:
+$answer
+
+It could not be used: $problems
+Answer again with only a JSON object that matches the output schema, without any other text.""")
+
+
+def build_repair_prompt(prompt_text: str, raw_answer: str, errors: List[str]) -> str:
+    return REPAIR_PROMPT.substitute(prompt=prompt_text, answer=raw_answer.strip() or "(empty)",
+                                    problems="; ".join(dict.fromkeys(errors)))
+
+
+# -----------------------------
+# Schema compilation
+# -----------------------------
+# Covers the JSON Schema keywords the output schemas use (type, properties, required,
+# additionalProperties, items, enum, const, string/number/array bounds, pattern).
+
+_TYPE_CHECKS: Dict[str, Callable[[Any], bool]] = {
+    "object": lambda v: isinstance(v, dict),
+    "array": lambda v: isinstance(v, list),
+    "string": lambda v: isinstance(v, str),
+    "integer": lambda v: isinstance(v, int) and not isinstance(v, bool),
+    "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    "boolean": lambda v: isinstance(v, bool),
+    "null": lambda v: v is None,
+}
+
+
+def compile_schema(schema: Dict[str, Any]) -> Validator:
+    """Compile a JSON schema into a function returning the list of violations (empty if valid)."""
+    checks: List[Callable[[Any, str, List[str]], None]] = []
+
+    types = schema.get("type")
+    if types is not None:
+        type_names = [types] if isinstance(types, str) else list(types)
+        type_checks = [_TYPE_CHECKS[name] for name in type_names if name in _TYPE_CHECKS]
+
+        def check_type(value, path, errors):
+            if not any(check(value) for check in type_checks):
+                errors.append(f"{path} must be of type {' or '.join(type_names)}")
+        checks.append(check_type)
+
+    if "enum" in schema:
+        allowed = list(schema["enum"])
+
+        def check_enum(value, path, errors):
+            if value not in allowed:
+                errors.append(f"{path} must be one of {allowed}")
+        checks.append(check_enum)
+
+    if "const" in schema:
+        const = schema["const"]
+
+        def check_const(value, path, errors):
+            if value != const:
+                errors.append(f"{path} must be {const!r}")
+        checks.append(check_const)
+
+    required = list(schema.get("required", ()))
+    properties = {name: compile_schema(sub) for name, sub in schema.get("properties", {}).items()}
+    additional = schema.get("additionalProperties", True)
+    additional_validator = compile_schema(additional) if isinstance(additional, dict) else None
+    if required or properties or additional is not True:
+        def check_object(value, path, errors):
+            if not isinstance(value, dict):
+                return
+            for name in required:
+                if name not in value:
+                    errors.append(f"{path}.{name} is required")
+            for name, item in value.items():
+                validator = properties.get(name, additional_validator)
+                if validator is not None:
+                    errors.extend(validator(item, f"{path}.{name}"))
+                elif additional is False and name not in properties:
+                    errors.append(f"{path}.{name} is not allowed")
+        checks.append(check_object)
+
+    if "items" in schema and isinstance(schema["items"], dict):
+        item_validator = compile_schema(schema["items"])
+
+        def check_items(value, path, errors):
+            if isinstance(value, list):
+                for i, item in enumerate(value):
+                    errors.extend(item_validator(item, f"{path}[{i}]"))
+        checks.append(check_items)
+
+    bounds = [
+        ("minLength", str, len, lambda actual, bound: actual >= bound, "at least {} characters"),
+        ("maxLength", str, len, lambda actual, bound: actual <= bound, "at most {} characters"),
+        ("minItems", list, len, lambda actual, bound: actual >= bound, "at least {} items"),
+        ("maxItems", list, len, lambda actual, bound: actual <= bound, "at most {} items"),
+        ("minimum", (int, float), lambda v: v, lambda actual, bound: actual >= bound, ">= {}"),
+        ("maximum", (int, float), lambda v: v, lambda actual, bound: actual <= bound, "<= {}"),
+    ]
+    for keyword, kind, measure, ok, message in bounds:
+        if keyword in schema:
+            def check_bound(value, path, errors, bound=schema[keyword], kind=kind, measure=measure, ok=ok, message=message):
+                if isinstance(value, kind) and not isinstance(value, bool) and not ok(measure(value), bound):
+                    errors.append(f"{path} must be {message.format(bound)}")
+            checks.append(check_bound)
+
+    if "pattern" in schema:
+        pattern = re.compile(schema["pattern"])
+
+        def check_pattern(value, path, errors):
+            if isinstance(value, str) and not pattern.search(value):
+                errors.append(f"{path} must match {pattern.pattern}")
+        checks.append(check_pattern)
+
+    def validate(value: Any, path: str = "$") -> List[str]:
+        errors: List[str] = []
+        for check in checks:
+            check(value, path, errors)
+        return errors
+
+    return validate
@@ -1,52 +1,61 @@
-from huggingface_hub import InferenceClient
-import requests
-
-# -----------------------------
-# TGI Setup
-# -----------------------------
-tgi : object = None
-try:
-    res = requests.get("https://llm.vse.cz/tgi/info")
-    res.raise_for_status()
-    tgi = InferenceClient("https://llm.vse.cz/tgi")
-    print("Success connecting to Text Generation Inference API. Info:", res.json())
-except Exception as e:
-    print(f"Warning: Can't connect to Text Generation Inference API: {e}")
-
-# -----------------------------
-# Model routing Setup
-# -----------------------------
-# add at the end
-if tgi is not None:
-    model_provider_map = ["llama-3.1-8b-instruct(fp16)"] = "tgi"
-model_names = list(model_provider_map.keys())
-
-def call_tgi_chat(
-    model_name: str, #ignored param, declared to keep the interface consistent
-    prompt_text: str,
-    temperature: float,
-    top_p: float,
-    frequency_penalty: float,
-    presence_penalty: float,
-    response_type: object = None
-):
-    if not response_type:
-        raise ValueError("Missing response type for Text Generation Inference API Call.")
-    
-    try:
-        response = tgi.chat.completions.create(
-            model="tgi",
-            messages=[{"role": "user", "content": prompt_text}],
-            temperature=temperature if temperature else 0.7,
-            max_tokens=2000,
-            top_p=max(min(top_p, 0.99), 0.01),
-            frequency_penalty=frequency_penalty,
-            presence_penalty=presence_penalty
-            # tools=tools,
-            # tool_choice="auto"
-        )
-        data = response.choices[0].message.content.split().strip().replace("json","").replace("`","")
-        return data
-    except Exception as e:
-        print("err", e)
-        raise HTTPException(status_code=500, detail=f"Text Generation Inference API call failed: {e}")
\ No newline at end of file
+from typing import Any, Dict, Optional
+
+import httpx
+import openai
+
+from utils.engines import OpenAIEngine, chat_messages
+from utils.http_pool import ProviderPool
+
+# -----------------------------
+# TGI Setup
+# -----------------------------
+# Text Generation Inference exposes an OpenAI-compatible Messages API under /v1,
+# so the engine reuses OpenAIEngine with TGI's parameter quirks. A vLLM server can
+# be wired in the same way.
+
+TGI_MODEL_NAME = "llama-3.1-8b-instruct(fp16)"
+
+
+class TGIEngine(OpenAIEngine):
+    name = "tgi"
+    supports_n = False  # candidates are asked for as a list instead
+
+    def __init__(self, host: str, pool: ProviderPool, max_concurrency: int = 4):
+        base_url = host.rstrip("/") + "/v1"
+        super().__init__(
+            client_factory=lambda: openai.OpenAI(
+                base_url=base_url, api_key="-", http_client=pool.sync_client(), timeout=pool.config.timeout
+            ),
+            async_client_factory=lambda: openai.AsyncOpenAI(
+                base_url=base_url, api_key="-", http_client=pool.async_client(), timeout=pool.config.timeout,
+                max_retries=0
+            ),
+            max_concurrency=max_concurrency,
+        )
+        self.host = host
+
+    def stream_kwargs(self) -> Dict[str, Any]:
+        return {}
+
+    def completion_kwargs(self, data: Any, prompt_text: str) -> Dict[str, Any]:
+        return dict(
+            model="tgi",  # TGI serves a single model, the name is ignored
+            messages=chat_messages(data, prompt_text),
+            temperature=data.temperature if data.temperature else 0.7,
+            max_tokens=2000,
+            top_p=max(min(data.top_p, 0.99), 0.01),
+            frequency_penalty=data.frequency_penalty,
+            presence_penalty=data.presence_penalty
+        )
+
+
+async def probe_tgi(host: str, timeout: float = 5.0) -> Optional[Dict[str, Any]]:
+    """Return the TGI /info payload, or None when the server is unreachable."""
+    try:
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            res = await client.get(host.rstrip("/") + "/info")
+            res.raise_for_status()
+            return res.json()
+    except Exception as e:
+        print(f"Warning: Can't connect to Text Generation Inference API: {e}")
+        return None
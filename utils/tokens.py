@@ -0,0 +1,123 @@
+import json
+import math
+import threading
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# -----------------------------
+# Token accounting
+# -----------------------------
+# Prompt sizes per model, for the prompt token budget and Ollama's num_ctx. OpenAI models
+# are counted exactly with tiktoken (when installed). Other models (Llama & co. on Ollama
+# and TGI) have no local tokenizer here, so cl100k_base stands in for theirs with a safety
+# margin; without tiktoken every model falls back to a characters-per-token estimate.
+# tiktoken downloads its BPE files on first use, so encodings are loaded in a background
+# thread (`preload` at startup, or on a model's first count) and counts are estimated until
+# then. Counts are memoized: a prompt is counted for the budget and again for num_ctx, and
+# few-shot snippets repeat across requests.
+
+CHARS_PER_TOKEN = 3.5
+# Stand-in tokenizers undercount some models' vocabularies
+APPROXIMATE_MARGIN = 1.15
+
+
+def _load_tiktoken():
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    return tiktoken
+
+
+class TokenCounter:
+    def __init__(self, cache_size: int = 4096):
+        self._tiktoken = _load_tiktoken()
+        # Model name -> (encode, exact), or None where no encoding could be loaded
+        self._encoders: Dict[str, Optional[Tuple[Callable[[str], List[int]], bool]]] = {}
+        self._loading = set()
+        self._lock = threading.Lock()
+        self._count = lru_cache(maxsize=cache_size)(self._count_uncached)
+
+    @property
+    def backend(self) -> str:
+        return "tiktoken" if self._tiktoken is not None else "estimate"
+
+    def _load_encoder(self, model_name: str) -> Optional[Tuple[Callable[[str], List[int]], bool]]:
+        """(encode, exact) for the model, None without tiktoken."""
+        if self._tiktoken is None:
+            return None
+        try:
+            try:
+                encoding, exact = self._tiktoken.encoding_for_model(model_name), True
+            except KeyError:
+                encoding, exact = self._tiktoken.get_encoding("cl100k_base"), False
+        except Exception as e:
+            # The BPE files are downloaded on first use
+            print(f"Warning: no tokenizer for {model_name}, estimating its token counts: {e}")
+            return None
+        return encoding.encode_ordinary, exact
+
+    def _load(self, model_name: str):
+        try:
+            self._encoders[model_name] = self._load_encoder(model_name)
+        finally:
+            with self._lock:
+                self._loading.discard(model_name)
+
+    def preload(self, model_names: Iterable[str]):
+        """Load the encodings of `model_names` in the calling thread (blocking, may download)."""
+        for model_name in model_names:
+            if model_name not in self._encoders:
+                self._load(model_name)
+
+    def _load_in_background(self, model_name: str):
+        with self._lock:
+            if model_name in self._loading or self._tiktoken is None:
+                return
+            self._loading.add(model_name)
+        threading.Thread(target=self._load, args=(model_name,), daemon=True).start()
+
+    def _count_uncached(self, model_name: str, loaded: bool, text: str) -> int:
+        encoder = self._encoders.get(model_name) if loaded else None
+        if encoder is None:
+            return math.ceil(len(text) / CHARS_PER_TOKEN * APPROXIMATE_MARGIN)
+        encode, exact = encoder
+        tokens = len(encode(text))
+        return tokens if exact else math.ceil(tokens * APPROXIMATE_MARGIN)
+
+    def count(self, model_name: str, text: str) -> int:
+        """Tokens of `text` for the model (an upper estimate where its tokenizer is not available)."""
+        loaded = model_name in self._encoders
+        if not loaded:
+            self._load_in_background(model_name)
+        return self._count(model_name, loaded, text)
+
+    def stats(self) -> Dict[str, Any]:
+        info = self._count.cache_info()
+        return {
+            "backend": self.backend,
+            "hits": info.hits,
+            "misses": info.misses,
+            "size": info.currsize,
+            "encoders": sorted(name for name, encoder in self._encoders.items() if encoder is not None),
+        }
+
+
+def parse_model_budgets(raw: Optional[str]) -> Dict[str, int]:
+    """MODEL_PROMPT_TOKEN_BUDGETS: JSON object of model name -> prompt token budget."""
+    if not raw:
+        return {}
+    try:
+        return {model: int(budget) for model, budget in json.loads(raw).items()}
+    except (ValueError, TypeError, AttributeError) as e:
+        print(f"Warning: ignoring invalid MODEL_PROMPT_TOKEN_BUDGETS: {e}")
+        return {}
+
+
+def context_size(prompt_tokens: int, completion_tokens: int, minimum: int = 4096, maximum: int = 32768) -> int:
+    """
+    Smallest power-of-two context that holds prompt and answer, within [minimum, maximum].
+    Powers of two keep the number of distinct sizes (each one a model reload in Ollama) small.
+    """
+    needed = max(prompt_tokens + completion_tokens, minimum, 1)
+    return min(1 << (needed - 1).bit_length(), maximum)
@@ -0,0 +1,126 @@
+import asyncio
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# -----------------------------
+# Ollama model warm-up
+# -----------------------------
+# Loading a large model takes seconds, and Ollama unloads idle models after their
+# keep-alive (5 minutes by default), so the first request after a quiet period pays the
+# load. The warmer preloads the configured models at startup and then, every `interval`,
+# checks what is loaded (`ollama ps`). Models with traffic in the last `hot_window`
+# seconds that are unloaded, or would unload before the next check, get an empty-prompt
+# ping that loads them or extends their keep-alive. Idle models are left to expire, so
+# the VRAM goes to the models that are actually used.
+
+
+class OllamaWarmer:
+    def __init__(
+        self,
+        engine: Any,
+        models: Callable[[], List[str]],
+        interval: float = 60.0,
+        hot_window: float = 1800.0,
+        preload: bool = True,
+    ):
+        self.engine = engine
+        # Models to keep warm, re-read every round so discovered models are included
+        self.models = models
+        self.interval = interval
+        self.hot_window = hot_window
+        self.preload = preload
+        # model -> {"loaded", "expires_at", "size_vram"} as of the last check
+        self.state: Dict[str, Dict[str, Any]] = {}
+        self.last_check: Optional[float] = None
+        # (model, reason, outcome) -> count; reason is "startup" or "keepalive"
+        self.warmups: Dict[Tuple[str, str, str], int] = defaultdict(int)
+        self.load_seconds: Dict[str, float] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def warm(self, model_name: str, reason: str) -> bool:
+        try:
+            self.load_seconds[model_name] = await self.engine.warm(model_name)
+        except Exception as e:
+            print(f"Warning: warming up {model_name} failed: {e}")
+            self.warmups[(model_name, reason, "failed")] += 1
+            return False
+        self.warmups[(model_name, reason, "ok")] += 1
+        return True
+
+    async def refresh(self):
+        """Update the load state of the models from the Ollama host."""
+        loaded = await self.engine.loaded_models()
+        self.state = {
+            model: {"loaded": model in loaded, **loaded.get(model, {"expires_at": None, "size_vram": None})}
+            for model in self.models()
+        }
+        self.last_check = time.time()
+
+    def needs_ping(self, model_name: str, now: float) -> bool:
+        last_used = self.engine.last_used.get(model_name)
+        if last_used is None or now - last_used > self.hot_window:
+            return False
+        state = self.state.get(model_name, {})
+        expires_at = state.get("expires_at")
+        return not state.get("loaded") or (expires_at is not None and expires_at - now < 2 * self.interval)
+
+    async def run(self):
+        if self.preload:
+            # One at a time, parallel loads only compete for the same disk and VRAM
+            for model_name in self.models():
+                await self.warm(model_name, "startup")
+        while True:
+            try:
+                await self.refresh()
+                now = time.time()
+                for model_name in self.models():
+                    if self.needs_ping(model_name, now):
+                        await self.warm(model_name, "keepalive")
+            except Exception as e:
+                print(f"Warning: Ollama load state check failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> asyncio.Task:
+        self._task = asyncio.ensure_future(self.run())
+        return self._task
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "interval": self.interval,
+            "hot_window": self.hot_window,
+            "keep_alive": self.engine.keep_alive,
+            "last_check": self.last_check,
+            "models": {
+                model: {
+                    **self.state.get(model, {"loaded": None}),
+                    "last_used": self.engine.last_used.get(model),
+                    "cold_starts": self.engine.cold_starts.get(model, 0),
+                    "last_warmup_load_seconds": self.load_seconds.get(model),
+                }
+                for model in self.models()
+            },
+            "warmups": [
+                {"model": model, "reason": reason, "outcome": outcome, "count": count}
+                for (model, reason, outcome), count in sorted(self.warmups.items())
+            ],
+        }
+
+
+def parse_keep_alive(raw: Optional[str]):
+    """OLLAMA_KEEP_ALIVE: a duration ("30m", "2h") or seconds (-1 keeps models loaded), None if unset."""
+    if not raw:
+        return None
+    try:
+        return float(raw) if "." in raw else int(raw)
+    except ValueError:
+        return raw
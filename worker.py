@@ -0,0 +1,46 @@
+"""
+Standalone job worker: `python worker.py`.
+
+Works off the job queue (/jobs, /ontology/mine) outside the request-serving processes,
+sharing the API's job store (JOB_STORE_BACKEND / JOB_STORE_PATH / REDIS_URL), engines and
+prompts. This is how jobs are run: the API processes only queue them (unless
+JOB_WORKER_IN_PROCESS=true, meant for development). `./run` starts JOB_WORKERS of them next
+to the server; workers on other hosts or containers need JOB_STORE_BACKEND=redis.
+On SIGTERM/SIGINT unfinished items are handed back to the queue; after a crash they are
+resumed by any worker once their lease (JOB_LEASE_SECONDS) expires.
+"""
+
+import asyncio
+import signal
+
+from asgi import backend
+
+
+async def main():
+    if backend.job_worker is None:
+        # Not an error, ./run starts workers whether or not the queue is on
+        print("The job queue is disabled (JOB_STORE_BACKEND=off), no job worker needed.", flush=True)
+        return
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
+
+    backend.start_prompt_watcher()
+    await backend.register_optional_engines()
+    # Job traffic keeps its models warm too
+    backend.start_model_warmer()
+    worker = backend.job_worker
+    worker.start()
+    print(f"Job worker {worker.worker_id} running {worker.concurrency} items at a time", flush=True)
+    await stopping.wait()
+
+    await worker.stop()
+    await backend.stop_model_warmer()
+    backend.stop_prompt_watcher()
+    for pool in backend.provider_pools.values():
+        await pool.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())